@@ -1,9 +1,16 @@
 import os
+import struct
 import sys
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.abspath("bazel/bazel-bin/aes/"))
 
 import pybind_aes
 
+# Plaintext is read and encrypted in chunks of this many bytes when streaming
+stream_chunk_size = 1024 * 1024
+AES_BLOCK_SIZE = 16
+
+
 def encrypt_file(file_path: str, key: str = None):
     if key is None:
         key = pybind_aes.aes_key_generate()
@@ -15,3 +22,529 @@ def decrypt_file(in_file_path: str, out_file_path: str, key: str):
     return pybind_aes.aes_file_decrypt(in_file_path, out_file_path, key)
 
 
+def encrypted_size(plain_size: int) -> int:
+    """
+    Size of the ciphertext of plain_size bytes, the padding always adds 1 to 16 bytes
+    """
+    return (plain_size // AES_BLOCK_SIZE + 1) * AES_BLOCK_SIZE
+
+
+class EncryptingReader:
+    """
+    Read-only binary file object returning the encryption of another one, in the format written by encrypt_file().
+    Pass it to ipfs_cluster.add_stream_to_cluster() with size=encrypted_size(plain size) to encrypt while
+    uploading, without writing the ciphertext to disk.
+    """
+
+    def __init__(self, fileobj, key: str, chunk_size: int = None):
+        self.fileobj = fileobj
+        self.key = key
+        self.chunk_size = chunk_size or stream_chunk_size
+        self._buffer = bytearray(self.chunk_size)
+        self._start = fileobj.tell() if fileobj.seekable() else None
+        self._reset()
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Returns the next piece of ciphertext, about chunk_size bytes whatever size is, b'' at the end
+        """
+        while not self._done:
+            n = self.fileobj.readinto(self._buffer)
+            if not n:
+                self._done = True
+                return self._count(self._encryptor.finalize())
+            # Input is passed without a copy, the ciphertext is written straight into the returned bytes
+            out = self._encryptor.update(memoryview(self._buffer)[:n])
+            if out:
+                return self._count(out)
+        return b''
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._start is not None
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """
+        Only rewinding to the start is supported, the encryption then starts over
+        """
+        if offset != 0 or whence != os.SEEK_SET or self._start is None:
+            raise OSError("EncryptingReader can only seek back to the start")
+        self.fileobj.seek(self._start)
+        self._reset()
+        return 0
+
+    def _reset(self):
+        self._encryptor = pybind_aes.AESEncryptor(self.key)
+        self._done = False
+        self._position = 0
+
+    def _count(self, data: bytes) -> bytes:
+        self._position += len(data)
+        return data
+
+
+class DecryptingWriter:
+    """
+    Write-only binary file object decrypting what is written to it into another one.
+    close() checks the padding and must be called once all ciphertext was written.
+    """
+
+    def __init__(self, fileobj, key: str):
+        self.fileobj = fileobj
+        self._decryptor = pybind_aes.AESDecryptor(key)
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.fileobj.write(self._decryptor.update(data))
+        return len(data)
+
+    def writable(self) -> bool:
+        return True
+
+    def close(self):
+        """
+        :raises RuntimeError: If the ciphertext was truncated or the key is wrong
+        """
+        if not self.closed:
+            self.closed = True
+            self.fileobj.write(self._decryptor.finalize())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+# Chunked AES-GCM format, for files that are encrypted on several cores and can be decrypted from any offset:
+#
+#   header   "RSAESGC1", version (1 byte), 3 reserved bytes, chunk size (uint32), plaintext size (uint64),
+#            nonce prefix (8 random bytes), all little endian
+#   chunks   every chunk_size bytes of plaintext (the last chunk may be shorter) encrypted on their own, followed
+#            by their 16 byte tag
+#
+# The nonce of chunk i is the nonce prefix followed by i, and the header is authenticated with every chunk, so
+# chunks can't be reordered, cut off or moved to another file without the tag check failing.
+CHUNKED_MAGIC = b"RSAESGC1"
+CHUNKED_VERSION = 1
+CHUNKED_HEADER = struct.Struct("<8sB3xIQ8s")
+GCM_TAG_SIZE = 16
+
+chunked_chunk_size = 1024 * 1024
+# Threads encrypting / decrypting chunks, and chunks handed to them at once
+chunked_threads = os.cpu_count() or 1
+chunked_batch_per_thread = 4
+
+
+class ChunkedHeader:
+    def __init__(self, chunk_size: int, plain_size: int, nonce_prefix: bytes):
+        self.chunk_size = chunk_size
+        self.plain_size = plain_size
+        self.nonce_prefix = nonce_prefix
+        self.raw = CHUNKED_HEADER.pack(CHUNKED_MAGIC, CHUNKED_VERSION, chunk_size, plain_size, nonce_prefix)
+
+    @classmethod
+    def parse(cls, data: bytes):
+        """
+        :raises ValueError: If data doesn't start with a chunked format header
+        """
+        if len(data) < CHUNKED_HEADER.size:
+            raise ValueError("Not a chunked AES file: header is truncated")
+        magic, version, chunk_size, plain_size, nonce_prefix = CHUNKED_HEADER.unpack_from(data)
+        if magic != CHUNKED_MAGIC:
+            raise ValueError("Not a chunked AES file")
+        if version != CHUNKED_VERSION:
+            raise ValueError(f"Unsupported chunked AES version {version}")
+        if chunk_size == 0:
+            raise ValueError("Invalid chunked AES header")
+        return cls(chunk_size, plain_size, nonce_prefix)
+
+    @property
+    def chunk_count(self) -> int:
+        return -(-self.plain_size // self.chunk_size)
+
+    @property
+    def encrypted_size(self) -> int:
+        return CHUNKED_HEADER.size + self.plain_size + self.chunk_count * GCM_TAG_SIZE
+
+    def ciphertext_range(self, offset: int, length: int):
+        """
+        Locates the chunks holding plaintext bytes [offset, offset + length)
+
+        :return: (first chunk index, start, end) with [start, end) the byte range of these chunks in the file
+        """
+        end = min(offset + length, self.plain_size)
+        if offset < 0 or length < 0:
+            raise ValueError("Negative offset or length")
+        if offset >= end:
+            return offset // self.chunk_size, CHUNKED_HEADER.size, CHUNKED_HEADER.size
+        stride = self.chunk_size + GCM_TAG_SIZE
+        first, last = offset // self.chunk_size, (end - 1) // self.chunk_size
+        start = CHUNKED_HEADER.size + first * stride
+        return first, start, min(CHUNKED_HEADER.size + (last + 1) * stride, self.encrypted_size)
+
+
+def new_chunked_header(plain_size: int, chunk_size: int = None) -> ChunkedHeader:
+    return ChunkedHeader(chunk_size or chunked_chunk_size, plain_size, os.urandom(8))
+
+
+def chunked_encrypted_size(plain_size: int, chunk_size: int = None) -> int:
+    return ChunkedHeader(chunk_size or chunked_chunk_size, plain_size, bytes(8)).encrypted_size
+
+
+def encrypt_chunks(key: str, header: ChunkedHeader, first_chunk: int, data, threads: int = None) -> bytes:
+    """
+    Encrypts data, which must start at a chunk boundary and only end inside a chunk if it is the last one
+    """
+    return pybind_aes.gcm_encrypt_chunks(key, header.nonce_prefix, first_chunk, data, header.chunk_size,
+                                         header.raw, threads or chunked_threads)
+
+
+def decrypt_chunks(key: str, header: ChunkedHeader, first_chunk: int, data, threads: int = None) -> bytes:
+    """
+    Decrypts whole encrypted chunks starting with chunk first_chunk
+
+    :raises ValueError: If a chunk fails authentication (wrong key or damaged data)
+    """
+    return pybind_aes.gcm_decrypt_chunks(key, header.nonce_prefix, first_chunk, data, header.chunk_size,
+                                         header.raw, threads or chunked_threads)
+
+
+def encrypt_file_chunked(in_file_path: str, out_file_path: str, key: str = None, chunk_size: int = None,
+                         threads: int = None) -> str:
+    """
+    Encrypts a file into the chunked format, several chunks at a time on `threads` threads.
+    Writing a batch overlaps with encrypting the next one.
+
+    :return: The key, a new one if none is given
+    """
+    if key is None:
+        key = pybind_aes.aes_key_generate()
+    threads = threads or chunked_threads
+    header = new_chunked_header(os.path.getsize(in_file_path), chunk_size)
+    buffer = bytearray(header.chunk_size * threads * chunked_batch_per_thread)
+    with open(in_file_path, 'rb') as src, open(out_file_path, 'wb') as dst, \
+            ThreadPoolExecutor(max_workers=1) as writer:
+        dst.write(header.raw)
+        pending = None
+        index = 0
+        while True:
+            n = src.readinto(buffer)
+            if not n:
+                break
+            out = encrypt_chunks(key, header, index, memoryview(buffer)[:n], threads)
+            if pending is not None:
+                pending.result()
+            pending = writer.submit(dst.write, out)
+            index += -(-n // header.chunk_size)
+        if pending is not None:
+            pending.result()
+    return key
+
+
+def decrypt_file_chunked(in_file_path: str, out_file_path: str, key: str, threads: int = None):
+    """
+    :raises ValueError: If the file isn't in the chunked format or fails authentication, nothing is left at
+                        out_file_path then
+    """
+    threads = threads or chunked_threads
+    try:
+        with open(in_file_path, 'rb') as src, open(out_file_path, 'wb') as dst, \
+                ThreadPoolExecutor(max_workers=1) as writer:
+            header = ChunkedHeader.parse(src.read(CHUNKED_HEADER.size))
+            if os.fstat(src.fileno()).st_size != header.encrypted_size:
+                raise ValueError("Chunked AES file is truncated or has trailing data")
+            buffer = bytearray((header.chunk_size + GCM_TAG_SIZE) * threads * chunked_batch_per_thread)
+            pending = None
+            index = 0
+            while True:
+                n = src.readinto(buffer)
+                if not n:
+                    break
+                out = decrypt_chunks(key, header, index, memoryview(buffer)[:n], threads)
+                if pending is not None:
+                    pending.result()
+                pending = writer.submit(dst.write, out)
+                index += -(-n // (header.chunk_size + GCM_TAG_SIZE))
+            if pending is not None:
+                pending.result()
+    except Exception:
+        if os.path.exists(out_file_path):
+            os.remove(out_file_path)
+        raise
+
+
+def iter_decrypted(key: str, header: ChunkedHeader, first_chunk: int, pieces, threads: int = None, end: int = None):
+    """
+    Decrypts encrypted chunks, starting with chunk first_chunk, that arrive in pieces of any size (e.g. an HTTP
+    response body), yielding the plaintext one batch of chunks at a time
+
+    :param end: Plaintext offset the pieces must reach, defaults to the end of the file
+    :raises ValueError: If a chunk fails authentication, or the pieces end before end (including exactly on a chunk
+                        boundary, or with the last chunk cut off)
+    """
+    threads = threads or chunked_threads
+    stride = header.chunk_size + GCM_TAG_SIZE
+    batch_size = stride * threads * chunked_batch_per_thread
+    index = first_chunk
+    expected = min(header.plain_size, end if end is not None else header.plain_size)
+    produced = first_chunk * header.chunk_size
+    pending = bytearray()
+    for piece in pieces:
+        pending += piece
+        while len(pending) >= batch_size:
+            batch = bytes(pending[:batch_size])
+            del pending[:batch_size]
+            plain = decrypt_chunks(key, header, index, batch, threads)
+            produced += len(plain)
+            yield plain
+            index += threads * chunked_batch_per_thread
+    if pending:
+        plain = decrypt_chunks(key, header, index, bytes(pending), threads)
+        produced += len(plain)
+        yield plain
+    if produced < expected:
+        raise ValueError(f"The encrypted stream ended at plaintext offset {produced}, expected {expected}")
+
+
+def read_chunked_header(fileobj) -> ChunkedHeader:
+    fileobj.seek(0)
+    return ChunkedHeader.parse(fileobj.read(CHUNKED_HEADER.size))
+
+
+def is_chunked_file(file_path: str) -> bool:
+    with open(file_path, 'rb') as f:
+        return f.read(len(CHUNKED_MAGIC)) == CHUNKED_MAGIC
+
+
+def decrypt_range(source, key: str, offset: int, length: int, threads: int = None) -> bytes:
+    """
+    Decrypts plaintext bytes [offset, offset + length) of a chunked file, only reading the chunks holding them.
+    Reading past the end returns fewer bytes.
+
+    :param source: Path or seekable binary file object
+    :raises ValueError: If the file isn't in the chunked format or the chunks fail authentication
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return decrypt_range(f, key, offset, length, threads)
+    header = read_chunked_header(source)
+    first, start, end = header.ciphertext_range(offset, length)
+    if start == end:
+        return b''
+    source.seek(start)
+    data = source.read(end - start)
+    if len(data) != end - start:
+        raise ValueError("Chunked AES file is truncated")
+    plain = decrypt_chunks(key, header, first, data, threads)
+    skip = offset - first * header.chunk_size
+    return plain[skip:skip + length]
+
+
+CHUNKED_CIPHER = "aes-gcm-chunked-v1"
+
+
+def generate_key() -> str:
+    return pybind_aes.aes_key_generate()
+
+
+class ChunkedEncryptingReader:
+    """
+    Read-only binary file object returning the chunked format encryption of another one, so a file can be
+    encrypted while it is uploaded: the next batch of chunks is read and encrypted on a background thread (and the
+    native thread pool) while the previous one is being sent.
+
+    Pass it to ipfs_cluster.add_stream_to_cluster() with size=reader.size. fileobj must produce exactly plain_size
+    bytes.
+    """
+
+    def __init__(self, fileobj, key: str, plain_size: int, chunk_size: int = None, threads: int = None):
+        self.fileobj = fileobj
+        self.key = key
+        self.plain_size = plain_size
+        self.chunk_size = chunk_size or chunked_chunk_size
+        self.threads = threads or chunked_threads
+        self._buffer = bytearray(self.chunk_size * self.threads * chunked_batch_per_thread)
+        self._start = fileobj.tell() if fileobj.seekable() else None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encrypt")
+        self._next = None
+        self._reset()
+
+    @property
+    def size(self) -> int:
+        return self.header.encrypted_size
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Returns the header, then one batch of encrypted chunks per call whatever size is, b'' at the end
+        """
+        if not self._header_sent:
+            self._header_sent = True
+            self._next = self._executor.submit(self._encrypt_next)
+            return self._count(self.header.raw)
+        if self._next is None:
+            return b''
+        out = self._next.result()
+        self._next = self._executor.submit(self._encrypt_next) if out else None
+        return self._count(out)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._start is not None
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """
+        Only rewinding to the start is supported, the encryption then starts over with a new nonce prefix
+        """
+        if offset != 0 or whence != os.SEEK_SET or self._start is None:
+            raise OSError("ChunkedEncryptingReader can only seek back to the start")
+        if self._next is not None:
+            self._next.cancel()
+            try:
+                self._next.result()
+            except Exception:
+                pass
+        self.fileobj.seek(self._start)
+        self._reset()
+        return 0
+
+    def close(self):
+        if self._next is not None:
+            self._next.cancel()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _reset(self):
+        self.header = new_chunked_header(self.plain_size, self.chunk_size)
+        self._header_sent = False
+        self._next = None
+        self._index = 0
+        self._read = 0
+        self._position = 0
+
+    def _encrypt_next(self) -> bytes:
+        remaining = self.plain_size - self._read
+        view = memoryview(self._buffer)[:min(len(self._buffer), remaining)]
+        n = 0
+        while n < len(view):
+            got = self.fileobj.readinto(view[n:])
+            if not got:
+                raise OSError(f"File ended after {self._read + n} of {self.plain_size} bytes")
+            n += got
+        if not n:
+            return b''
+        out = encrypt_chunks(self.key, self.header, self._index, view[:n], self.threads)
+        self._index += -(-n // self.chunk_size)
+        self._read += n
+        return out
+
+    def _count(self, data: bytes) -> bytes:
+        self._position += len(data)
+        return data
+
+
+class ChunkedDecryptingWriter:
+    """
+    Write-only binary file object decrypting a chunked format stream into another one as it arrives.
+    Batches of chunks are decrypted and written on a background thread while the next batch is received.
+    close() checks that the whole file arrived and must be called once all of it was written.
+    """
+
+    def __init__(self, fileobj, key: str, threads: int = None):
+        self.fileobj = fileobj
+        self.key = key
+        self.threads = threads or chunked_threads
+        self.header = None
+        self.closed = False
+        self._pending = bytearray()
+        self._batch_size = None
+        self._index = 0
+        self._written = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decrypt")
+        self._last = None
+
+    def write(self, data) -> int:
+        """
+        :raises ValueError: If the stream isn't in the chunked format or a chunk fails authentication
+        """
+        self._pending += data
+        if self.header is None:
+            if len(self._pending) < CHUNKED_HEADER.size:
+                return len(data)
+            self.header = ChunkedHeader.parse(self._pending)
+            del self._pending[:CHUNKED_HEADER.size]
+            self._batch_size = (self.header.chunk_size + GCM_TAG_SIZE) * self.threads * chunked_batch_per_thread
+        while len(self._pending) >= self._batch_size:
+            batch = bytes(self._pending[:self._batch_size])
+            del self._pending[:self._batch_size]
+            self._submit(batch)
+        return len(data)
+
+    def writable(self) -> bool:
+        return True
+
+    def close(self):
+        """
+        :raises ValueError: If the stream was truncated, has trailing data or fails authentication
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.header is None:
+                raise ValueError("Chunked AES stream is truncated")
+            if self._pending:
+                self._submit(bytes(self._pending))
+                self._pending = bytearray()
+            if self._last is not None:
+                self._last.result()
+            if self._written != self.header.plain_size:
+                raise ValueError("Chunked AES stream is truncated or has trailing data")
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def abort(self):
+        """
+        Stops without checking anything, e.g. after the download failed
+        """
+        self.closed = True
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _submit(self, batch: bytes):
+        # One batch is decrypted while the next one arrives, errors surface on the following write or close()
+        if self._last is not None:
+            self._last.result()
+        stride = self.header.chunk_size + GCM_TAG_SIZE
+        index = self._index
+        self._index += -(-len(batch) // stride)
+        self._last = self._executor.submit(self._decrypt, index, batch)
+
+    def _decrypt(self, index: int, batch: bytes):
+        plain = decrypt_chunks(self.key, self.header, index, batch, self.threads)
+        self.fileobj.write(plain)
+        self._written += len(plain)
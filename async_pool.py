@@ -0,0 +1,36 @@
+"""
+Thread pool shared by the asyncio functions of kv_service and ipfs_cluster, which run the blocking calls on it.
+pybind_kv and requests both release the GIL while they wait, so the calls really run side by side; the pool size
+bounds how many of them are in flight at once, ResilientDB and cluster calls together.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Maximum number of blocking calls the async API runs at the same time
+max_concurrency = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the pool shared by the process, created on first use
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="async-pool")
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """
+    Awaits func(*args, **kwargs) running on the shared pool
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
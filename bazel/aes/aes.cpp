@@ -13,6 +13,13 @@
 #include <openssl/buffer.h>
 #include <openssl/evp.h>
 #include <fstream>
+#include <algorithm>
+#include <atomic>
+#include <cstdint>
+#include <exception>
+#include <mutex>
+#include <stdexcept>
+#include <thread>
 
 
 
@@ -196,9 +203,364 @@ std::vector<unsigned char> base64_decode(const std::string& input) {
     return output;
 }
 
+// Chunked AES-GCM: every chunk is encrypted on its own with the nonce
+// nonce_prefix (8 bytes) || chunk index (4 bytes, big endian) and followed by
+// its 16 byte tag, so chunks can be processed in parallel and decrypted
+// independently. The container format (header, chunk size) lives in aes.py.
+constexpr size_t GCM_TAG_SIZE = 16;
+constexpr size_t GCM_NONCE_PREFIX_SIZE = 8;
+
+const EVP_CIPHER* gcm_cipher_for(const std::vector<unsigned char>& key) {
+    if (key.size() == 16) return EVP_aes_128_gcm();
+    if (key.size() == 32) return EVP_aes_256_gcm();
+    throw std::invalid_argument("AES key must be 32 or 64 hex characters");
+}
+
+// Runs func(i) for i in [0, count) on up to `threads` threads, rethrowing the first exception.
+template <typename Func>
+void parallel_for(size_t count, int threads, Func func) {
+    size_t workers = std::min<size_t>(count, std::max(1, threads));
+    if (workers <= 1) {
+        for (size_t i = 0; i < count; ++i) func(i);
+        return;
+    }
+    std::atomic<size_t> next{0};
+    std::exception_ptr error;
+    std::mutex error_mutex;
+    std::vector<std::thread> pool;
+    for (size_t w = 0; w < workers; ++w) {
+        pool.emplace_back([&]() {
+            for (size_t i = next++; i < count; i = next++) {
+                try {
+                    func(i);
+                } catch (...) {
+                    std::lock_guard<std::mutex> lock(error_mutex);
+                    if (!error) error = std::current_exception();
+                    next = count;
+                }
+            }
+        });
+    }
+    for (auto& t : pool) t.join();
+    if (error) std::rethrow_exception(error);
+}
+
+class GcmChunk {
+public:
+    GcmChunk(const EVP_CIPHER* cipher, const std::vector<unsigned char>& key, const std::string& nonce_prefix,
+             uint64_t index, const std::string& aad, bool encrypt)
+        : ctx_(EVP_CIPHER_CTX_new()) {
+        if (ctx_ == nullptr) throw std::runtime_error("Error: Cannot allocate cipher context.");
+        if (index > 0xffffffffULL) throw std::overflow_error("Too many chunks");
+        unsigned char nonce[12];
+        std::memcpy(nonce, nonce_prefix.data(), GCM_NONCE_PREFIX_SIZE);
+        for (int b = 0; b < 4; ++b) nonce[8 + b] = static_cast<unsigned char>(index >> (24 - 8 * b));
+        int len = 0;
+        bool ok = (encrypt ? EVP_EncryptInit_ex(ctx_, cipher, nullptr, nullptr, nullptr)
+                           : EVP_DecryptInit_ex(ctx_, cipher, nullptr, nullptr, nullptr))
+                  && EVP_CIPHER_CTX_ctrl(ctx_, EVP_CTRL_GCM_SET_IVLEN, sizeof(nonce), nullptr)
+                  && (encrypt ? EVP_EncryptInit_ex(ctx_, nullptr, nullptr, key.data(), nonce)
+                              : EVP_DecryptInit_ex(ctx_, nullptr, nullptr, key.data(), nonce))
+                  && (aad.empty() || (encrypt
+                        ? EVP_EncryptUpdate(ctx_, nullptr, &len, reinterpret_cast<const unsigned char*>(aad.data()),
+                                            static_cast<int>(aad.size()))
+                        : EVP_DecryptUpdate(ctx_, nullptr, &len, reinterpret_cast<const unsigned char*>(aad.data()),
+                                            static_cast<int>(aad.size()))));
+        if (!ok) {
+            EVP_CIPHER_CTX_free(ctx_);
+            throw std::runtime_error("Error: GCM initialization failed.");
+        }
+    }
+
+    ~GcmChunk() { EVP_CIPHER_CTX_free(ctx_); }
+
+    // Writes the ciphertext of in followed by the tag to out
+    void Encrypt(const unsigned char* in, size_t in_len, unsigned char* out) {
+        int len = 0;
+        if (!EVP_EncryptUpdate(ctx_, out, &len, in, static_cast<int>(in_len))
+            || !EVP_EncryptFinal_ex(ctx_, out + len, &len)
+            || !EVP_CIPHER_CTX_ctrl(ctx_, EVP_CTRL_GCM_GET_TAG, GCM_TAG_SIZE, out + in_len)) {
+            throw std::runtime_error("Error: Encryption failed.");
+        }
+    }
+
+    // Decrypts in (ciphertext followed by the tag) to out, false if the tag doesn't match
+    bool Decrypt(const unsigned char* in, size_t in_len, unsigned char* out) {
+        size_t cipher_len = in_len - GCM_TAG_SIZE;
+        int len = 0;
+        if (!EVP_DecryptUpdate(ctx_, out, &len, in, static_cast<int>(cipher_len))) {
+            throw std::runtime_error("Error: Decryption failed.");
+        }
+        std::vector<unsigned char> tag(in + cipher_len, in + in_len);
+        if (!EVP_CIPHER_CTX_ctrl(ctx_, EVP_CTRL_GCM_SET_TAG, GCM_TAG_SIZE, tag.data())) {
+            throw std::runtime_error("Error: Decryption failed.");
+        }
+        return EVP_DecryptFinal_ex(ctx_, out + len, &len) > 0;
+    }
+
+private:
+    EVP_CIPHER_CTX* ctx_;
+};
+
+void check_gcm_args(const std::string& nonce_prefix, size_t chunk_size) {
+    if (nonce_prefix.size() != GCM_NONCE_PREFIX_SIZE) {
+        throw std::invalid_argument("nonce_prefix must be 8 bytes");
+    }
+    if (chunk_size == 0 || chunk_size > (1u << 30)) {
+        throw std::invalid_argument("chunk_size must be between 1 byte and 1 GiB");
+    }
+}
+
+const unsigned char* contiguous_bytes(const pybind11::buffer_info& info, size_t* len) {
+    if (info.ndim > 1 || (info.ndim == 1 && info.strides[0] != info.itemsize)) {
+        throw std::invalid_argument("Buffer must be contiguous");
+    }
+    *len = info.size * info.itemsize;
+    return static_cast<const unsigned char*>(info.ptr);
+}
+
+// Encrypts data as consecutive chunks of chunk_size bytes (the last one may be
+// shorter) numbered from first_index, on up to `threads` threads.
+// Returns every chunk's ciphertext followed by its tag.
+pybind11::bytes gcm_encrypt_chunks(const std::string& hex_key, const std::string& nonce_prefix,
+                                   uint64_t first_index, pybind11::buffer data, size_t chunk_size,
+                                   const std::string& aad, int threads) {
+    check_gcm_args(nonce_prefix, chunk_size);
+    std::vector<unsigned char> key = hex_string_to_bytes(hex_key);
+    const EVP_CIPHER* cipher = gcm_cipher_for(key);
+    pybind11::buffer_info info = data.request();
+    size_t in_len;
+    const unsigned char* in = contiguous_bytes(info, &in_len);
+    size_t chunks = (in_len + chunk_size - 1) / chunk_size;
+    std::string out(in_len + chunks * GCM_TAG_SIZE, '\0');
+    unsigned char* out_ptr = reinterpret_cast<unsigned char*>(&out[0]);
+    {
+        pybind11::gil_scoped_release release;
+        parallel_for(chunks, threads, [&](size_t i) {
+            size_t offset = i * chunk_size;
+            size_t len = std::min(chunk_size, in_len - offset);
+            GcmChunk(cipher, key, nonce_prefix, first_index + i, aad, true)
+                .Encrypt(in + offset, len, out_ptr + offset + i * GCM_TAG_SIZE);
+        });
+    }
+    return pybind11::bytes(out);
+}
+
+// Reverse of gcm_encrypt_chunks, data holds whole encrypted chunks starting with chunk first_index.
+// Raises ValueError naming the first chunk whose tag doesn't match (wrong key, corrupted or reordered data).
+pybind11::bytes gcm_decrypt_chunks(const std::string& hex_key, const std::string& nonce_prefix,
+                                   uint64_t first_index, pybind11::buffer data, size_t chunk_size,
+                                   const std::string& aad, int threads) {
+    check_gcm_args(nonce_prefix, chunk_size);
+    std::vector<unsigned char> key = hex_string_to_bytes(hex_key);
+    const EVP_CIPHER* cipher = gcm_cipher_for(key);
+    pybind11::buffer_info info = data.request();
+    size_t in_len;
+    const unsigned char* in = contiguous_bytes(info, &in_len);
+    size_t stride = chunk_size + GCM_TAG_SIZE;
+    size_t chunks = (in_len + stride - 1) / stride;
+    if (chunks > 0 && in_len - (chunks - 1) * stride <= GCM_TAG_SIZE) {
+        throw std::invalid_argument("Truncated chunk");
+    }
+    std::string out(in_len - chunks * GCM_TAG_SIZE, '\0');
+    unsigned char* out_ptr = reinterpret_cast<unsigned char*>(&out[0]);
+    std::atomic<uint64_t> bad_chunk{UINT64_MAX};
+    {
+        pybind11::gil_scoped_release release;
+        parallel_for(chunks, threads, [&](size_t i) {
+            size_t offset = i * stride;
+            size_t len = std::min(stride, in_len - offset);
+            if (!GcmChunk(cipher, key, nonce_prefix, first_index + i, aad, false)
+                     .Decrypt(in + offset, len, out_ptr + i * chunk_size)) {
+                uint64_t index = first_index + i;
+                uint64_t current = bad_chunk.load();
+                while (index < current && !bad_chunk.compare_exchange_weak(current, index)) {}
+            }
+        });
+    }
+    if (bad_chunk != UINT64_MAX) {
+        throw std::invalid_argument("Authentication failed for chunk " + std::to_string(bad_chunk.load()));
+    }
+    return pybind11::bytes(out);
+}
+
+
+namespace py = pybind11;
+
+// Streaming counterpart of aes_encrypt_file / aes_decrypt_file producing the same
+// AES-128-ECB format, fed from and into Python buffers so nothing touches the disk.
+class AESStreamCipher {
+public:
+    AESStreamCipher(const std::string& hex_key, bool encrypt) : encrypt_(encrypt) {
+        std::vector<unsigned char> key = hex_string_to_bytes(hex_key);
+        if (key.size() != 16) {
+            throw std::invalid_argument("AES-128 key must be 32 hex characters");
+        }
+        ctx_ = EVP_CIPHER_CTX_new();
+        if (ctx_ == nullptr) {
+            throw std::runtime_error("Error: Cannot allocate cipher context.");
+        }
+        int ok = encrypt ? EVP_EncryptInit_ex(ctx_, EVP_aes_128_ecb(), nullptr, key.data(), nullptr)
+                         : EVP_DecryptInit_ex(ctx_, EVP_aes_128_ecb(), nullptr, key.data(), nullptr);
+        if (!ok) {
+            EVP_CIPHER_CTX_free(ctx_);
+            throw std::runtime_error("Error: Cipher initialization failed.");
+        }
+    }
+
+    ~AESStreamCipher() { EVP_CIPHER_CTX_free(ctx_); }
+
+    AESStreamCipher(const AESStreamCipher&) = delete;
+    AESStreamCipher& operator=(const AESStreamCipher&) = delete;
+
+    // Processes data and returns the output that is ready, up to len(data) + 15 bytes.
+    py::bytes Update(py::buffer data) {
+        py::buffer_info in = data.request();
+        size_t in_len = ContiguousSize(in);
+        PyObject* result = PyBytes_FromStringAndSize(nullptr, in_len + AES_BLOCK_SIZE);
+        if (result == nullptr) {
+            throw py::error_already_set();
+        }
+        size_t out_len;
+        try {
+            py::gil_scoped_release release;
+            out_len = Process(static_cast<const unsigned char*>(in.ptr), in_len,
+                              reinterpret_cast<unsigned char*>(PyBytes_AS_STRING(result)));
+        } catch (...) {
+            Py_DECREF(result);
+            throw;
+        }
+        return ShrinkBytes(result, out_len);
+    }
+
+    // Like Update but writes into out, which must be writable and hold len(data) + 16 bytes.
+    // Returns the number of bytes written.
+    size_t UpdateInto(py::buffer data, py::buffer out) {
+        py::buffer_info in = data.request();
+        py::buffer_info dst = out.request(true);
+        size_t in_len = ContiguousSize(in);
+        if (ContiguousSize(dst) < in_len + AES_BLOCK_SIZE) {
+            throw std::invalid_argument("Output buffer must hold len(data) + 16 bytes");
+        }
+        py::gil_scoped_release release;
+        return Process(static_cast<const unsigned char*>(in.ptr), in_len, static_cast<unsigned char*>(dst.ptr));
+    }
+
+    // Returns the last block (padding when encrypting). The cipher can't be used afterwards.
+    py::bytes Finalize() {
+        unsigned char buffer[AES_BLOCK_SIZE];
+        size_t out_len;
+        {
+            py::gil_scoped_release release;
+            out_len = Final(buffer);
+        }
+        return py::bytes(reinterpret_cast<char*>(buffer), out_len);
+    }
+
+    size_t FinalizeInto(py::buffer out) {
+        py::buffer_info dst = out.request(true);
+        if (ContiguousSize(dst) < AES_BLOCK_SIZE) {
+            throw std::invalid_argument("Output buffer must hold 16 bytes");
+        }
+        py::gil_scoped_release release;
+        return Final(static_cast<unsigned char*>(dst.ptr));
+    }
+
+private:
+    size_t Process(const unsigned char* in, size_t in_len, unsigned char* out) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        if (finalized_) {
+            throw std::runtime_error("Cipher already finalized");
+        }
+        // EVP takes int lengths, feed huge buffers in pieces
+        const size_t max_piece = 1 << 30;
+        size_t written = 0;
+        for (size_t offset = 0; offset < in_len; offset += max_piece) {
+            int piece = static_cast<int>(std::min(max_piece, in_len - offset));
+            int len = 0;
+            int ok = encrypt_ ? EVP_EncryptUpdate(ctx_, out + written, &len, in + offset, piece)
+                              : EVP_DecryptUpdate(ctx_, out + written, &len, in + offset, piece);
+            if (!ok) {
+                throw std::runtime_error(encrypt_ ? "Error: Encryption failed." : "Error: Decryption failed.");
+            }
+            written += len;
+        }
+        return written;
+    }
+
+    size_t Final(unsigned char* out) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        if (finalized_) {
+            throw std::runtime_error("Cipher already finalized");
+        }
+        finalized_ = true;
+        int len = 0;
+        int ok = encrypt_ ? EVP_EncryptFinal_ex(ctx_, out, &len) : EVP_DecryptFinal_ex(ctx_, out, &len);
+        if (!ok) {
+            throw std::runtime_error(encrypt_ ? "Error: Final encryption step failed."
+                                              : "Error: Final decryption step failed (wrong key or truncated data).");
+        }
+        return len;
+    }
+
+    static size_t ContiguousSize(const py::buffer_info& info) {
+        if (info.ndim > 1 || (info.ndim == 1 && info.strides[0] != info.itemsize)) {
+            throw std::invalid_argument("Buffer must be contiguous");
+        }
+        return info.size * info.itemsize;
+    }
+
+    static py::bytes ShrinkBytes(PyObject* bytes, size_t len) {
+        if (_PyBytes_Resize(&bytes, len) != 0) {
+            throw py::error_already_set();
+        }
+        return py::reinterpret_steal<py::bytes>(bytes);
+    }
+
+    EVP_CIPHER_CTX* ctx_ = nullptr;
+    bool encrypt_;
+    bool finalized_ = false;
+    std::mutex mutex_;
+};
+
+class AESEncryptor : public AESStreamCipher {
+public:
+    explicit AESEncryptor(const std::string& hex_key) : AESStreamCipher(hex_key, true) {}
+};
+
+class AESDecryptor : public AESStreamCipher {
+public:
+    explicit AESDecryptor(const std::string& hex_key) : AESStreamCipher(hex_key, false) {}
+};
+
 
 PYBIND11_MODULE(pybind_aes, m) {
-    m.def("aes_file_encrypt", &aes_encrypt_file, "");
-    m.def("aes_file_decrypt", &aes_decrypt_file, "");
+    // File encryption/decryption is pure disk and CPU work, release the GIL so
+    // other Python threads can run meanwhile.
+    m.def("aes_file_encrypt", &aes_encrypt_file, pybind11::call_guard<pybind11::gil_scoped_release>(), "");
+    m.def("aes_file_decrypt", &aes_decrypt_file, pybind11::call_guard<pybind11::gil_scoped_release>(), "");
     m.def("aes_key_generate", &generate_random_key, "Generate random 16 bytes key");
+
+    m.def("gcm_encrypt_chunks", &gcm_encrypt_chunks, py::arg("hex_key"), py::arg("nonce_prefix"),
+          py::arg("first_index"), py::arg("data"), py::arg("chunk_size"), py::arg("aad"), py::arg("threads"),
+          "Encrypt data as independent AES-GCM chunks in parallel");
+    m.def("gcm_decrypt_chunks", &gcm_decrypt_chunks, py::arg("hex_key"), py::arg("nonce_prefix"),
+          py::arg("first_index"), py::arg("data"), py::arg("chunk_size"), py::arg("aad"), py::arg("threads"),
+          "Decrypt and authenticate AES-GCM chunks in parallel");
+
+    // The buffers are read and written with the GIL released, callers must not resize them meanwhile.
+    py::class_<AESEncryptor>(m, "AESEncryptor")
+        .def(py::init<const std::string&>(), py::arg("hex_key"))
+        .def("update", &AESEncryptor::Update, py::arg("data"), "Encrypt data, returns the ciphertext that is ready")
+        .def("update_into", &AESEncryptor::UpdateInto, py::arg("data"), py::arg("out"),
+             "Encrypt data into out (len(data) + 16 bytes), returns the number of bytes written")
+        .def("finalize", &AESEncryptor::Finalize, "Returns the padded last block")
+        .def("finalize_into", &AESEncryptor::FinalizeInto, py::arg("out"));
+    py::class_<AESDecryptor>(m, "AESDecryptor")
+        .def(py::init<const std::string&>(), py::arg("hex_key"))
+        .def("update", &AESDecryptor::Update, py::arg("data"), "Decrypt data, returns the plaintext that is ready")
+        .def("update_into", &AESDecryptor::UpdateInto, py::arg("data"), py::arg("out"),
+             "Decrypt data into out (len(data) + 16 bytes), returns the number of bytes written")
+        .def("finalize", &AESDecryptor::Finalize, "Checks and strips the padding, returns the last plaintext")
+        .def("finalize_into", &AESDecryptor::FinalizeInto, py::arg("out"));
 }
\ No newline at end of file
@@ -4,46 +4,205 @@
 #include <sys/types.h>
 #include <unistd.h>
 #include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
 
+#include <algorithm>
+#include <condition_variable>
+#include <exception>
 #include <fstream>
+#include <functional>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <thread>
+#include <utility>
+#include <vector>
 #include "common/proto/signature_info.pb.h"
 #include "interface/kv/kv_client.h"
 #include "platform/config/resdb_config_utils.h"
 
+namespace py = pybind11;
+
 using resdb::GenerateReplicaInfo;
 using resdb::GenerateResDBConfig;
 using resdb::KVClient;
 using resdb::ReplicaInfo;
 using resdb::ResDBConfig;
 
+// A long-lived connection to ResilientDB. The config file is parsed once and
+// KVClient instances are kept in a small pool so concurrent callers each get
+// their own client instead of building a new one per request.
+class KVConnection {
+ public:
+  KVConnection(const std::string& config_path, int pool_size)
+      : config_(GenerateResDBConfig(config_path)),
+        config_path_(config_path),
+        pool_size_(pool_size > 0 ? pool_size : 1) {
+    config_.SetClientTimeoutMs(100000);
+  }
 
-
-
-std::string get(std::string key, std::string config_path) {
-    ResDBConfig config = GenerateResDBConfig(config_path);
-    config.SetClientTimeoutMs(100000);
-    KVClient client(config);
-    auto result_ptr = client.Get(key);
+  std::string Get(const std::string& key) {
+    Lease lease(this);
+    auto result_ptr = lease->Get(key);
     if (result_ptr) {
-        return *result_ptr;
+      return *result_ptr;
     } else {
-        return "";
+      return "";
+    }
+  }
+
+  bool Set(const std::string& key, const std::string& value) {
+    Lease lease(this);
+    int result = lease->Set(key, value);
+    return result == 0;
+  }
+
+  // Fetches a batch of keys. The batch is spread over the pooled clients so
+  // the whole call costs about ceil(len(keys) / pool_size) round trips.
+  std::vector<std::string> MultiGet(const std::vector<std::string>& keys) {
+    std::vector<std::string> values(keys.size());
+    ForEachParallel(keys.size(), [&](KVClient* client, size_t i) {
+      auto result_ptr = client->Get(keys[i]);
+      values[i] = result_ptr ? *result_ptr : "";
+    });
+    return values;
+  }
+
+  std::vector<bool> MultiSet(
+      const std::vector<std::pair<std::string, std::string>>& items) {
+    // std::vector<bool> can't be written from several threads, collect ints.
+    std::vector<int> results(items.size(), 0);
+    ForEachParallel(items.size(), [&](KVClient* client, size_t i) {
+      results[i] = client->Set(items[i].first, items[i].second) == 0;
+    });
+    return std::vector<bool>(results.begin(), results.end());
+  }
+
+  const std::string& config_path() const { return config_path_; }
+  int pool_size() const { return pool_size_; }
+
+ private:
+  // Checks a client out of the pool for the lifetime of the object and hands
+  // it back on destruction, also when the call throws.
+  class Lease {
+   public:
+    explicit Lease(KVConnection* conn) : conn_(conn), client_(conn->Acquire()) {}
+    ~Lease() { conn_->Release(std::move(client_)); }
+    KVClient* operator->() { return client_.get(); }
+    KVClient* get() { return client_.get(); }
+
+   private:
+    KVConnection* conn_;
+    std::unique_ptr<KVClient> client_;
+  };
+
+  // Runs fn(client, i) for i in [0, count) using up to pool_size worker
+  // threads, each holding its own leased client.
+  void ForEachParallel(size_t count,
+                       const std::function<void(KVClient*, size_t)>& fn) {
+    if (count == 0) {
+      return;
+    }
+    size_t workers = std::min(count, static_cast<size_t>(pool_size_));
+    if (workers == 1) {
+      Lease lease(this);
+      for (size_t i = 0; i < count; i++) {
+        fn(lease.get(), i);
+      }
+      return;
+    }
+    std::vector<std::exception_ptr> errors(workers);
+    std::vector<std::thread> threads;
+    for (size_t w = 0; w < workers; w++) {
+      threads.emplace_back([&, w] {
+        try {
+          Lease lease(this);
+          for (size_t i = w; i < count; i += workers) {
+            fn(lease.get(), i);
+          }
+        } catch (...) {
+          errors[w] = std::current_exception();
+        }
+      });
     }
+    for (auto& t : threads) {
+      t.join();
+    }
+    for (auto& error : errors) {
+      if (error) {
+        std::rethrow_exception(error);
+      }
+    }
+  }
+
+  std::unique_ptr<KVClient> Acquire() {
+    std::unique_lock<std::mutex> lock(mutex_);
+    cv_.wait(lock, [this] { return !idle_.empty() || created_ < pool_size_; });
+    if (!idle_.empty()) {
+      std::unique_ptr<KVClient> client = std::move(idle_.back());
+      idle_.pop_back();
+      return client;
+    }
+    created_++;
+    return std::make_unique<KVClient>(config_);
+  }
+
+  void Release(std::unique_ptr<KVClient> client) {
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      idle_.push_back(std::move(client));
+    }
+    cv_.notify_one();
+  }
+
+  ResDBConfig config_;
+  std::string config_path_;
+  int pool_size_;
+  int created_ = 0;
+  std::mutex mutex_;
+  std::condition_variable cv_;
+  std::vector<std::unique_ptr<KVClient>> idle_;
+};
+
+// Shared connections for the module level get/set functions, one per config path.
+KVConnection& shared_connection(const std::string& config_path) {
+  static std::mutex mutex;
+  static std::map<std::string, std::unique_ptr<KVConnection>> connections;
+  std::lock_guard<std::mutex> lock(mutex);
+  auto it = connections.find(config_path);
+  if (it == connections.end()) {
+    it = connections
+             .emplace(config_path, std::make_unique<KVConnection>(config_path, 4))
+             .first;
+  }
+  return *it->second;
+}
+
+std::string get(std::string key, std::string config_path) {
+    return shared_connection(config_path).Get(key);
 }
 
 bool set(std::string key, std::string value, std::string config_path) {
-    ResDBConfig config = GenerateResDBConfig(config_path);
-    config.SetClientTimeoutMs(100000);
-    KVClient client(config);
-    int result = client.Set(key, value);
-    if (result == 0) {
-        return true;
-    } else {
-        return false;
-    }
+    return shared_connection(config_path).Set(key, value);
 }
 
 PYBIND11_MODULE(pybind_kv, m) {
-    m.def("get", &get, "A function that gets a value from the key-value store");
-    m.def("set", &set, "A function that sets a value in the key-value store");
-}
\ No newline at end of file
+    // Every call below blocks on the network, so the GIL is released while it
+    // runs and other Python threads (e.g. Flask request threads) keep going.
+    using release_gil = py::call_guard<py::gil_scoped_release>;
+    py::class_<KVConnection>(m, "KVConnection")
+        .def(py::init<const std::string&, int>(), py::arg("config_path"), py::arg("pool_size") = 4,
+             "Create a pooled connection from a ResilientDB client config file")
+        .def("get", &KVConnection::Get, py::arg("key"), release_gil(),
+             "Get a value from the key-value store")
+        .def("set", &KVConnection::Set, py::arg("key"), py::arg("value"), release_gil(),
+             "Set a value in the key-value store")
+        .def("multi_get", &KVConnection::MultiGet, py::arg("keys"), release_gil(),
+             "Get a list of keys, returns the values in the same order (\"\" for missing keys)")
+        .def("multi_set", &KVConnection::MultiSet, py::arg("items"), release_gil(),
+             "Set a list of (key, value) pairs, returns a success flag per item")
+        .def_property_readonly("config_path", &KVConnection::config_path)
+        .def_property_readonly("pool_size", &KVConnection::pool_size);
+    m.def("get", &get, release_gil(), "A function that gets a value from the key-value store");
+    m.def("set", &set, release_gil(), "A function that sets a value in the key-value store");
+}
@@ -0,0 +1,104 @@
+"""
+Compares payload size and encode/decode time of the KV value codecs on the values of a 10k file catalog: a manifest
+page, the file records and the holder flags (see file_manifest.py and client.holder_key()).
+
+Usage:
+    python benchmarks/codec_bench.py [--files 10000] [--rounds 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codec
+
+
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+# file_manifest.PAGE_SIZE, not imported because file_manifest needs pybind_kv
+PAGE_SIZE = 128
+
+
+def random_id(prefix, length):
+    # CIDs and peer IDs are base58 strings
+    return prefix + ''.join(random.choices(BASE58, k=length - len(prefix)))
+
+
+def build_samples(file_count):
+    """
+    :return: [(name, value, separate)], separate values are lists of records stored under a key each
+    """
+    files = []
+    for i in range(file_count):
+        record = {
+            'file_name': f"holiday_video_{i}.mp4",
+            'file_size': random.randint(1, 5 * 1024 ** 3),
+            'timestamp': "2024-11-08 10:15:00",
+            'page': i // PAGE_SIZE,
+        }
+        if i % 10 == 0:
+            record.update({'encrypted': True, 'cipher': "aes-gcm-chunked-v1", 'key': f"{random.getrandbits(128):032x}"})
+        files.append((random_id("Qm", 46), record))
+    return [
+        (f"manifest page ({PAGE_SIZE} CIDs)", [cid for cid, _ in files[:PAGE_SIZE]], False),
+        (f"{file_count} file records", [record for _, record in files], True),
+        (f"{file_count} holder flags", [random.random() < 0.1 for _ in range(file_count)], True),
+    ]
+
+
+def measure(obj, encode, decode, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encoded = encode(obj)
+    encode_time = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decoded = decode(encoded)
+    decode_time = (time.perf_counter() - start) / rounds
+    assert decoded == obj
+    return len(encoded.encode('utf-8')), encode_time, decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    defaults = {'compact_min_size': codec.compact_min_size, 'compress_threshold': codec.compress_threshold,
+                'compression': codec.compression}
+    variants = [
+        ("json", "json", {}),
+        ("compact", "compact", {'compact_min_size': 0, 'compress_threshold': 10 ** 12}),
+        ("compact+zlib", "compact", {'compact_min_size': 0, 'compress_threshold': 512, 'compression': "zlib"}),
+    ]
+    if codec.zstandard is not None:
+        variants.append(("compact+zstd", "compact",
+                         {'compact_min_size': 0, 'compress_threshold': 512, 'compression': "zstd"}))
+    # What encode() does out of the box, JSON for small values and compact+compression for large ones
+    variants.append(("default", None, {}))
+
+    for sample_name, obj, separate in build_samples(args.files):
+        print(sample_name)
+        json_size = None
+        for name, codec_name, settings in variants:
+            for setting, value in dict(defaults, **settings).items():
+                setattr(codec, setting, value)
+            encode = lambda o: codec.encode(o, codec_name)
+            decode = codec.decode
+            if separate:
+                # File records and holder flags are separate KV values, measure them one by one
+                size = encode_time = decode_time = 0
+                for record in obj:
+                    s, e, d = measure(record, encode, decode, 1)
+                    size, encode_time, decode_time = size + s, encode_time + e, decode_time + d
+            else:
+                size, encode_time, decode_time = measure(obj, encode, decode, args.rounds)
+            json_size = json_size or size
+            print(f"  {name:<14} {size:>10} bytes ({size / json_size:6.1%})"
+                  f"  encode {encode_time * 1000:8.2f} ms  decode {decode_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
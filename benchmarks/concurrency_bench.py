@@ -0,0 +1,75 @@
+"""
+Checks that requests touching ResilientDB (/all_files) and AES/IPFS (/upload) overlap in the Flask server
+instead of being serialized by the GIL.
+
+Every request is sent N times back to back and then N times at once. If the native calls hold the GIL the
+concurrent run takes about as long as the sequential one and each concurrent request waits up to N times longer;
+with the GIL released the run should be close to the duration of a single request, with about the same latency per
+request. The speedup is the measure: the client always has N requests open at once, so counting requests in flight
+on this side would say nothing about whether the server overlapped them.
+
+Usage (with the server running):
+    python benchmarks/concurrency_bench.py --url http://localhost:5000 --requests 8 --upload-file /path/to/file
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def timed_request(send):
+    """
+    :return: (latency in seconds, HTTP status)
+    """
+    start = time.perf_counter()
+    response = send()
+    return time.perf_counter() - start, response.status_code
+
+
+def latency_summary(results):
+    latencies = [latency for latency, _ in results]
+    return f"latency mean {sum(latencies) / len(latencies) * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms"
+
+
+def run(name, send, count):
+    start = time.perf_counter()
+    sequential = [timed_request(send) for _ in range(count)]
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        concurrent = list(executor.map(lambda _: timed_request(send), range(count)))
+    concurrent_time = time.perf_counter() - start
+
+    failures = sum(1 for _, status in sequential + concurrent if status != 200)
+    print(f"{name}:")
+    print(f"  sequential: {sequential_time:.3f}s for {count} requests, {latency_summary(sequential)}")
+    print(f"  concurrent: {concurrent_time:.3f}s for {count} requests, {latency_summary(concurrent)}")
+    print(f"  speedup:    {sequential_time / concurrent_time:.2f}x")
+    if failures:
+        print(f"  {failures} requests did not return 200")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--requests", type=int, default=8, help="Number of requests per run")
+    parser.add_argument("--upload-file", help="File used for the /upload run, skipped if not given")
+    args = parser.parse_args()
+
+    run("/all_files", lambda: requests.get(f"{args.url}/all_files"), args.requests)
+
+    if args.upload_file:
+        file_name = os.path.basename(args.upload_file)
+
+        def upload():
+            with open(args.upload_file, "rb") as f:
+                return requests.post(f"{args.url}/upload", files={"files": (file_name, f)})
+
+        run("/upload", upload, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Measures how much wall-clock time encryption adds to uploads and downloads.
+
+A local HTTP server stands in for the cluster API / gateway: it reads uploads and throws them away, and serves a
+file for downloads, optionally throttled to --mbps to look like a real network. For every size it times
+    plain         the file sent as is (what upload_file() does without encrypt)
+    pipelined     aes.ChunkedEncryptingReader, encrypting the next batch while the previous one is sent
+    sequential    encrypt_file_chunked() to a temporary file first, then send that
+and the same for downloads (plain stream vs aes.ChunkedDecryptingWriter on the stream).
+
+Usage (from the repository root, after bazel build):
+    python benchmarks/encryption_bench.py [--sizes 16,256] [--mbps 0] [--threads 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import requests
+
+import aes
+import ipfs_cluster as ipfs
+
+CHUNK = 256 * 1024
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    mbps = 0
+    download_path = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            data = self.rfile.read(min(CHUNK, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            self._throttle(len(data))
+        body = b'{"cid": {"/": "bench"}}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(self.download_path)))
+        self.end_headers()
+        with open(self.download_path, 'rb') as f:
+            while True:
+                data = f.read(CHUNK)
+                if not data:
+                    break
+                self.wfile.write(data)
+                self._throttle(len(data))
+
+    def _throttle(self, nbytes):
+        if self.mbps:
+            time.sleep(nbytes * 8 / (self.mbps * 1e6))
+
+
+def send(url, fileobj, size):
+    body = ipfs.MultipartFileStream(fileobj, "bench.bin", size)
+    response = requests.post(url, data=body, headers={'Content-Type': body.content_type})
+    response.raise_for_status()
+
+
+def receive(url, fileobj):
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=CHUNK):
+            fileobj.write(chunk)
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def report(name, size, seconds, baseline):
+    overhead = f"{(seconds / baseline - 1) * 100:+.0f}%" if baseline else ""
+    print(f"  {name:<11} {seconds:7.3f}s  {size / seconds / 2 ** 20:8.1f} MiB/s  {overhead}")
+
+
+def bench(url, workdir, size_mib, threads):
+    size = size_mib * 2 ** 20
+    plain_path = os.path.join(workdir, "plain.bin")
+    encrypted_path = os.path.join(workdir, "encrypted.bin")
+    with open(plain_path, 'wb') as f:
+        for _ in range(size_mib):
+            f.write(os.urandom(2 ** 20))
+    key = aes.generate_key()
+
+    print(f"upload {size_mib} MiB:")
+
+    def plain_upload():
+        with open(plain_path, 'rb') as f:
+            send(url, f, size)
+
+    def pipelined_upload():
+        with open(plain_path, 'rb') as f, aes.ChunkedEncryptingReader(f, key, size, threads=threads) as reader:
+            send(url, reader, reader.size)
+
+    def sequential_upload():
+        aes.encrypt_file_chunked(plain_path, encrypted_path, key, threads=threads)
+        with open(encrypted_path, 'rb') as f:
+            send(url, f, os.path.getsize(encrypted_path))
+
+    baseline = timed(plain_upload)
+    report("plain", size, baseline, None)
+    report("pipelined", size, timed(pipelined_upload), baseline)
+    report("sequential", size, timed(sequential_upload), baseline)
+
+    print(f"download {size_mib} MiB:")
+    out_path = os.path.join(workdir, "out.bin")
+
+    def plain_download():
+        SinkHandler.download_path = plain_path
+        with open(out_path, 'wb') as f:
+            receive(url, f)
+
+    def decrypting_download():
+        SinkHandler.download_path = encrypted_path
+        with open(out_path, 'wb') as f, aes.ChunkedDecryptingWriter(f, key, threads=threads) as writer:
+            receive(url, writer)
+
+    baseline = timed(plain_download)
+    report("plain", size, baseline, None)
+    report("decrypting", size, timed(decrypting_download), baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="16,256", help="Comma separated file sizes in MiB")
+    parser.add_argument("--mbps", type=float, default=0, help="Simulated network bandwidth, 0 for unlimited")
+    parser.add_argument("--threads", type=int, default=aes.chunked_threads, help="Encryption threads")
+    args = parser.parse_args()
+
+    SinkHandler.mbps = args.mbps
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    print(f"{args.threads} encryption threads, network {'unlimited' if not args.mbps else f'{args.mbps} Mbit/s'}")
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size_mib in (int(s) for s in args.sizes.split(',')):
+                bench(url, workdir, size_mib, args.threads)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Load test of the HTTP API: --clients concurrent clients send requests back to back for --duration seconds, then
+the throughput and latency percentiles are printed. Run it once against each serving mode to compare them:
+
+    python3 controller.py                                              # development server, port 5000
+    gunicorn -c gunicorn.conf.py wsgi:app                              # production, port 5000
+
+Usage:
+    python benchmarks/load_test.py --url http://localhost:5000 --clients 32 --duration 20 \
+        --paths /peers,/all_files,/kv_cache/stats
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+
+import requests
+
+
+def client_loop(url, paths, deadline, latencies, statuses, lock):
+    session = requests.Session()
+    local_latencies = []
+    local_statuses = Counter()
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = session.get(url + path, timeout=30)
+            response.content
+            local_statuses[response.status_code] += 1
+        except requests.exceptions.RequestException as e:
+            local_statuses[type(e).__name__] += 1
+            continue
+        local_latencies.append(time.perf_counter() - start)
+    with lock:
+        latencies.extend(local_latencies)
+        statuses.update(local_statuses)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds")
+    parser.add_argument("--paths", default="/peers,/all_files,/kv_cache/stats", help="Comma separated GET paths")
+    args = parser.parse_args()
+
+    paths = args.paths.split(',')
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=client_loop, args=(args.url, paths, deadline, latencies, statuses, lock))
+               for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{args.url} with {args.clients} clients for {elapsed:.1f}s on {', '.join(paths)}")
+    print(f"  requests/sec: {len(latencies) / elapsed:.1f}")
+    print(f"  latency p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p95 {percentile(latencies, 0.95) * 1000:.1f}ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms")
+    print(f"  responses: {dict(statuses)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Local content-addressed cache of downloaded files.
+
+Content under a CID never changes, so a file downloaded once can be served from disk afterwards. Files are kept
+under "<cache_dir>/<last 2 chars of CID>/<CID>" next to a "<CID>.json" sidecar holding their size and SHA-256, the
+least recently used ones are evicted once the cache grows over max_bytes. Entries are written to a temporary
+file and renamed into place, and their SHA-256 is checked every time they are served, so a damaged or half
+written entry is dropped instead of being handed out.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+cache_dir = os.path.join(os.path.expanduser("~"), ".resshare", "cid_cache")
+max_bytes = 10 * 1024 ** 3
+# Files larger than this share of max_bytes are not cached, they would push out everything else
+max_entry_fraction = 0.25
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class CIDCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # CID -> size, least recently used first
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.corrupted = 0
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def fetch(self, cid: str, dest_path: str) -> bool:
+        """
+        Copies the cached content of cid to dest_path (atomically, through a temporary file next to it).
+
+        :return: True if the file was served from the cache, False on a miss or if the entry failed its integrity check
+        """
+        with self._lock:
+            if cid not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(cid)
+        meta = self._read_meta(cid)
+        temp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(self._path(cid), "rb") as src, open(temp_path, "wb") as dst:
+                digest, size = _copy(src, dst)
+            if meta is None or size != meta.get('size') or digest != meta.get('sha256'):
+                raise ValueError("checksum mismatch")
+            os.replace(temp_path, dest_path)
+        except (OSError, ValueError) as e:
+            print(f"Dropping cached copy of {cid}: {e}")
+            _remove(temp_path)
+            with self._lock:
+                self.corrupted += 1
+                self.misses += 1
+            self.discard(cid)
+            return False
+        # The file mtime records recency across restarts
+        _touch(self._path(cid))
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, cid: str, src_path: str) -> bool:
+        """
+        Copies src_path into the cache as the content of cid, evicting least recently used entries as needed.
+
+        :return: True if the file was cached
+        """
+        try:
+            size = os.path.getsize(src_path)
+        except OSError:
+            return False
+        if size > self.max_bytes * max_entry_fraction:
+            return False
+        with self._lock:
+            if cid in self._entries:
+                self._entries.move_to_end(cid)
+                return True
+
+        os.makedirs(os.path.dirname(self._path(cid)), exist_ok=True)
+        temp_path = f"{self._path(cid)}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(src_path, "rb") as src, open(temp_path, "wb") as dst:
+                digest, copied = _copy(src, dst)
+            if copied != size:
+                raise OSError(f"{src_path} changed while it was copied")
+            _write_json(self._meta_path(cid), {'cid': cid, 'size': size, 'sha256': digest})
+            os.replace(temp_path, self._path(cid))
+        except OSError as e:
+            print(f"Failed to cache {cid}: {e}")
+            _remove(temp_path)
+            return False
+
+        with self._lock:
+            if cid not in self._entries:
+                self._entries[cid] = size
+                self._total += size
+            evicted = self._evict_locked()
+        for old_cid in evicted:
+            self._remove_files(old_cid)
+        return True
+
+    def open(self, cid: str):
+        """
+        Opens the cached content of cid for reading, e.g. to serve byte ranges of it. Only the size is checked
+        against the sidecar here, reading the whole file for its SHA-256 would defeat range requests.
+
+        :return: A binary file object the caller must close, None on a miss
+        """
+        with self._lock:
+            if cid not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cid)
+        meta = self._read_meta(cid)
+        try:
+            f = open(self._path(cid), "rb")
+        except OSError:
+            f = None
+        if f is None or meta is None or os.fstat(f.fileno()).st_size != meta.get('size'):
+            if f is not None:
+                f.close()
+            print(f"Dropping cached copy of {cid}: size mismatch")
+            with self._lock:
+                self.corrupted += 1
+                self.misses += 1
+            self.discard(cid)
+            return None
+        _touch(self._path(cid))
+        with self._lock:
+            self.hits += 1
+        return f
+
+    def discard(self, cid: str):
+        with self._lock:
+            size = self._entries.pop(cid, None)
+            if size is not None:
+                self._total -= size
+        self._remove_files(cid)
+
+    def __contains__(self, cid: str) -> bool:
+        with self._lock:
+            return cid in self._entries
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'corrupted': self.corrupted,
+            }
+
+    def _evict_locked(self) -> list:
+        evicted = []
+        while self._total > self.max_bytes and self._entries:
+            cid, size = self._entries.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            evicted.append(cid)
+        return evicted
+
+    def _load(self):
+        """
+        Rebuilds the index from the files on disk, oldest mtime first. Entries without a valid sidecar and
+        leftover temporary files are removed.
+        """
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".tmp"):
+                    _remove(path)
+                    continue
+                if name.endswith(".json"):
+                    if not os.path.exists(path[:-len(".json")]):
+                        _remove(path)
+                    continue
+                meta = self._read_meta(name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if meta is None or meta.get('size') != stat.st_size:
+                    self._remove_files(name)
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, cid, size in sorted(found):
+            self._entries[cid] = size
+            self._total += size
+        for cid in self._evict_locked():
+            self._remove_files(cid)
+
+    def _path(self, cid: str) -> str:
+        return os.path.join(self.root, cid[-2:], cid)
+
+    def _meta_path(self, cid: str) -> str:
+        return self._path(cid) + ".json"
+
+    def _read_meta(self, cid: str):
+        try:
+            with open(self._meta_path(cid)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove_files(self, cid: str):
+        _remove(self._path(cid))
+        _remove(self._meta_path(cid))
+
+
+def get_cache() -> CIDCache:
+    """
+    Returns the cache shared by the process, creating it in cache_dir on first use
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CIDCache(cache_dir, max_bytes)
+    return _cache
+
+
+def _copy(src, dst):
+    """
+    :return: (SHA-256 hex digest, number of bytes) of what was copied
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = src.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        dst.write(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _write_json(path, obj):
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(temp_path, path)
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,13 +1,30 @@
 import kv_service as kv
 import ipfs_cluster as ipfs
-import json
+import aes
+import cid_cache
+import file_index
+import file_stream
+import jobs
+import peer_directory
+import file_manifest as manifest
+import codec
+import itertools
 import os
 import mimetypes
+import threading
+from collections import OrderedDict
 from datetime import datetime
 # Global variable
 my_ipfs_cluster_id = ipfs.get_my_peer_id()
 
-def upload_file(file_path: str):
+# Progress of uploads that were given an upload id, see get_upload_progress()
+MAX_TRACKED_UPLOADS = 256
+_upload_progress = OrderedDict()
+_upload_progress_lock = threading.Lock()
+
+
+def upload_file(file_path: str, upload_id: str = None, replication_min: int = None, replication_max: int = None,
+                encrypt: bool = False, progress_callback=None):
     """
     The whole process of uploading a file
     This function should be called when user want to upload a file
@@ -21,68 +38,438 @@ def upload_file(file_path: str):
                                             "file_size": FILE_SIZE_2(int)(bytes),
                                         },
                         }
+    It is stored as one record per file plus a paged index of CIDs, see file_manifest.py
 
 
     :param file_path: THe file path on user's local machine
-    :return None
+    :param upload_id: If given, the progress of sending the file to the cluster can be polled with
+                      get_upload_progress(upload_id)
+    :param replication_min: If given, the file is pinned with these replication factors in the background, follow
+                            it with get_replication_status(cid). replication_max defaults to replication_min.
+    :param encrypt: Encrypt the file with a new key (chunked AES-GCM, see aes.py) while it is uploaded. The key is
+                    kept in the file record ("encrypted", "cipher", "key") and download_file() decrypts with it.
+    :param progress_callback: Called as progress_callback(bytes_sent, total_bytes) while the file is sent, an
+                              exception it raises aborts the upload
+    :return The CID of the file, None if the upload failed
     """
-    global my_ipfs_cluster_id
+    with open(file_path, 'rb') as f:
+        return upload_stream(f, os.path.basename(file_path), os.path.getsize(file_path), upload_id=upload_id,
+                             replication_min=replication_min, replication_max=replication_max, encrypt=encrypt,
+                             progress_callback=progress_callback)
 
-    # Get my current files under my IPFS cluster peer ID
-    my_file_structure = kv.get_kv(my_ipfs_cluster_id)
-    try:
-        my_file_structure = json.loads(my_file_structure)
-    except:
-        print("File structure broken or empty")
-        my_file_structure = {}
 
-    # Generate metadata of this file
-    new_file_info = {'file_name': os.path.basename(file_path), 'file_size': os.path.getsize(file_path), 'timestamp': datetime.now().strftime("%Y-%m-%d")}
+def upload_stream(fileobj, file_name: str, size: int = None, upload_id: str = None, replication_min: int = None,
+                  replication_max: int = None, encrypt: bool = False, progress_callback=None):
+    """
+    Same as upload_file() for the content of a binary file-like object, e.g. an upload read from the HTTP request
+    while it arrives. The file size recorded is the number of bytes read from fileobj.
+
+    :param file_name: The name the file is listed with
+    :param size: Number of bytes fileobj will produce, None if unknown (not allowed with encrypt)
+    :return The CID of the file, None if the upload failed
+    :raises ValueError: If encrypt is set without a size, or fileobj produced more or fewer than size bytes
+    """
+    if encrypt and size is None:
+        raise ValueError("The file size must be known to encrypt an upload")
+    counter = _CountingReader(fileobj, size)
 
     # Send to IPFS cluster and get CID
-    cid = ipfs.add_file_to_cluster(file_path)
+    progress_callback = _chain_callbacks(_track_upload(upload_id, file_name, size), progress_callback)
+    try:
+        if encrypt:
+            cid, encryption = _upload_encrypted(counter, file_name, size, progress_callback)
+        else:
+            cid, encryption = ipfs.add_stream_to_cluster(counter, file_name, size, progress_callback), {}
+        if cid:
+            # Generate metadata of this file
+            new_file_info = {'file_name': file_name, 'file_size': counter.bytes_read,
+                             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **encryption}
+            _record_upload(cid, new_file_info)
+    except Exception:
+        _finish_upload(upload_id, 'failed')
+        raise
+    _finish_upload(upload_id, 'done' if cid else 'failed')
 
-    # Update ResilientDB
-    my_file_structure[cid] = new_file_info
-    kv.set_kv(my_ipfs_cluster_id, json.dumps(my_file_structure))
+    if cid and replication_min is not None:
+        ipfs.pin_with_replication(cid, replication_min,
+                                  replication_max if replication_max is not None else replication_min)
+    return cid
 
-    #Seperate KV pair for Delete File
-    
-    delete_file_structure = kv.get_kv(cid)
+
+def _chain_callbacks(*callbacks):
+    callbacks = [callback for callback in callbacks if callback is not None]
+    if len(callbacks) <= 1:
+        return callbacks[0] if callbacks else None
+
+    def callback(*args):
+        for c in callbacks:
+            c(*args)
+
+    return callback
+
+
+def submit_upload(file_path: str, upload_id: str = None, replication_min: int = None, replication_max: int = None,
+                  encrypt: bool = False) -> jobs.Job:
+    """
+    Queues upload_file() on the background job queue, follow it with get_job(job.id)
+
+    :raises jobs.QueueFull: If too many jobs are waiting already
+    """
+    def run(job):
+        def progress(bytes_sent, total_bytes):
+            job.set_progress(bytes_sent=bytes_sent, total_bytes=total_bytes)
+            job.raise_if_cancelled()
+
+        job.raise_if_cancelled()
+        cid = upload_file(file_path, upload_id=upload_id, replication_min=replication_min,
+                          replication_max=replication_max, encrypt=encrypt, progress_callback=progress)
+        if cid is None:
+            raise RuntimeError("The cluster did not accept the file")
+        return {'cid': cid, 'upload_id': upload_id}
+
+    return jobs.get_queue().submit('upload', run, os.path.basename(file_path))
+
+
+def submit_delete(cid: str) -> jobs.Job:
+    """
+    Queues delete_file() on the background job queue, its status message becomes the job result. A deletion that
+    failed (unknown file, no access, ResilientDB or cluster errors) fails the job with the message as error.
+
+    :raises jobs.QueueFull: If too many jobs are waiting already
+    """
+    def run(job):
+        ok, status = _delete_file(cid)
+        if not ok:
+            raise RuntimeError(status)
+        return {'cid': cid, 'status': status}
+
+    return jobs.get_queue().submit('delete', run, cid)
+
+
+def get_job(job_id: str):
+    """
+    :return: The job as a python dict, None if the id is unknown
+    :return format: {
+                        'id': JOB_ID(str),
+                        'kind': 'upload' | 'delete',
+                        'state': 'queued' | 'running' | 'succeeded' | 'failed' | 'cancelled',
+                        'progress': {'bytes_sent': int, 'total_bytes': int} for uploads,
+                        'result': {'cid': CID, ...} once succeeded,
+                        'error': ERROR(str) once failed or cancelled,
+                        'description', 'cancel_requested', 'created_at', 'started_at', 'finished_at'
+                    }
+    """
+    job = jobs.get_queue().get(job_id)
+    return job.to_dict() if job is not None else None
+
+
+def cancel_job(job_id: str):
+    """
+    Cancels a queued job, a running upload stops at its next chunk
+
+    :return: See get_job()
+    """
+    job = jobs.get_queue().cancel(job_id)
+    return job.to_dict() if job is not None else None
+
+
+def get_jobs() -> dict:
+    queue = jobs.get_queue()
+    return {'queue': queue.stats(), 'jobs': queue.jobs()}
+
+
+def _upload_encrypted(fileobj, file_name: str, size: int, progress_callback):
+    """
+    Sends the chunked AES-GCM encryption of fileobj, encrypting the next batch of chunks while the previous one is
+    sent
+
+    :return: (CID, the encryption fields of the file record)
+    """
+    key = aes.generate_key()
+    with aes.ChunkedEncryptingReader(fileobj, key, size) as reader:
+        cid = ipfs.add_stream_to_cluster(reader, file_name, reader.size, progress_callback)
+    if cid is not None:
+        # fileobj is the _CountingReader of upload_stream(), this raises if data is left beyond the announced size
+        fileobj.read(1)
+    return cid, {'encrypted': True, 'cipher': aes.CHUNKED_CIPHER, 'key': key}
+
+
+class _CountingReader:
+    """
+    Passes reads through to a binary file object, counting the bytes read. With a size it also checks that the
+    file holds exactly that many bytes, since the size was already announced as the Content-Length of the upload.
+    """
+
+    def __init__(self, fileobj, size: int = None):
+        """
+        :raises ValueError: From read(), once fileobj turned out to be shorter or longer than size
+        """
+        self.fileobj = fileobj
+        self.size = size
+        self.bytes_read = 0
+        self._start = fileobj.tell() if fileobj.seekable() else None
+
+    def read(self, size: int = -1) -> bytes:
+        if self.size is None:
+            data = self.fileobj.read(size)
+            self.bytes_read += len(data)
+            return data
+        remaining = self.size - self.bytes_read
+        if remaining <= 0:
+            if size != 0 and self.fileobj.read(1):
+                raise ValueError(f"The file is larger than the {self.size} bytes announced")
+            return b''
+        data = self.fileobj.read(remaining if size is None or size < 0 else min(size, remaining))
+        if not data and size != 0:
+            raise ValueError(f"The file ended after {self.bytes_read} of the {self.size} bytes announced")
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._start is not None
+
+    def tell(self) -> int:
+        return self.fileobj.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        position = self.fileobj.seek(offset, whence)
+        self.bytes_read = position - self._start
+        return position
+
+
+def get_replication_status(cid: str, wait: float = 0):
+    """
+    Replication progress of a file uploaded with replication factors
+
+    :param wait: Seconds to wait for the replication to reach its target (or fail) first
+    :return a python dict, None if no replication was requested for this CID
+    :return format: {
+                        'cid': CID(str),
+                        'state': 'requested' | 'pinning' | 'replicated' | 'failed' | 'timed_out',
+                        'pinned': NUMBER_OF_PEERS_WITH_A_COPY(int),
+                        'target': NUMBER_OF_COPIES_WANTED(int or None),
+                        'peers': {PEER_NAME(str): STATUS(str)},
+                        'errors': [ERROR(str)],
+                        'replication_min': int, 'replication_max': int, 'started_at': float, 'updated_at': float
+                    }
+    """
+    return ipfs.get_replication_status(cid, wait)
+
+
+def _record_upload(cid: str, new_file_info: dict):
+    """
+    Registers an uploaded file in ResilientDB under my peer ID
+    """
+    global my_ipfs_cluster_id
+
+    # Update ResilientDB, only this file's record and one manifest page are written
+    manifest.add_file(my_ipfs_cluster_id, cid, new_file_info)
+
+    # Separate KV pairs for Delete File: every peer holding the file writes only its own key, so peers never
+    # overwrite each other's flags
+    if not kv.set_obj(holder_key(cid, my_ipfs_cluster_id), False):
+        raise RuntimeError(f"Failed to write {holder_key(cid, my_ipfs_cluster_id)} to ResilientDB")
+    # The CID key tells listings the file exists, every uploader writes the same value
+    if not codec.decode(kv.get_kv(cid, fresh=True)):
+        kv.set_obj(cid, {cid: {}})
+    file_index.invalidate()
+
+
+def get_upload_progress(upload_id: str):
+    """
+    Progress of an upload started with upload_file(..., upload_id=upload_id)
+
+    :return a python dict, None if the upload id is unknown
+    :return format: {
+                        'file_name': FILE_NAME(str),
+                        'bytes_sent': BYTES_SENT(int),
+                        'total_bytes': TOTAL_BYTES(int or None),
+                        'status': 'uploading' | 'done' | 'failed'
+                    }
+    """
+    with _upload_progress_lock:
+        progress = _upload_progress.get(upload_id)
+        return dict(progress) if progress is not None else None
+
+
+def _track_upload(upload_id, file_name, total_bytes):
+    if upload_id is None:
+        return None
+    progress = {'file_name': file_name, 'bytes_sent': 0, 'total_bytes': total_bytes, 'status': 'uploading'}
+    with _upload_progress_lock:
+        _upload_progress[upload_id] = progress
+        _upload_progress.move_to_end(upload_id)
+        # Forget the oldest uploads, finished ones are only kept for a while for polling
+        while len(_upload_progress) > MAX_TRACKED_UPLOADS:
+            _upload_progress.popitem(last=False)
+
+    def callback(bytes_sent, total):
+        progress['bytes_sent'] = bytes_sent
+        if total is not None:
+            progress['total_bytes'] = total
+
+    return callback
+
+
+def _finish_upload(upload_id, status):
+    if upload_id is None:
+        return
+    with _upload_progress_lock:
+        progress = _upload_progress.get(upload_id)
+        if progress is not None:
+            progress['status'] = status
+
+
+def holder_key(cid: str, peer_id: str) -> str:
+    """
+    Key of a peer's deletion flag for a file it holds: False while it keeps the file, True once it asked for the
+    deletion, "" if it doesn't hold the file
+    """
+    return f"{cid} HOLDER {peer_id}"
+
+
+def _get_holders(cid: str) -> dict:
+    """
+    Reads the deletion flags of all peers holding a file, always from ResilientDB. The peers looked at are the
+    cluster peers plus those listed in a legacy deletion record (the old single {CID: {PEER_ID: bool}} value under
+    the CID key, its flags are used unless the peer wrote its own key since).
+
+    :return: {PEER_ID: True if it asked for the deletion}
+    """
+    cluster_peers = (get_all_peers() or {}).get("cluster_peers") or []
+    legacy_record = kv.get_obj(cid, fresh=True)
+    holders = _normalize_delete_file_structure(legacy_record).get(cid, {}) if legacy_record else {}
+    peer_ids = list(dict.fromkeys([my_ipfs_cluster_id, *cluster_peers, *holders]))
+    flags = kv.multi_get((holder_key(cid, peer_id) for peer_id in peer_ids), fresh=True)
+    for peer_id in peer_ids:
+        flag = codec.decode(flags[holder_key(cid, peer_id)])
+        if isinstance(flag, bool):
+            holders[peer_id] = flag
+    return holders
+
+
+def _normalize_delete_file_structure(parsed) -> dict:
+    """
+    Copies a decoded deletion record into the {CID: {PEER_ID: bool}} format, a broken record becomes {}
+    """
     try:
-        parsed = json.loads(delete_file_structure)
-        
         result = {}
         for outer_key, inner_dict in parsed.items():
             result[outer_key] = {}
             for inner_key, value in inner_dict.items():
                 result[outer_key][inner_key] = value
-        
-        delete_file_structure = result
-    except json.JSONDecodeError:
-        print("Delete File structure is not valid JSON")
-        delete_file_structure = {}
+        return result
     except Exception as e:
-        print(f"An error occurred: {e}")
-        delete_file_structure = {}
-
-    # Now delete_file_structure has the desired format
-    print(delete_file_structure)
-
-    if cid not in delete_file_structure:
-        delete_file_structure[cid] = {my_ipfs_cluster_id: False}
-    else:
-        delete_file_structure[cid][my_ipfs_cluster_id] = False
-    
-    kv.set_kv(cid, json.dumps(delete_file_structure))
+        print(f"Delete File structure is broken: {e}")
+        return {}
 
-def download_file(cid: str, file_path: str):
+def download_file(cid: str, file_path: str, peer_id: str = None):
     """
     This function will download file with cid to file_path
     :param cid: The file CID that user wants to download
     :param file_path: The file path where user wants to save the file(include file name suche like test.txt)
+    :param peer_id: The peer that uploaded the file, if known. Its file record tells whether the file is encrypted,
+                    without it the records of all peers are looked up.
     """
-    return ipfs.download_file_from_ipfs(cid, file_path)
+    file_info = _find_file_info(cid, peer_id)
+    # Content under a CID never changes, so a copy downloaded before is as good as a fresh one
+    cache = cid_cache.get_cache()
+    cacheable = _use_cache(cid, file_info)
+    if cacheable and cache.fetch(cid, file_path):
+        print(f"File {cid} served from the local cache")
+        return {"success": True, "message": f"File downloaded successfully and saved to {file_path}"}
+    if file_info is not None and file_info.get('encrypted'):
+        result = _download_encrypted(cid, file_path, file_info)
+    else:
+        result = ipfs.download_file_from_ipfs(cid, file_path)
+    if result["success"] and cacheable:
+        cache.put(cid, file_path)
+    return result
+
+
+def open_file_stream(cid: str, byte_range=None, peer_id: str = None):
+    """
+    Opens a file, or one byte range of it, to be streamed to an HTTP caller without being written to disk.
+    Encrypted files are decrypted on the way. The stream must be closed once the response is done.
+
+    :param byte_range: werkzeug.datastructures.Range with a single range, None for the whole file
+    :param peer_id: The peer that uploaded the file, if known, see download_file()
+    :return: (file_stream.FileStream, the file record or None if no catalog lists the file)
+    :raises file_stream.RangeNotSatisfiable: If byte_range lies outside of the file
+    :raises download_engine.DownloadError: If no gateway has the file
+    """
+    file_info = _find_file_info(cid, peer_id)
+    stream = file_stream.open_stream(cid, file_info, byte_range, from_cache=_use_cache(cid, file_info))
+    return stream, _public_file_info(file_info)
+
+
+def _find_file_info(cid: str, peer_id: str = None):
+    """
+    :return: The file record of cid, from peer_id's catalog if given, otherwise from mine or any other peer's.
+             None if no catalog lists it.
+    """
+    if peer_id is not None:
+        peer_ids = [peer_id]
+    else:
+        peer_ids = [my_ipfs_cluster_id] + [peer.get('id') for peer in peer_directory.get_directory().peers()
+                                           if isinstance(peer, dict) and peer.get('id')]
+    _, file_info = manifest.find_file(peer_ids, cid)
+    return file_info
+
+
+def _use_cache(cid: str, file_info: dict) -> bool:
+    """
+    Tells whether cid may be served from and added to the local cache: only while a catalog lists it and it isn't
+    deleted. A deletion only discards the copy cached by the deleting node, the copies of the others go here.
+    Encrypted files are never cached, their plaintext would be kept on disk under the CID of the ciphertext.
+
+    :param file_info: The file record of cid, see _find_file_info()
+    """
+    try:
+        live = file_info is not None and not file_info.get('encrypted') and bool(codec.decode(kv.get_kv(cid)))
+    except Exception as e:
+        print(f"Error reading the record of {cid}: {e}")
+        return False
+    if not live:
+        cid_cache.get_cache().discard(cid)
+    return live
+
+
+def _download_encrypted(cid: str, file_path: str, file_info: dict):
+    """
+    Downloads an encrypted file and decrypts it while it arrives, the plaintext is written to "<file_path>.part"
+    and only moved to file_path once every chunk was authenticated
+    """
+    if file_info.get('cipher') != aes.CHUNKED_CIPHER or not file_info.get('key'):
+        return {"success": False, "message": f"Unsupported encryption {file_info.get('cipher')} for {cid}"}
+    part_path = file_path + ".part"
+    try:
+        with open(part_path, 'wb') as f:
+            writer = aes.ChunkedDecryptingWriter(f, file_info['key'])
+            try:
+                result = ipfs.download_stream_from_ipfs(cid, writer)
+                if result["success"]:
+                    writer.close()
+            finally:
+                writer.abort()
+        if not result["success"]:
+            os.remove(part_path)
+            return result
+        os.replace(part_path, file_path)
+    except (OSError, ValueError) as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return {"success": False, "message": f"Failed to decrypt {cid}: {e}"}
+    print(f"Decrypted {cid} to {file_path}")
+    return {"success": True, "message": f"File downloaded successfully and saved to {file_path}"}
 
 
 def get_all_peers():
@@ -126,7 +513,7 @@ def get_all_peers():
                         'peername': 'cluster1'
                     }
     """
-    return ipfs.list_all_peers()
+    return peer_directory.get_directory().cluster_info()
 
 
 def get_all_pinned_file():
@@ -212,6 +599,61 @@ def get_all_pinned_file():
     return ipfs.list_pinned_files()
 
 
+def iter_pinned_files(status: str = None, peer: str = None, file_type=None, name_prefix: str = None):
+    """
+    Generator version of get_all_pinned_file() that reads the pins from the cluster as they come in
+
+    :param status: Optional comma separated statuses, only pins with one of them on some peer are returned
+    :param peer: Optional, only pins this peer has in its peer_map
+    :param file_type: Optional, only pins whose name has one of these types, see file_index.parse_file_types()
+    :param name_prefix: Optional, only pins whose name starts with this, ignoring case
+    """
+    pins = ipfs.iter_pins(status)
+    types = file_index.parse_file_types(file_type)
+    if peer is None and types is None and not name_prefix:
+        return pins
+    return _filter_pins(pins, peer, types, name_prefix)
+
+
+def _filter_pins(pins, peer, types, name_prefix):
+    try:
+        for pin in pins:
+            if peer is not None and peer not in (pin.get('peer_map') or {}):
+                continue
+            if file_index.name_matches(pin.get('name'), name_prefix, types):
+                yield pin
+    finally:
+        # Closes the cluster response when the caller stops early
+        pins.close()
+
+
+def get_pinned_page(limit: int = None, cursor: str = None, status: str = None, peer: str = None, file_type=None,
+                    name_prefix: str = None) -> dict:
+    """
+    One page of iter_pinned_files(). The cluster can't sort or skip, so the pins before the page are read and
+    dropped without being kept; pins added or removed meanwhile shift the page boundary by that many pins.
+
+    :param limit: Pins per page, at most file_index.max_limit
+    :param cursor: next_cursor of the previous page, None for the first page
+    :return: {'pins': [...], 'next_cursor': str, None on the last page}
+    :raises file_index.InvalidQuery: If limit or cursor is invalid
+    """
+    limit = file_index.check_limit(limit)
+    offset = 0
+    if cursor is not None:
+        values = file_index.decode_cursor(cursor)
+        if len(values) != 2 or values[0] != 'pins' or not isinstance(values[1], int) or values[1] < 0:
+            raise file_index.InvalidQuery("The cursor doesn't belong to the pin list")
+        offset = values[1]
+    pins = iter_pinned_files(status, peer, file_type, name_prefix)
+    try:
+        page = list(itertools.islice(pins, offset, offset + limit + 1))
+    finally:
+        pins.close()
+    next_cursor = file_index.encode_cursor(['pins', offset + limit]) if len(page) > limit else None
+    return {'pins': page[:limit], 'next_cursor': next_cursor}
+
+
 def get_file_status(cid: str):
     """
     This function will return file info of a certain file
@@ -254,49 +696,93 @@ def get_other_peer_file_structure(peer_id: str):
     :return format: Same as my_file_structure in upload_file(). If return an empty dict {} means this user hasn't upload
                     any files yet
     """
-    peer_file_structure = kv.get_kv(peer_id)
-    try:
-        peer_file_structure = json.loads(peer_file_structure)
-    except:
-        peer_file_structure = {}
-    return peer_file_structure
+    return {cid: _public_file_info(file_info) for cid, file_info in manifest.get_files(peer_id).items()}
 
 
-def get_all_file():
+def _public_file_info(file_info) -> dict:
     """
-    This function will return all file info that current cluster has
+    Drops the encryption key from a file record before it is handed out
+    """
+    if isinstance(file_info, dict) and 'key' in file_info:
+        return {name: value for name, value in file_info.items() if name != 'key'}
+    return file_info
 
-    :return a python dict
-    :return format: {
-                        PEER_ID_1(str): {
-                                            CID1(str):  {
-                                                            "file_name": FILE_NAME_1(str),
-                                                            "file_size": FILE_SIZE_1(int)(bytes),
-                                                        },
-                                            CID2(str):  {
-                                                            "file_name": FILE_NAME_2(str),
-                                                            "file_size": FILE_SIZE_2(int)(bytes),
-                                                        },
-                                        }，
-                        PEER_ID_2(str): {},
-                    }
+
+def get_peers_file_structures(peer_ids) -> dict:
+    """
+    Batched version of get_other_peer_file_structure(), fetching all peers in one KV call
+    :param peer_ids: The peer IDs to lookup
+    :return A python dict {PEER_ID(str): file structure}, see get_other_peer_file_structure()
+    """
+    return manifest.get_files_for_peers(peer_ids)
+
+
+def get_all_file(sort: str = None, order: str = 'asc', peer: str = None, file_type=None, name_prefix: str = None):
+    """
+    This function will return all file info that current cluster has. It is served from file_index, which is
+    rebuilt at most every file_index.ttl seconds and after our own uploads and deletes.
+
+    :param sort: Optional, 'name', 'size' or 'timestamp'. Without it files come in catalog order.
+    :param order: 'asc' or 'desc'
+    :param peer: Optional, only files of this peer
+    :param file_type: Optional, only files of these types, see file_index.parse_file_types()
+    :param name_prefix: Optional, only files whose name starts with this, ignoring case
+    :return a python list
+    :return format: [
+                        {
+                            "peerID": PEER_ID(str),
+                            "fileName": FILE_NAME(str),
+                            "fileSize": FILE_SIZE(int)(bytes),
+                            "timestamp": TIMESTAMP(str),
+                            "encrypted": bool,
+                            "CID": CID(str),
+                        },
+                    ]
+    :raises file_index.InvalidQuery: If sort or order is invalid
+    """
+    index = file_index.get_index(_load_file_list)
+    return list(index.select(sort, order, peer, file_type, name_prefix))
+
+
+def get_file_page(limit: int = None, cursor: str = None, sort: str = None, order: str = 'asc', peer: str = None,
+                  file_type=None, name_prefix: str = None) -> dict:
+    """
+    One page of get_all_file(), only the files of the page are copied
+
+    :param limit: Files per page, at most file_index.max_limit
+    :param cursor: next_cursor of the previous page, None for the first page
+    :param sort: 'name' (default), 'size' or 'timestamp'
+    :return: {'files': [...], 'next_cursor': str, None on the last page}
+    :raises file_index.InvalidQuery: If an argument is invalid
     """
+    index = file_index.get_index(_load_file_list)
+    return index.page(limit, cursor, sort, order, peer, file_type, name_prefix)
+
+
+def _load_file_list() -> list:
     peers = get_all_peers()["cluster_peers"]
-    all_files = {}
-    for peer in peers:
-        all_files[peer] = get_other_peer_file_structure(peer)
+    all_files = get_peers_file_structures(peers)
+    cid_records = kv.multi_get(_all_cids(all_files))
+    return _build_file_list(all_files, cid_records)
+
 
+def _all_cids(all_files: dict):
+    return [cid for files in all_files.values() if files for cid in files]
+
+
+def _build_file_list(all_files: dict, cid_records: dict) -> list:
     unique_files = {}
 
     for peer_id, files in all_files.items():
         if files:  
             for cid, file_info in files.items():
-                cid_data = kv.get_kv(cid)
-                if cid not in unique_files and  cid_data and cid_data != "{}":
+                if cid not in unique_files and codec.decode(cid_records.get(cid)):
                     unique_files[cid] = {
                         'peerID': peer_id,
                         'fileName': file_info.get('file_name'),
                         'fileSize': file_info.get('file_size'),
+                        'timestamp': file_info.get('timestamp'),
+                        'encrypted': bool(file_info.get('encrypted')),
                         'CID': cid
                     }
 
@@ -323,18 +809,16 @@ def add_favorite_peer(peer_id: str, nickname: str) -> dict:
                                         },
                     }
     """
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
-    peer_name = ipfs.get_peer_name(peer_id)
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
-    except:
-        print("Your favorite peer list is currently empty or broken, creating a new one.")
-        my_favorite_list = {}
+    peer_name = peer_directory.get_directory().peer_name(peer_id)
 
-    my_favorite_list[peer_id] = {'nickname': nickname, 'peer_name': peer_name}
+    def add(my_favorite_list):
+        if not isinstance(my_favorite_list, dict):
+            print("Your favorite peer list is currently empty or broken, creating a new one.")
+            my_favorite_list = {}
+        my_favorite_list[peer_id] = {'nickname': nickname, 'peer_name': peer_name}
+        return my_favorite_list
 
-    kv.set_kv(my_ipfs_cluster_id + " FAVORITE", json.dumps(my_favorite_list))
-    return my_favorite_list
+    return kv.update_obj(my_ipfs_cluster_id + " FAVORITE", add, default=lambda: None)
 
 
 def change_nickname(peer_id: str, new_nickname: str) -> dict:
@@ -348,17 +832,15 @@ def change_nickname(peer_id: str, new_nickname: str) -> dict:
     :return format: Please follow add_favorite_peer() return format
     """
 
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
-    except:
-        print("Your favorite peer list is currently empty or broken, creating a new one.")
-        return {}
-
-    my_favorite_list[peer_id]['nickname'] = new_nickname
-    kv.set_kv(my_ipfs_cluster_id + " FAVORITE", json.dumps(my_favorite_list))
+    def rename(my_favorite_list):
+        if not isinstance(my_favorite_list, dict):
+            print("Your favorite peer list is currently empty or broken, creating a new one.")
+            return None
+        my_favorite_list[peer_id]['nickname'] = new_nickname
+        return my_favorite_list
 
-    return my_favorite_list
+    my_favorite_list = kv.update_obj(my_ipfs_cluster_id + " FAVORITE", rename, default=lambda: None)
+    return my_favorite_list if isinstance(my_favorite_list, dict) else {}
 
 
 def remove_favorite_peer(peer_id) -> dict:
@@ -370,21 +852,19 @@ def remove_favorite_peer(peer_id) -> dict:
     :return a python dict after modification
     :return format: Please follow add_favorite_peer() return format
     """
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
-    except:
-        print("Your favorite peer list is currently empty or broken, creating a new one.")
-        return {}
-
-    try:
+    def remove(my_favorite_list):
+        if not isinstance(my_favorite_list, dict):
+            print("Your favorite peer list is currently empty or broken, creating a new one.")
+            return None
+        if peer_id not in my_favorite_list:
+            print(f"{peer_id} not found.")
+            return None
         del my_favorite_list[peer_id]
-        kv.set_kv(my_ipfs_cluster_id + " FAVORITE", json.dumps(my_favorite_list))
-        return my_favorite_list
-    except:
-        print(f"{peer_id} not found.")
         return my_favorite_list
 
+    my_favorite_list = kv.update_obj(my_ipfs_cluster_id + " FAVORITE", remove, default=lambda: None)
+    return my_favorite_list if isinstance(my_favorite_list, dict) else {}
+
 
 def get_my_favorite_peer() -> dict:
     """
@@ -394,77 +874,76 @@ def get_my_favorite_peer() -> dict:
     :return a python dict after modification
     :return format: Please follow add_favorite_peer() return format
     """
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
+    my_favorite_list = kv.get_obj(my_ipfs_cluster_id + " FAVORITE")
+    if isinstance(my_favorite_list, dict):
         return my_favorite_list
-    except:
-        print("Your favorite peer list is currently empty or broken, creating a new one.")
-        return {}
+    print("Your favorite peer list is currently empty or broken, creating a new one.")
+    return {}
 
 def delete_file(cid:str) -> str:
+    """
+    Marks the file as deleted by this peer and removes it from the cluster once every peer holding it did
+
+    :return: A status message
+    """
+    return _delete_file(cid)[1]
+
+
+def _delete_file(cid: str):
+    """
+    :return: (True if the file was deleted or our mark was recorded, status message)
+    """
     global my_ipfs_cluster_id
-    delete_file_structure = kv.get_kv(cid)
+
     try:
-        parsed = json.loads(delete_file_structure)
-        
-        result = {}
-        for outer_key, inner_dict in parsed.items():
-            result[outer_key] = {}
-            for inner_key, value in inner_dict.items():
-                result[outer_key][inner_key] = value
-        
-        delete_file_structure = result
-    except json.JSONDecodeError:
-        if delete_file_structure != "":
-            print("Delete File structure is not valid JSON")
-        delete_file_structure = {}
+        holders = _get_holders(cid)
     except Exception as e:
-        print(f"An error occurred: {e}")
-        delete_file_structure = {}
-
+        return False, f"Error updating ResilientDB: {str(e)}"
+    if not holders:
+        return False, f"File with CID {cid} not found"
+    if my_ipfs_cluster_id not in holders:
+        return False, f"Peer {my_ipfs_cluster_id} does not have access to this file for deletion"
 
-    if cid not in delete_file_structure:
-        return f"File with CID {cid} not found"
-    
-    if my_ipfs_cluster_id not in delete_file_structure[cid]:
-        return f"Peer {my_ipfs_cluster_id} does not have access to this file for deletion"
-    delete_file_structure[cid][my_ipfs_cluster_id] = True
+    # Our flag is written before the others are read: of two peers marking the file at the same time, at least
+    # one then sees both flags set
     try:
-        kv.set_kv(cid, json.dumps(delete_file_structure))
+        if not kv.set_obj(holder_key(cid, my_ipfs_cluster_id), True):
+            return False, f"Error updating ResilientDB: failed to write {holder_key(cid, my_ipfs_cluster_id)}"
+        holders = _get_holders(cid)
     except Exception as e:
-        return f"Error updating ResilientDB: {str(e)}"
-    peer_values = delete_file_structure[cid]
+        return False, f"Error updating ResilientDB: {str(e)}"
     
-    all_peers_true = all(value for value in peer_values.values())
+    all_peers_true = all(value for value in holders.values())
     if all_peers_true:
         try:
-            ipfs.remove_file_from_cluster(cid)
-            
-            del delete_file_structure[cid]
-            
-            kv.set_kv(cid, json.dumps(delete_file_structure))
-            file_structure = kv.get_kv(my_ipfs_cluster_id)
-            
+            # The records stay in place when the unpin fails, so the deletion can be retried
+            if not ipfs.remove_file_from_cluster(cid):
+                return False, f"Error deleting file: could not remove {cid} from the cluster"
+            cid_cache.get_cache().discard(cid)
+
+            # Every peer finishing the deletion writes the same values
+            cleared = {holder_key(cid, peer_id): "" for peer_id in holders}
+            cleared[cid] = codec.encode({})
+            results = kv.multi_set(cleared)
+            file_index.invalidate()
+            failed = [key for key in cleared if not results.get(key)]
+            if failed:
+                return False, f"Partial deletion: File removed from cluster, but failed to write {', '.join(failed)}"
+
             try:
-                peer_file_structure = json.loads(file_structure) if file_structure else {}
-                
-                if cid in peer_file_structure:
-                    del peer_file_structure[cid]
-                
-                kv.set_kv(my_ipfs_cluster_id, json.dumps(peer_file_structure))
-                
+                manifest.remove_file(my_ipfs_cluster_id, cid)
+
                 print(f"Successfully deleted file with CID {cid}")
-                return "File deleted successfully"
-            
-            except json.JSONDecodeError:
-                print("Error parsing peer file structure")
-                return "Partial deletion: File removed from cluster, but local structure update failed"
+                return True, "File deleted successfully"
+
+            except Exception as e:
+                print(f"Error updating peer file structure: {e}")
+                return False, "Partial deletion: File removed from cluster, but local structure update failed"
 
         except Exception as e:
-            return f"Error deleting file: {str(e)}"
+            return False, f"Error deleting file: {str(e)}"
     else:
-        return "Cannot delete file: Not all peers have marked it as True"
+        return True, "Cannot delete file: Not all peers have marked it as True"
     
 def fetch_dashboard_data():
     """
@@ -499,7 +978,12 @@ def fetch_dashboard_data():
 
     """
     peers = get_all_peers()["cluster_peers"]
-    all_files = {}
+    all_files = get_peers_file_structures(peers)
+    cid_records = kv.multi_get(_all_cids(all_files))
+    return _build_dashboard_stats(peers, all_files, cid_records)
+
+
+def _build_dashboard_stats(peers: list, all_files: dict, cid_records: dict) -> dict:
     unique_files = {}
     
     stats = {
@@ -513,16 +997,12 @@ def fetch_dashboard_data():
         'files_with_timestamp': [],
         'peer_cid_array': []
     }
-    for peer in peers:
-        all_files[peer] = get_other_peer_file_structure(peer)
     unique_peer_ids = set()
 
     for peer_id, files in all_files.items():
         if files:
             for cid, file_info in files.items():
-                cid_data = kv.get_kv(cid)
-                
-                if cid not in unique_files and cid_data and cid_data != "{}":
+                if cid not in unique_files and codec.decode(cid_records.get(cid)):
                     file_name = file_info.get('file_name', '')
                     
                     file_type = get_file_type(file_name)
@@ -576,4 +1056,56 @@ def get_file_type(filename):
             return 'photo'
     
     return 'other'
-    
+
+
+def init_process():
+    """
+    Opens this process's ResilientDB connection, IPFS HTTP session and peer directory and creates its job queue
+    (whose worker threads start with the first job), so the first requests don't pay for it. Every server process
+    (e.g. each gunicorn worker) calls it once.
+    """
+    kv.get_connection()
+    ipfs.get_session()
+    peer_directory.get_directory()
+    jobs.get_queue()
+
+
+def shutdown(timeout: float = None) -> bool:
+    """
+    Stops taking background jobs and waits up to timeout seconds for the queued and running ones (uploads,
+    deletes) to finish
+
+    :return: True if all of them finished
+    """
+    drained = jobs.get_queue().drain(timeout)
+    if not drained:
+        print(f"Shutting down with unfinished jobs: {jobs.get_queue().stats()}")
+    return drained
+
+
+def get_kv_cache_stats() -> dict:
+    """
+    Statistics of the local ResilientDB read cache, see kv_service.KVCache
+    """
+    return kv.cache_stats()
+
+
+def get_endpoint_stats() -> dict:
+    """
+    Health, latency and traffic of the configured IPFS Cluster API endpoints and gateways
+    """
+    return ipfs.get_endpoint_stats()
+
+
+def get_cid_cache_stats() -> dict:
+    """
+    Statistics of the local cache of downloaded files, see cid_cache.CIDCache
+    """
+    return cid_cache.get_cache().stats()
+
+
+def get_gc_status() -> dict:
+    """
+    State of the batched garbage collection that follows deletes, see gc_scheduler.GCScheduler
+    """
+    return ipfs.get_gc_status()
@@ -0,0 +1,301 @@
+"""
+Encoding of the values stored in ResilientDB.
+
+Values are plain JSON (the legacy format) or a registered codec, marked by a "~<tag>:" prefix. decode() looks at
+the prefix, so records written in any format can always be read back.
+
+The built-in "compact" codec is a small msgpack-style binary format: common field names are written as one byte,
+CIDs and peer IDs are stored as their raw base58-decoded bytes, every other string is written once and referred
+back to by index afterwards (peer IDs repeat a lot in deletion records), and large values are compressed. KV
+values travel as Python str through pybind_kv, so the bytes are base85 encoded. When that doesn't come out smaller
+than JSON the value is simply stored as JSON.
+"""
+
+import base64
+import functools
+import json
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec used by encode() when none is given
+default_codec = "compact"
+
+# Values whose JSON form is shorter than this (bytes) are stored as JSON by the compact codec, the few bytes it
+# would save on small records aren't worth the slower pure Python decoding
+compact_min_size = 1024
+# The compact codec compresses values whose binary form is larger than this (bytes)
+compress_threshold = 512
+# "zlib" or "zstd" (needs the optional zstandard package on every node that reads the values)
+compression = "zlib"
+
+# Field names written as a single byte by the compact codec. Only append to this list, the index is the wire id.
+INTERNED_FIELDS = [
+    'file_name', 'file_size', 'timestamp', 'page', 'version', 'pages',
+    'nickname', 'peer_name', 'encrypted', 'key', 'cipher',
+]
+
+_codecs = {}
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _STR_REF, _LIST, _DICT, _FIELD, _B58 = range(11)
+_B58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_B58_INDEX = {c: i for i, c in enumerate(_B58_ALPHABET)}
+_B58_CHARS = frozenset(_B58_ALPHABET)
+# Big integer arithmetic is done 10 digits at a time
+_B58_CHUNK = 10
+_B58_CHUNK_BASE = 58 ** _B58_CHUNK
+# CIDs (Qm...) and peer IDs (12D3KooW...) are base58, strings at least this long are stored as raw bytes
+_B58_MIN_LENGTH = 32
+_FLAG_ZLIB = 1
+_FLAG_ZSTD = 2
+_FORMAT_VERSION = 1
+_FIELD_IDS = {name: i for i, name in enumerate(INTERNED_FIELDS)}
+
+
+class CodecError(ValueError):
+    pass
+
+
+def register_codec(name: str, tag: str, encode_func, decode_func):
+    """
+    Registers a codec usable with encode(name=...). Values are stored as "~<tag>:" + encode_func(obj).
+
+    :param encode_func: obj -> str
+    :param decode_func: str -> obj
+    """
+    if ':' in tag or '~' in tag:
+        raise ValueError("Codec tags can't contain ':' or '~'")
+    _codecs[name] = (tag, encode_func, decode_func)
+
+
+def encode(obj, name: str = None) -> str:
+    """
+    Encodes obj with the given codec (default_codec if None), "json" writes the legacy plain JSON
+    """
+    name = name or default_codec
+    if name == "json":
+        return json.dumps(obj)
+    tag, encode_func, _ = _codecs[name]
+    if name == "compact":
+        plain = json.dumps(obj)
+        if len(plain) < compact_min_size:
+            return plain
+        encoded = f"~{tag}:" + encode_func(obj)
+        return plain if len(plain) <= len(encoded) else encoded
+    return f"~{tag}:" + encode_func(obj)
+
+
+def decode(raw: str, default=None):
+    """
+    Decodes a value written by encode() in any registered format, or legacy JSON.
+
+    :return: The decoded object, default if raw is empty or can't be decoded
+    """
+    if not raw:
+        return default
+    try:
+        if raw.startswith('~'):
+            tag, _, payload = raw[1:].partition(':')
+            for codec_tag, _, decode_func in _codecs.values():
+                if codec_tag == tag:
+                    return decode_func(payload)
+            raise CodecError(f"Unknown codec tag {tag}")
+        return json.loads(raw)
+    except (ValueError, TypeError, IndexError, struct.error, zlib.error) as e:
+        print(f"Failed to decode value: {e}")
+        return default
+
+
+def _encode_compact(obj) -> str:
+    out = bytearray()
+    _write(obj, out, {})
+    flags = 0
+    if len(out) > compress_threshold:
+        if compression == "zstd" and zstandard is not None:
+            compressed, flag = zstandard.ZstdCompressor().compress(bytes(out)), _FLAG_ZSTD
+        else:
+            compressed, flag = zlib.compress(bytes(out), 6), _FLAG_ZLIB
+        if len(compressed) < len(out):
+            out, flags = compressed, flag
+    return base64.b85encode(bytes([_FORMAT_VERSION, flags]) + bytes(out)).decode('ascii')
+
+
+def _decode_compact(payload: str):
+    data = base64.b85decode(payload)
+    if len(data) < 2 or data[0] != _FORMAT_VERSION:
+        raise CodecError("Unsupported compact format")
+    flags, body = data[1], data[2:]
+    if flags & _FLAG_ZSTD:
+        if zstandard is None:
+            raise CodecError("Value is zstd compressed but zstandard is not installed")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif flags & _FLAG_ZLIB:
+        body = zlib.decompress(body)
+    obj, pos = _read(body, 0, [])
+    if pos != len(body):
+        raise CodecError("Trailing data in compact value")
+    return obj
+
+
+def _write(obj, out: bytearray, strings: dict):
+    if obj is None:
+        out.append(_NONE)
+    elif obj is True:
+        out.append(_TRUE)
+    elif obj is False:
+        out.append(_FALSE)
+    elif isinstance(obj, int):
+        if not -2 ** 63 <= obj < 2 ** 63:
+            raise OverflowError(f"Integer {obj} does not fit in 64 bits")
+        out.append(_INT)
+        _write_varint((obj << 1) ^ (obj >> 63), out)
+    elif isinstance(obj, float):
+        out.append(_FLOAT)
+        out += struct.pack('<d', obj)
+    elif isinstance(obj, str):
+        _write_str(obj, out, strings)
+    elif isinstance(obj, (list, tuple)):
+        out.append(_LIST)
+        _write_varint(len(obj), out)
+        for item in obj:
+            _write(item, out, strings)
+    elif isinstance(obj, dict):
+        out.append(_DICT)
+        _write_varint(len(obj), out)
+        for key, value in obj.items():
+            if not isinstance(key, str):
+                raise TypeError(f"Dict keys must be str, got {type(key).__name__}")
+            field_id = _FIELD_IDS.get(key)
+            if field_id is not None:
+                out.append(_FIELD)
+                out.append(field_id)
+            else:
+                _write_str(key, out, strings)
+            _write(value, out, strings)
+    else:
+        raise TypeError(f"Can't encode {type(obj).__name__}")
+
+
+def _write_str(s: str, out: bytearray, strings: dict):
+    index = strings.get(s)
+    if index is not None:
+        out.append(_STR_REF)
+        _write_varint(index, out)
+        return
+    strings[s] = len(strings)
+    data = _b58decode(s) if len(s) >= _B58_MIN_LENGTH else None
+    if data is not None:
+        out.append(_B58)
+    else:
+        data = s.encode('utf-8')
+        out.append(_STR)
+    _write_varint(len(data), out)
+    out += data
+
+
+@functools.lru_cache(maxsize=65536)
+def _b58decode(s: str):
+    """
+    :return: The bytes s is the base58 encoding of, None if s isn't base58
+    """
+    if not _B58_CHARS.issuperset(s):
+        return None
+    n = 0
+    for i in range(0, len(s), _B58_CHUNK):
+        chunk = s[i:i + _B58_CHUNK]
+        value = 0
+        for c in chunk:
+            value = value * 58 + _B58_INDEX[c]
+        n = n * 58 ** len(chunk) + value
+    zeros = len(s) - len(s.lstrip('1'))
+    return b'\0' * zeros + n.to_bytes((n.bit_length() + 7) // 8, 'big')
+
+
+@functools.lru_cache(maxsize=65536)
+def _b58encode(data: bytes) -> str:
+    n = int.from_bytes(data, 'big')
+    chunks = []
+    while n:
+        n, value = divmod(n, _B58_CHUNK_BASE)
+        chars = []
+        for _ in range(_B58_CHUNK):
+            value, digit = divmod(value, 58)
+            chars.append(_B58_ALPHABET[digit])
+        chunks.append(''.join(reversed(chars)))
+    zeros = len(data) - len(data.lstrip(b'\0'))
+    return '1' * zeros + ''.join(reversed(chunks)).lstrip('1')
+
+
+def _write_varint(n: int, out: bytearray):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read(data: bytes, pos: int, strings: list):
+    kind = data[pos]
+    pos += 1
+    if kind == _NONE:
+        return None, pos
+    if kind == _FALSE:
+        return False, pos
+    if kind == _TRUE:
+        return True, pos
+    if kind == _INT:
+        n, pos = _read_varint(data, pos)
+        return (n >> 1) ^ -(n & 1), pos
+    if kind == _FLOAT:
+        return struct.unpack_from('<d', data, pos)[0], pos + 8
+    if kind in (_STR, _STR_REF, _FIELD, _B58):
+        return _read_str(kind, data, pos, strings)
+    if kind == _LIST:
+        count, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = _read(data, pos, strings)
+            items.append(item)
+        return items, pos
+    if kind == _DICT:
+        count, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(count):
+            key, pos = _read_str(data[pos], data, pos + 1, strings)
+            result[key], pos = _read(data, pos, strings)
+        return result, pos
+    raise CodecError(f"Unknown type byte {kind}")
+
+
+def _read_str(kind: int, data: bytes, pos: int, strings: list):
+    if kind == _FIELD:
+        return INTERNED_FIELDS[data[pos]], pos + 1
+    if kind == _STR_REF:
+        index, pos = _read_varint(data, pos)
+        return strings[index], pos
+    if kind in (_STR, _B58):
+        length, pos = _read_varint(data, pos)
+        if pos + length > len(data):
+            raise CodecError("Truncated string")
+        raw = data[pos:pos + length]
+        s = _b58encode(raw) if kind == _B58 else raw.decode('utf-8')
+        strings.append(s)
+        return s, pos + length
+    raise CodecError(f"Expected a string, got type byte {kind}")
+
+
+def _read_varint(data: bytes, pos: int):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+register_codec("compact", "c1", _encode_compact, _decode_compact)
@@ -1,11 +1,23 @@
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, Response, jsonify, request, stream_with_context
+import itertools
+import json
+import mimetypes
 import client
+import download_engine
+import file_index
+import file_stream
+import ipfs_cluster as ipfs
+import jobs
+import kv_service as kv
+import multipart_upload
 import os
+from urllib.parse import quote
+import uuid
 from datetime import datetime
 from flask_cors import CORS
 
-app = Flask(__name__)
-CORS(app)
+# The routes, registered on the app by create_app()
+api = Blueprint('api', __name__)
 
 # @app.route('/upload', methods=['POST'])
 # def upload_file():
@@ -13,33 +25,35 @@ CORS(app)
 #     client.upload_file(file_path)
 #     return jsonify({"status": "File uploaded successfully"}), 200
 
-# Temporary folder to save files
-TEMP_UPLOAD_FOLDER = "temp_uploads"
-os.makedirs(TEMP_UPLOAD_FOLDER, exist_ok=True)
-
-@app.route('/upload', methods=['POST'])
+@api.route('/upload', methods=['POST'])
 def upload_file():
+    # Uploads are streamed to the cluster while they arrive, nothing is written to the server's disk:
+    #   multipart/form-data      a "files" part, optional fields (upload_id, replication_min, replication_max,
+    #                            encrypt, file_size) must come before it
+    #   application/octet-stream the raw file, named by the X-File-Name header or ?file_name=, options as query
+    #                            parameters
+    #   application/json         {"file_path": ...} of a file on the server machine
     try:
-        # Check if a file is part of the request
-        if 'files' in request.files:
-            uploaded_file = request.files['files']
-
-            # Save the file temporarily
-            temp_path = os.path.join(TEMP_UPLOAD_FOLDER, uploaded_file.filename)
-            uploaded_file.save(temp_path)
-
-            # Simulate processing the file via its temporary path
-            client.upload_file(temp_path)
+        if request.mimetype == 'multipart/form-data':
+            return _upload_multipart()
+        elif request.mimetype == 'application/octet-stream':
+            return _upload_raw()
 
-            # Remove the temporary file
-            os.remove(temp_path)
-            return jsonify({"status": "File uploaded successfully", "temp_path": temp_path}), 200
-
-        # If no file, check for a file path in JSON data
-        elif request.json and 'file_path' in request.json:
+        # If no file, check for a file path in JSON data. The file is uploaded by a background job, see /jobs/<job_id>
+        elif request.is_json and request.json and 'file_path' in request.json:
             file_path = request.json.get('file_path')
-            client.upload_file(file_path)
-            return jsonify({"status": "File uploaded successfully"}), 200
+            upload_id = request.json.get('upload_id') or request.headers.get('X-Upload-Id') or uuid.uuid4().hex
+            try:
+                replication_min, replication_max = _replication_factors(request.json)
+                wait = _wait_seconds()
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            try:
+                job = client.submit_upload(file_path, upload_id=upload_id, replication_min=replication_min,
+                                           replication_max=replication_max, encrypt=_flag(request.json, 'encrypt'))
+            except jobs.QueueFull as e:
+                return _queue_full(e)
+            return _job_response(job, wait, "File uploaded successfully", upload_id=upload_id)
 
         # If neither file nor path is provided, return an error
         else:
@@ -48,9 +62,141 @@ def upload_file():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+def _upload_multipart():
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        return jsonify({"error": "multipart/form-data without a boundary"}), 400
+    upload = multipart_upload.MultipartUpload(request.stream, boundary)
+    try:
+        if not upload.open_file():
+            return jsonify({"error": "No file or file path provided"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Pass an upload_id form field (or X-Upload-Id header) to poll /upload_progress/<upload_id> meanwhile
+    return _upload_stream(upload, upload.file_name, upload.fields, request.headers.get('X-File-Size'),
+                          after=upload.finish)
+
+
+def _upload_raw():
+    file_name = request.headers.get('X-File-Name') or request.args.get('file_name')
+    if not file_name:
+        return jsonify({"error": "No file name, set the X-File-Name header or ?file_name="}), 400
+    return _upload_stream(request.stream, file_name, request.args, request.content_length)
+
+
+def _upload_stream(fileobj, file_name, options, size, after=None):
+    upload_id = options.get('upload_id') or request.headers.get('X-Upload-Id') or uuid.uuid4().hex
+    encrypt = _flag(options, 'encrypt')
+    try:
+        replication_min, replication_max = _replication_factors(options)
+        size = options.get('file_size', size)
+        size = int(size) if size not in (None, '') else None
+        if size is not None and size < 0:
+            raise ValueError("file_size must not be negative")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if encrypt and size is None:
+        return jsonify({"error": "file_size (or the X-File-Size header) is required to encrypt an upload"}), 400
+
+    try:
+        cid = client.upload_stream(fileobj, os.path.basename(file_name), size, upload_id=upload_id,
+                                   replication_min=replication_min, replication_max=replication_max, encrypt=encrypt)
+    except ValueError as e:
+        # The body didn't hold the number of bytes announced
+        return jsonify({"error": str(e), "upload_id": upload_id}), 400
+    if cid is None:
+        return jsonify({"error": "The cluster did not accept the file", "upload_id": upload_id}), 502
+    if after is not None:
+        after()
+    return jsonify({"status": "File uploaded successfully", "upload_id": upload_id, "cid": cid,
+                    "file_name": os.path.basename(file_name)}), 200
+
+
+def _replication_factors(values):
+    """
+    Reads the optional "replication_min" / "replication_max" upload fields
+
+    :raises ValueError: If they are not integers
+    """
+    factors = []
+    for name in ('replication_min', 'replication_max'):
+        value = values.get(name)
+        if value is None or value == '':
+            factors.append(None)
+            continue
+        try:
+            factors.append(int(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an integer")
+    return tuple(factors)
+
+
+def _wait_seconds() -> float:
+    """
+    Reads ?wait=SECONDS, how long a request queueing a job waits for it to finish (at most 60 seconds)
+
+    :raises ValueError: If it is not a number
+    """
+    try:
+        return max(0.0, min(float(request.args.get('wait', 0)), 60.0))
+    except ValueError:
+        raise ValueError("wait must be a number")
+
+
+def _job_response(job, wait, done_status, **fields):
+    """
+    202 with the job id while the job runs, or the job's result (merged into the body) if it finished within wait
+    seconds
+    """
+    if wait:
+        job.wait(wait)
+    data = job.to_dict()
+    body = {"job_id": job.id, "status_url": f"/jobs/{job.id}", "job": data, **fields}
+    if data['state'] == jobs.SUCCEEDED:
+        return jsonify({"status": done_status, **body, **(data['result'] or {})}), 200
+    if data['state'] in jobs.FINISHED_STATES:
+        return jsonify({"error": data['error'], **body}), 500
+    return jsonify({"status": f"Job {data['state']}", **body}), 202
+
+
+def _queue_full(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = '5'
+    return response, 429
+
+
+def _flag(values, name) -> bool:
+    """
+    Reads an optional boolean field, sent as JSON true or as "true" / "1" / "yes" / "on" in a form
+    """
+    value = values.get(name)
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'on')
+    return bool(value)
+
         
 
-@app.route('/download', methods=['POST'])
+@api.route('/upload_progress/<string:upload_id>', methods=['GET'])
+def get_upload_progress(upload_id):
+    progress = client.get_upload_progress(upload_id)
+    if progress is None:
+        return jsonify({"error": f"No upload with id {upload_id}"}), 404
+    return jsonify({"data": progress}), 200
+
+@api.route('/replication/<string:cid>', methods=['GET'])
+def get_replication_status(cid):
+    # ?wait=SECONDS holds the request until the replication finished, at most 60 seconds
+    try:
+        wait = min(float(request.args.get('wait', 0)), 60.0)
+    except ValueError:
+        return jsonify({"error": "wait must be a number"}), 400
+    status = client.get_replication_status(cid, wait)
+    if status is None:
+        return jsonify({"error": f"No replication requested for {cid}"}), 404
+    return jsonify({"data": status}), 200
+
+@api.route('/download', methods=['POST'])
 def download_file():
     data = request.json
     cid = data.get('cid')
@@ -66,46 +212,178 @@ def download_file():
     file_path = os.path.join(downloads_folder, filename)
     
     os.makedirs(downloads_folder, exist_ok=True)
-    result = client.download_file(cid, file_path)
+    # peer_id (the uploader) is optional, it saves looking up whether the file is encrypted in every catalog
+    result = client.download_file(cid, file_path, peer_id=data.get('peer_id'))
     if result['success']:
         return jsonify({"status": "success", "message": result['message']}), 200
     else:
         return jsonify({"status": "failure", "message": result['message']}), 500
 
-@app.route('/peers', methods=['GET'])
+@api.route('/download/<string:cid>', methods=['GET'])
+def stream_download(cid):
+    # Streams the file to the caller, nothing is written to the server's disk. Supports single Range requests and
+    # conditional requests: content under a CID never changes, so the CID is a strong ETag and the response can
+    # be cached forever. ?filename= overrides the stored file name, ?inline=1 asks to display the file.
+    etag = cid
+    headers = {
+        'ETag': f'"{etag}"',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=31536000, immutable',
+    }
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    byte_range = request.range
+    if byte_range is not None and len(byte_range.ranges) != 1:
+        # Multiple ranges aren't supported, the whole file is a valid answer
+        byte_range = None
+    if byte_range is not None and 'If-Range' in request.headers and request.if_range.etag != etag:
+        byte_range = None
+
+    try:
+        stream, file_info = client.open_file_stream(cid, byte_range, peer_id=request.args.get('peer_id'))
+    except file_stream.RangeNotSatisfiable as e:
+        headers['Content-Range'] = f"bytes */{e.size}" if e.size is not None else "bytes */*"
+        return Response(status=416, headers=headers)
+    except download_engine.DownloadError as e:
+        return jsonify({"error": str(e)}), 404 if e.status_code == 404 else 502
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
+
+    file_name = request.args.get('filename') or (file_info or {}).get('file_name') or cid
+    disposition = 'inline' if _flag(request.args, 'inline') else 'attachment'
+    headers['Content-Type'] = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    headers['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(file_name)}"
+    if stream.length is not None:
+        headers['Content-Length'] = str(stream.length)
+    if stream.partial:
+        headers['Content-Range'] = stream.content_range
+
+    def generate():
+        try:
+            yield from stream
+        except Exception as e:
+            # Too late for an error status, the client sees fewer bytes than Content-Length
+            print(f"Streaming {cid} failed: {e}")
+
+    response = Response(generate(), status=206 if stream.partial else 200, headers=headers)
+    response.call_on_close(stream.close)
+    return response
+
+@api.route('/peers', methods=['GET'])
 def get_all_peers():
     peers = client.get_all_peers()
     return jsonify(peers), 200
 
-@app.route('/pinned_files', methods=['GET'])
+@api.route('/pinned_files', methods=['GET'])
 def get_all_pinned_files():
-    pinned_files = client.get_all_pinned_file()
-    return jsonify(pinned_files), 200
+    # Streamed pin by pin as a JSON array, or one pin per line with ?format=ndjson.
+    # ?status=pinned,error only lists pins with one of these statuses on some peer, ?peer=, ?type= and ?prefix=
+    # filter like for /all_files. With ?limit=N only one page is sent, the X-Next-Cursor header holds the ?cursor=
+    # of the next one (no header on the last page).
+    args = request.args
+    filters = {'status': args.get('status'), 'peer': args.get('peer'), 'file_type': args.get('type'),
+               'name_prefix': args.get('prefix')}
+    ndjson = args.get('format') == 'ndjson'
+    next_cursor = None
+    try:
+        if 'limit' in args or 'cursor' in args:
+            page = client.get_pinned_page(args.get('limit'), args.get('cursor'), **filters)
+            pins, next_cursor = iter(page['pins']), page['next_cursor']
+        else:
+            pins = client.iter_pinned_files(**filters)
+        # Errors reaching the cluster are reported before the response starts
+        first = list(itertools.islice(pins, 1))
+    except file_index.InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-@app.route('/file_status/<string:cid>', methods=['GET'])
+    def generate():
+        if not ndjson:
+            yield '['
+        try:
+            for i, pin in enumerate(itertools.chain(first, pins)):
+                if ndjson:
+                    yield json.dumps(pin) + '\n'
+                else:
+                    yield (',' if i else '') + json.dumps(pin)
+        except Exception as e:
+            # Too late for an error status, the client sees the body end early
+            print(f"Pin listing failed while streaming: {e}")
+            return
+        if not ndjson:
+            yield ']'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+@api.route('/file_status/<string:cid>', methods=['GET'])
 def get_file_status(cid):
     file_status = client.get_file_status(cid)
     return jsonify(file_status), 200
 
-@app.route('/peer_files/<string:peer_id>', methods=['GET'])
+@api.route('/peer_files/<string:peer_id>', methods=['GET'])
 def get_other_peer_file_structure(peer_id):
     files = client.get_other_peer_file_structure(peer_id)
     return jsonify(files), 200
 
-@app.route('/all_files', methods=['GET'])
+@api.route('/all_files', methods=['GET'])
 def get_all_files():
-    all_files = client.get_all_file()
-    
+    # ?sort=name|size|timestamp&order=asc|desc, filters ?peer=PEER_ID, ?type=pdf,image/* and ?prefix=NAME_PREFIX.
+    # With ?limit=N only one page is sent with "next_cursor", pass it as ?cursor= to get the next page (null on the
+    # last one). Paging defaults to sort=name.
+    args = request.args
+    options = {'sort': args.get('sort'), 'order': args.get('order'), 'peer': args.get('peer'),
+               'file_type': args.get('type'), 'name_prefix': args.get('prefix')}
+    try:
+        if 'limit' in args or 'cursor' in args:
+            page = client.get_file_page(args.get('limit'), args.get('cursor'), **options)
+            return jsonify({"data": page['files'], "next_cursor": page['next_cursor']}), 200
+        all_files = client.get_all_file(**options)
+    except file_index.InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+
     return jsonify({"data": all_files}), 200
 
-@app.route('/delete', methods=['POST'])
+@api.route('/delete', methods=['POST'])
 def delete_file():
+    # Runs as a background job, see /jobs/<job_id>. With ?wait=SECONDS the status is returned if it finished by then.
     data = request.json
     cid = data.get('cid')
-    deletion_status = client.delete_file(cid)
-    return jsonify({"status": deletion_status}), 200
-
-@app.route('/fav_peers', methods=['GET'])
+    try:
+        wait = _wait_seconds()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        job = client.submit_delete(cid)
+    except jobs.QueueFull as e:
+        return _queue_full(e)
+    # The deletion status message of the job result becomes "status"
+    return _job_response(job, wait, None)
+
+@api.route('/jobs', methods=['GET'])
+def get_jobs():
+    return jsonify({"data": client.get_jobs()}), 200
+
+@api.route('/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = client.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"No job with id {job_id}"}), 404
+    return jsonify({"data": job}), 200
+
+@api.route('/jobs/<string:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = client.cancel_job(job_id)
+    if job is None:
+        return jsonify({"error": f"No job with id {job_id}"}), 404
+    return jsonify({"data": job}), 200
+
+@api.route('/fav_peers', methods=['GET'])
 def get_favorite_peers():
 
     try:
@@ -123,7 +401,7 @@ def get_favorite_peers():
             "message": "Failed to fetch favorite peers."
         }), 500
 
-@app.route('/add_fav_peers', methods=['POST'])
+@api.route('/add_fav_peers', methods=['POST'])
 def add_favorite_peer_controller():
     try:
         request_data = request.get_json()
@@ -158,7 +436,7 @@ def add_favorite_peer_controller():
             "message": "Failed to add favorite peer."
         }), 500
 
-@app.route('/rename_fav_peers/<peer_id>', methods=['PUT'])
+@api.route('/rename_fav_peers/<peer_id>', methods=['PUT'])
 def change_nickname_controller(peer_id):
 
     try:
@@ -197,7 +475,7 @@ def change_nickname_controller(peer_id):
             "message": "Failed to change nickname."
         }), 500
 
-@app.route('/remove_fav_peers/<peer_id>', methods=['DELETE'])
+@api.route('/remove_fav_peers/<peer_id>', methods=['DELETE'])
 def remove_favorite_peer_controller(peer_id):
     try:
         updated_favorite_list = client.remove_favorite_peer(peer_id)
@@ -222,10 +500,57 @@ def remove_favorite_peer_controller(peer_id):
         }), 500
 
 
-@app.route('/dashboard/file-stats', methods=['GET'])
+@api.route('/dashboard/file-stats', methods=['GET'])
 def get_dashboard_stats():
     dashboard_data = client.fetch_dashboard_data()
     
     return jsonify({"data": dashboard_data}), 200
+
+@api.route('/kv_cache/stats', methods=['GET'])
+def get_kv_cache_stats():
+    return jsonify({"data": client.get_kv_cache_stats()}), 200
+
+@api.route('/endpoints/stats', methods=['GET'])
+def get_endpoint_stats():
+    return jsonify({"data": client.get_endpoint_stats()}), 200
+
+@api.route('/cid_cache/stats', methods=['GET'])
+def get_cid_cache_stats():
+    return jsonify({"data": client.get_cid_cache_stats()}), 200
+
+@api.route('/gc/status', methods=['GET'])
+def get_gc_status():
+    return jsonify({"data": client.get_gc_status()}), 200
+
+def create_app(job_workers: int = None, job_max_queued: int = None, http_pool_size: int = None,
+               kv_pool_size: int = None) -> Flask:
+    """
+    Builds the Flask app, once per server process: the flask CLI and wsgi.py (gunicorn) both call it.
+    The optional settings override the module defaults before this process opens its ResilientDB / IPFS
+    connections and starts the background job workers.
+
+    :param http_pool_size: Keep-alive connections per cluster/gateway host, at least the number of server threads
+    :param kv_pool_size: Pooled ResilientDB clients
+    """
+    if job_workers is not None:
+        jobs.workers = job_workers
+    if job_max_queued is not None:
+        jobs.max_queued = job_max_queued
+    if http_pool_size is not None:
+        ipfs.http_pool_size = http_pool_size
+        # Importing client already opened a session with the default pool size
+        ipfs.reset_session()
+    if kv_pool_size is not None:
+        kv.pool_size = kv_pool_size
+    client.init_process()
+
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(api)
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server, see wsgi.py for production. Without the reloader, as its parent process would open its own
+    # ResilientDB and IPFS connections too.
+    create_app().run(debug=True, threaded=True, use_reloader=False)
@@ -0,0 +1,299 @@
+"""
+Parallel HTTP Range download engine used by ipfs_cluster.download_file_from_ipfs().
+
+The file is split into fixed-size segments that are fetched concurrently and written at their offset into a
+pre-allocated "<save_path>.part" file. Finished segments are recorded in "<save_path>.part.json", so a failed
+download picks up where it stopped the next time the same content is downloaded to the same path. Once every
+segment is there and the size matches, the part file is renamed to save_path.
+
+Several equivalent URLs (the same content on different gateways) can be given. Every request goes to the first
+one that works and a segment that fails is retried on the next, so a gateway going down mid-download only costs
+the segments that were in flight. Servers that don't support ranges (or don't report a size) are downloaded with a
+single stream.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Bytes written per read from the response
+WRITE_CHUNK_SIZE = 256 * 1024
+# Rounds over all URLs per segment before the download is given up
+SEGMENT_ATTEMPTS = 3
+SEGMENT_RETRY_DELAY = 1.0  # seconds, doubled on every retry
+
+STATE_VERSION = 1
+
+
+class DownloadError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Sources:
+    """
+    The candidate URLs of a download plus the callbacks reporting how each of them did
+    """
+
+    def __init__(self, urls, on_success, on_failure):
+        self._urls = urls
+        self._on_success = on_success
+        self._on_failure = on_failure
+
+    def urls(self) -> list:
+        urls = self._urls() if callable(self._urls) else self._urls
+        return [urls] if isinstance(urls, str) else list(urls)
+
+    def success(self, url, response, nbytes):
+        if self._on_success is not None:
+            self._on_success(url, response.elapsed.total_seconds(), nbytes)
+
+    def failure(self, url, error):
+        # A 4xx is about the request (e.g. unknown CID), not the health of the server
+        status_code = getattr(error, 'status_code', None)
+        if self._on_failure is not None and (status_code is None or status_code >= 500):
+            self._on_failure(url)
+
+
+def download(session: requests.Session, urls, save_path: str, segment_size: int, concurrency: int,
+             timeout=None, source_id: str = None, progress_callback=None, on_success=None,
+             on_failure=None) -> dict:
+    """
+    Downloads a file to save_path.
+
+    :param urls: URL of the file, a list of equivalent URLs in order of preference, or a callable returning such
+                 a list (called again before every request, so the order can change during the download)
+    :param source_id: Identifies the content (e.g. the CID), a partial download is only resumed for the same id
+    :param progress_callback: Called as progress_callback(bytes_done, total_bytes) as segments complete
+    :param on_success: Called as on_success(url, seconds_to_response, bytes) after each successful request
+    :param on_failure: Called as on_failure(url) when a server errors or can't be reached
+    :return: {"success": bool, "message": str}
+    """
+    sources = _Sources(urls, on_success, on_failure)
+    part_path = save_path + ".part"
+    state_path = save_path + ".part.json"
+    try:
+        if not sources.urls():
+            raise DownloadError("No download URL available")
+        total, etag = _probe(session, sources, part_path, timeout)
+        if total is not None:
+            _download_segments(session, sources, part_path, state_path, total, etag, segment_size, concurrency,
+                               timeout, source_id or sources.urls()[0], progress_callback)
+        os.replace(part_path, save_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+    except (DownloadError, requests.exceptions.RequestException, OSError) as e:
+        return {"success": False, "message": f"Error downloading file from IPFS: {e}"}
+    return {"success": True, "message": f"File downloaded successfully and saved to {save_path}"}
+
+
+def _probe(session, sources, part_path, timeout):
+    """
+    Asks the first working URL for the first byte. A server without range support answers with the whole file,
+    which is then written to part_path right away.
+
+    :return: (total size, etag) if the server supports range requests, otherwise (None, None)
+    """
+    last_error = None
+    for url in sources.urls():
+        try:
+            with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=timeout) as response:
+                if response.status_code == 206:
+                    total = parse_content_range(response.headers.get('Content-Range'))[2]
+                    if total is not None:
+                        sources.success(url, response, 0)
+                        return total, response.headers.get('ETag')
+                elif response.status_code == 200:
+                    sources.success(url, response, _write_single(response, part_path))
+                    return None, None
+                else:
+                    raise DownloadError(f"Failed to download file. Status code: {response.status_code}. "
+                                        f"Response: {response.text}", response.status_code)
+            # 206 without a total size, start over without the range header
+            return _download_single(session, sources, url, part_path, timeout)
+        except (DownloadError, requests.exceptions.RequestException) as e:
+            print(f"Download from {url} failed: {e}")
+            sources.failure(url, e)
+            last_error = e
+    raise last_error
+
+
+def _download_single(session, sources, url, part_path, timeout):
+    with session.get(url, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise DownloadError(f"Failed to download file. Status code: {response.status_code}. "
+                                f"Response: {response.text}", response.status_code)
+        sources.success(url, response, _write_single(response, part_path))
+    return None, None
+
+
+def _write_single(response, part_path):
+    expected = response.headers.get('Content-Length')
+    written = 0
+    with open(part_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=WRITE_CHUNK_SIZE):
+            f.write(chunk)
+            written += len(chunk)
+    if expected is not None and written != int(expected):
+        raise DownloadError(f"Incomplete download: got {written} of {expected} bytes")
+    return written
+
+
+def _download_segments(session, sources, part_path, state_path, total, etag, segment_size, concurrency, timeout,
+                       source_id, progress_callback):
+    segments = [(start, min(start + segment_size, total) - 1) for start in range(0, total, segment_size)]
+    state = _load_state(state_path, part_path, source_id, total, segment_size, etag)
+    if state is None:
+        state = {'version': STATE_VERSION, 'source': source_id, 'size': total, 'segment_size': segment_size,
+                 'etag': etag, 'done': []}
+        with open(part_path, "wb") as f:
+            _preallocate(f, total)
+        _save_state(state_path, state)
+    else:
+        print(f"Resuming download, {len(state['done'])} of {len(segments)} segments already done")
+
+    done = set(state['done'])
+    state_lock = threading.Lock()
+    bytes_done = [sum(segments[i][1] - segments[i][0] + 1 for i in done)]
+
+    fd = os.open(part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        writer = _PositionalWriter(fd)
+
+        def fetch(index):
+            start, end = segments[index]
+            _fetch_segment(session, sources, writer, start, end, total, timeout)
+            with state_lock:
+                done.add(index)
+                state['done'] = sorted(done)
+                _save_state(state_path, state)
+                bytes_done[0] += end - start + 1
+                if progress_callback is not None:
+                    progress_callback(bytes_done[0], total)
+
+        pending = [i for i in range(len(segments)) if i not in done]
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            # list() re-raises the first segment failure after the others finished
+            list(executor.map(fetch, pending))
+    finally:
+        os.close(fd)
+
+    if len(done) != len(segments) or os.path.getsize(part_path) != total:
+        raise DownloadError("Download incomplete, missing segments")
+
+
+def _fetch_segment(session, sources, writer, start, end, total, timeout):
+    """
+    Tries the URLs in order, starting over from the first one with a growing delay once every URL failed
+    """
+    delay = SEGMENT_RETRY_DELAY
+    attempt = 0
+    while True:
+        urls = sources.urls()
+        url = urls[attempt % len(urls)]
+        try:
+            response = _fetch_segment_once(session, url, writer, start, end, total, timeout)
+            sources.success(url, response, end - start + 1)
+            return
+        except (DownloadError, requests.exceptions.RequestException) as e:
+            sources.failure(url, e)
+            attempt += 1
+            if attempt >= SEGMENT_ATTEMPTS * len(urls):
+                raise
+            print(f"Segment {start}-{end} from {url} failed ({e}), retrying")
+            if attempt % len(urls) == 0:
+                time.sleep(delay)
+                delay *= 2
+
+
+def _fetch_segment_once(session, url, writer, start, end, total, timeout):
+    headers = {'Range': f'bytes={start}-{end}'}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code != 206:
+            raise DownloadError(f"Range request for bytes {start}-{end} returned {response.status_code}",
+                                response.status_code)
+        range_start, range_end, range_total = parse_content_range(response.headers.get('Content-Range'))
+        if range_start != start or range_end != end or range_total != total:
+            raise DownloadError(f"Asked for bytes {start}-{end}/{total}, got {range_start}-{range_end}/{range_total}")
+        offset = start
+        for chunk in response.iter_content(chunk_size=WRITE_CHUNK_SIZE):
+            if offset + len(chunk) > end + 1:
+                raise DownloadError(f"Server sent more than bytes {start}-{end}")
+            writer.write_at(chunk, offset)
+            offset += len(chunk)
+    if offset != end + 1:
+        raise DownloadError(f"Segment {start}-{end} ended after {offset - start} bytes")
+    return response
+
+
+class _PositionalWriter:
+    def __init__(self, fd):
+        self.fd = fd
+        self._lock = threading.Lock()
+
+    def write_at(self, data, offset):
+        if hasattr(os, 'pwrite'):
+            while data:
+                written = os.pwrite(self.fd, data, offset)
+                data, offset = data[written:], offset + written
+            return
+        with self._lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            while data:
+                written = os.write(self.fd, data)
+                data = data[written:]
+
+
+def _preallocate(f, size):
+    if hasattr(os, 'posix_fallocate') and size > 0:
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass
+    f.truncate(size)
+
+
+def parse_content_range(header):
+    """
+    :return: (start, end, total) of a "bytes START-END/TOTAL" header, None for the parts that are missing
+    """
+    try:
+        unit, _, rest = header.partition(' ')
+        if unit != 'bytes':
+            return None, None, None
+        span, _, total = rest.partition('/')
+        total = int(total) if total != '*' else None
+        if span == '*':
+            # "bytes */TOTAL" of a 416 response
+            return None, None, total
+        start, _, end = span.partition('-')
+        return int(start), int(end), total
+    except (AttributeError, ValueError):
+        return None, None, None
+
+
+def _load_state(state_path, part_path, source_id, total, segment_size, etag):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (state.get('version') != STATE_VERSION or state.get('source') != source_id or state.get('size') != total
+            or state.get('segment_size') != segment_size or state.get('etag') != etag
+            or not os.path.exists(part_path)
+            or os.path.getsize(part_path) != total):
+        return None
+    return state
+
+
+def _save_state(state_path, state):
+    temp_path = state_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
@@ -0,0 +1,181 @@
+"""
+Health and latency tracking for a set of equivalent HTTP endpoints (IPFS Cluster APIs or gateways).
+
+Every request reports back how long the endpoint took to answer, or that it failed. candidates() orders the
+endpoints fastest healthy first, so callers try them in that order and fail over to the next one on errors. An
+endpoint is marked unhealthy after failure_threshold failures in a row and healthy again by the next successful
+request or background probe.
+"""
+
+import threading
+import time
+
+# Weight of the newest sample in the latency moving average
+LATENCY_SMOOTHING = 0.3
+
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.latency = None  # seconds, moving average, None until measured
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.last_probe = None
+
+    def stats(self) -> dict:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'requests': self.requests,
+            'failures': self.failures,
+            'bytes': self.bytes,
+            'last_probe': self.last_probe,
+        }
+
+
+class EndpointPool:
+    def __init__(self, name: str, urls, probe_path: str, probe_method: str = 'GET', failure_threshold: int = 2):
+        """
+        :param urls: Base URLs, in order of preference until latencies are known
+        :param probe_path: Path appended to a base URL by probe()
+        """
+        if not urls:
+            raise ValueError(f"No {name} endpoints configured")
+        self.name = name
+        self.probe_path = probe_path
+        self.probe_method = probe_method
+        self.failure_threshold = failure_threshold
+        self._endpoints = [Endpoint(url) for url in urls]
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> list:
+        return [endpoint.url for endpoint in self._endpoints]
+
+    def candidates(self) -> list:
+        """
+        :return: Every base URL, healthy ones first, fastest first, then in configured order
+        """
+        with self._lock:
+            order = sorted(enumerate(self._endpoints), key=lambda item: (
+                not item[1].healthy,
+                item[1].latency if item[1].latency is not None else float('inf'),
+                item[0],
+            ))
+            return [endpoint.url for _, endpoint in order]
+
+    def best(self) -> str:
+        return self.candidates()[0]
+
+    def record_success(self, url: str, latency: float, nbytes: int = 0):
+        with self._lock:
+            endpoint = self._find(url)
+            if endpoint is None:
+                return
+            endpoint.requests += 1
+            endpoint.bytes += nbytes
+            endpoint.consecutive_failures = 0
+            endpoint.healthy = True
+            self._add_latency(endpoint, latency)
+
+    def record_failure(self, url: str):
+        with self._lock:
+            endpoint = self._find(url)
+            if endpoint is None:
+                return
+            endpoint.requests += 1
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold and endpoint.healthy:
+                endpoint.healthy = False
+                print(f"{self.name} endpoint {url} marked unhealthy")
+
+    def probe(self, session, timeout):
+        """
+        Sends probe_method probe_path to every endpoint and updates health and latency. Responses below 500 count
+        as healthy, the probe only checks that the endpoint is up and how fast it answers.
+        """
+        for url in self.urls:
+            start = time.perf_counter()
+            try:
+                response = session.request(self.probe_method, url.rstrip('/') + '/' + self.probe_path,
+                                           timeout=timeout)
+                response.close()
+                ok = response.status_code < 500
+            except Exception:
+                ok = False
+            latency = time.perf_counter() - start
+            with self._lock:
+                endpoint = self._find(url)
+                endpoint.last_probe = time.time()
+                if ok:
+                    endpoint.consecutive_failures = 0
+                    if not endpoint.healthy:
+                        print(f"{self.name} endpoint {url} is healthy again")
+                    endpoint.healthy = True
+                    self._add_latency(endpoint, latency)
+                else:
+                    endpoint.consecutive_failures += 1
+                    if endpoint.consecutive_failures >= self.failure_threshold and endpoint.healthy:
+                        endpoint.healthy = False
+                        print(f"{self.name} endpoint {url} marked unhealthy")
+
+    def stats(self) -> list:
+        with self._lock:
+            return [endpoint.stats() for endpoint in self._endpoints]
+
+    def _find(self, url):
+        for endpoint in self._endpoints:
+            if endpoint.url == url:
+                return endpoint
+        return None
+
+    @staticmethod
+    def _add_latency(endpoint, latency):
+        if endpoint.latency is None:
+            endpoint.latency = latency
+        else:
+            endpoint.latency += LATENCY_SMOOTHING * (latency - endpoint.latency)
+
+
+class Prober:
+    """
+    Daemon thread probing a set of pools every interval seconds
+    """
+
+    def __init__(self, pools, get_session, interval: float, timeout):
+        self.pools = pools
+        self.get_session = get_session
+        self.interval = interval
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="endpoint-prober", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for pool in self.pools:
+                try:
+                    pool.probe(self.get_session(), self.timeout)
+                except Exception as e:
+                    print(f"Probing {pool.name} endpoints failed: {e}")
+            self._stop.wait(self.interval)
+
+
+def parse_urls(line: str) -> list:
+    """
+    :return: The URLs of a comma or whitespace separated config line, each ending with '/'
+    """
+    urls = []
+    for url in line.replace(',', ' ').split():
+        urls.append(url if url.endswith('/') else url + '/')
+    return urls
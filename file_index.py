@@ -0,0 +1,251 @@
+"""
+Sorted, filterable view of the files of all peers, so /all_files can be paged through without reading every
+catalog for every page.
+
+Building the index reads all catalogs and checks every CID in ResilientDB, as get_all_file() always did. The result
+is shared by the requests of the next `ttl` seconds, and local uploads and deletes invalidate it. Serving a page is
+then a binary search for the cursor plus a scan over the matching entries. Only the page is copied into the
+response.
+
+A cursor holds the sort key of the last file sent, not a position. A page boundary therefore stays put when files
+are added or removed between two requests, or the index is rebuilt meanwhile.
+"""
+
+import base64
+import json
+import mimetypes
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+ttl = 10.0  # seconds
+default_limit = 100
+max_limit = 1000
+
+SORT_FIELDS = ('name', 'size', 'timestamp')
+
+_index = None
+_index_lock = threading.Lock()
+# Bumped by invalidate(), an index built before that is stale
+_generation = 0
+
+
+class InvalidQuery(ValueError):
+    """
+    Unknown sort field or order, bad limit or a cursor that wasn't issued for this query
+    """
+
+
+class FileIndex:
+    def __init__(self, files: list, generation: int = 0):
+        """
+        :param files: The file list of get_all_file(), in catalog order
+        """
+        self.files = files
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self._views = {}  # (sort, peer) -> (sorted keys, files in the same order)
+        self._views_lock = threading.Lock()
+
+    def select(self, sort: str = None, order: str = 'asc', peer: str = None, file_type=None,
+               name_prefix: str = None):
+        """
+        Yields all matching files, see page() for the parameters. Without sort they come in catalog order.
+        """
+        descending = _check_order(order)
+        types = parse_file_types(file_type)
+        if sort is None:
+            files = [f for f in self.files if peer is None or f['peerID'] == peer]
+            for f in (reversed(files) if descending else files):
+                if name_matches(f['fileName'], name_prefix, types):
+                    yield dict(f)
+            return
+        _, files = self._view(sort, peer)
+        for i in self._scan(sort, descending, peer, name_prefix, None):
+            if name_matches(files[i]['fileName'], name_prefix, types):
+                yield dict(files[i])
+
+    def page(self, limit: int = None, cursor: str = None, sort: str = None, order: str = 'asc', peer: str = None,
+             file_type=None, name_prefix: str = None) -> dict:
+        """
+        :param limit: Files per page, at most max_limit
+        :param cursor: next_cursor of the previous page, None for the first page
+        :param sort: 'name', 'size' or 'timestamp' (default 'name'), ties are ordered by CID
+        :param order: 'asc' or 'desc'
+        :param peer: Only files of this peer
+        :param file_type: Only files of these types, see parse_file_types()
+        :param name_prefix: Only files whose name starts with this, ignoring case
+        :return: {'files': [...], 'next_cursor': str, None on the last page}
+        :raises InvalidQuery: If an argument is invalid
+        """
+        limit = check_limit(limit)
+        sort = sort or 'name'
+        descending = _check_order(order)
+        types = parse_file_types(file_type)
+        after = None
+        if cursor is not None:
+            values = decode_cursor(cursor)
+            if len(values) != 4 or values[:2] != [sort, descending] or not isinstance(values[3], str) \
+                    or not isinstance(values[2], int if sort == 'size' else str):
+                raise InvalidQuery("The cursor belongs to a different sort order")
+            after = (values[2], values[3])
+
+        keys, files = self._view(sort, peer)
+        page = []
+        next_cursor = None
+        for i in self._scan(sort, descending, peer, name_prefix, after):
+            if not name_matches(files[i]['fileName'], name_prefix, types):
+                continue
+            if len(page) == limit:
+                last = page[-1][0]
+                next_cursor = encode_cursor([sort, descending, keys[last][0], keys[last][1]])
+                break
+            page.append((i, files[i]))
+        return {'files': [dict(f) for _, f in page], 'next_cursor': next_cursor}
+
+    def _scan(self, sort, descending, peer, name_prefix, after):
+        """
+        Yields the positions in the (sort, peer) view that can match, in the requested order
+        """
+        keys, _ = self._view(sort, peer)
+        lo, hi = 0, len(keys)
+        if sort == 'name' and name_prefix:
+            # Names sharing the prefix are next to each other
+            prefix = name_prefix.casefold()
+            lo = bisect_left(keys, (prefix,))
+            hi = bisect_left(keys, (prefix + '\U0010ffff',))
+        if after is not None:
+            if descending:
+                hi = min(hi, bisect_left(keys, after))
+            else:
+                lo = max(lo, bisect_right(keys, after))
+        return range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+
+    def _view(self, sort, peer):
+        view = self._views.get((sort, peer))
+        if view is None:
+            if sort not in SORT_FIELDS:
+                raise InvalidQuery(f"Unknown sort field {sort}, use one of {', '.join(SORT_FIELDS)}")
+            with self._views_lock:
+                view = self._views.get((sort, peer))
+                if view is None:
+                    entries = sorted((_sort_key(sort, f), f) for f in self.files
+                                     if peer is None or f['peerID'] == peer)
+                    view = ([key for key, _ in entries], [f for _, f in entries])
+                    self._views[(sort, peer)] = view
+        return view
+
+
+def get_index(load) -> FileIndex:
+    """
+    Returns the index shared by the process, rebuilt with load() when it is older than ttl or was invalidated.
+    Concurrent callers wait for the build already in progress instead of starting their own.
+
+    :param load: Returns the file list of get_all_file()
+    """
+    global _index
+    index = _index
+    if _is_current(index):
+        return index
+    with _index_lock:
+        if not _is_current(_index):
+            generation = _generation
+            _index = FileIndex(load(), generation)
+        return _index
+
+
+def invalidate():
+    """
+    Makes the next get_index() call rebuild the index, called after a file was added or removed
+    """
+    global _generation
+    _generation += 1
+
+
+def parse_file_types(value):
+    """
+    :param value: Comma separated string or list of file extensions ("pdf", ".png") and MIME types ("text/plain",
+                  "image/*"), None for any type
+    :return: Normalized frozenset, None for any type
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    types = frozenset(t.strip().lower().lstrip('.') for t in value if t.strip())
+    return types or None
+
+
+def name_matches(name, name_prefix: str = None, file_types=None) -> bool:
+    """
+    :param file_types: Result of parse_file_types()
+    """
+    name = name or ''
+    if name_prefix and not name.casefold().startswith(name_prefix.casefold()):
+        return False
+    if not file_types:
+        return True
+    extension = os.path.splitext(name)[1].lower().lstrip('.')
+    if extension in file_types:
+        return True
+    mime_type = mimetypes.guess_type(name)[0] or ''
+    return any(t == mime_type or (t.endswith('/*') and mime_type.startswith(t[:-1]))
+               for t in file_types if '/' in t)
+
+
+def check_limit(limit) -> int:
+    """
+    :raises InvalidQuery: If limit isn't a positive number
+    """
+    if limit is None:
+        return default_limit
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidQuery(f"Invalid limit {limit}")
+    if limit < 1:
+        raise InvalidQuery("The limit must be at least 1")
+    return min(limit, max_limit)
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    :raises InvalidQuery: If cursor wasn't made by encode_cursor()
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError):
+        raise InvalidQuery("Invalid cursor")
+    if not isinstance(values, list):
+        raise InvalidQuery("Invalid cursor")
+    return values
+
+
+def _is_current(index) -> bool:
+    return index is not None and index.generation == _generation and time.monotonic() - index.built_at < ttl
+
+
+def _check_order(order) -> bool:
+    """
+    :return: True for descending
+    """
+    if order in (None, 'asc'):
+        return False
+    if order == 'desc':
+        return True
+    raise InvalidQuery(f"Unknown order {order}, use asc or desc")
+
+
+def _sort_key(sort, f) -> tuple:
+    if sort == 'name':
+        value = (f['fileName'] or '').casefold()
+    elif sort == 'size':
+        value = f['fileSize'] if isinstance(f['fileSize'], int) else 0
+    else:
+        value = f.get('timestamp') or ''
+    return value, f['CID']
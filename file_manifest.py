@@ -0,0 +1,268 @@
+"""
+Per peer file catalog stored as separate ResilientDB keys, so adding or removing a file only rewrites a
+constant amount of data instead of the whole catalog.
+
+Layout:
+    "<PEER_ID> MANIFEST"           -> {"version": 2, "pages": N}
+    "<PEER_ID> MANIFEST <PAGE>"    -> [CID, CID, ...]              (at most PAGE_SIZE CIDs)
+    "<PEER_ID> FILE <CID>"         -> {"file_name": ..., "file_size": ..., "timestamp": ..., "page": PAGE}
+All values are encoded with codec.py.
+
+The legacy layout kept the whole catalog as one JSON dict under "<PEER_ID>". Peers without a manifest are still
+read from there, and our own legacy catalog is migrated the first time we write to it.
+"""
+
+import threading
+
+import codec
+import kv_service as kv
+
+MANIFEST_VERSION = 2
+PAGE_SIZE = 128
+
+# Serializes catalog writes within this process. Other processes of this node are handled by the compare-and-set
+# in kv_service.update_obj(); a peer's catalog is only ever written by that peer's node.
+_write_lock = threading.Lock()
+
+
+def manifest_key(peer_id: str) -> str:
+    return f"{peer_id} MANIFEST"
+
+
+def page_key(peer_id: str, page: int) -> str:
+    return f"{peer_id} MANIFEST {page}"
+
+
+def file_key(peer_id: str, cid: str) -> str:
+    return f"{peer_id} FILE {cid}"
+
+
+def add_file(peer_id: str, cid: str, file_info: dict):
+    """
+    Adds (or updates) one file in a peer's catalog
+
+    :param peer_id: The peer that owns the file
+    :param cid: The file CID
+    :param file_info: {"file_name": ..., "file_size": ..., "timestamp": ...}
+    """
+    with _write_lock:
+        header = _load_header_for_write(peer_id)
+        record = _parse(kv.get_kv(file_key(peer_id, cid), fresh=True), None)
+        if isinstance(record, dict) and 'page' in record:
+            # Already listed, only the metadata changes
+            _set(file_key(peer_id, cid), codec.encode(dict(file_info, page=record['page'])))
+            return
+
+        while True:
+            page = header.get('pages', 0) - 1
+            if page >= 0 and _append_to_page(peer_id, page, cid, file_info):
+                return
+
+            # The last page is full (or there is none yet), add a page unless another writer just did
+            def add_page(current):
+                if current.get('pages', 0) != page + 1:
+                    return None
+                return dict(current, version=MANIFEST_VERSION, pages=page + 2)
+
+            header = kv.update_obj(manifest_key(peer_id), add_page)
+
+
+def remove_file(peer_id: str, cid: str) -> bool:
+    """
+    Removes one file from a peer's catalog
+
+    :return: True if the file was listed, otherwise False
+    """
+    with _write_lock:
+        _load_header_for_write(peer_id)
+        record = _parse(kv.get_kv(file_key(peer_id, cid), fresh=True), None)
+        if not isinstance(record, dict) or 'page' not in record:
+            return False
+
+        def remove(cids):
+            if cid not in cids:
+                return None
+            cids.remove(cid)
+            return cids
+
+        kv.update_obj(page_key(peer_id, record['page']), remove, default=list)
+        # ResilientDB has no delete, an empty value marks the record as gone
+        _set(file_key(peer_id, cid), "")
+        return True
+
+
+def find_file(peer_ids, cid: str):
+    """
+    Looks up the record of one file in the catalogs of several peers with a single batched KV call.
+    Only the paged layout is searched, files listed in a legacy catalog are not found.
+
+    :return: (PEER_ID, {"file_name": ..., "file_size": ..., "timestamp": ...}) of the first peer listing cid,
+             (None, None) if none does
+    """
+    peer_ids = list(dict.fromkeys(peer_ids))
+    records = kv.multi_get(file_key(peer_id, cid) for peer_id in peer_ids)
+    for peer_id in peer_ids:
+        record = _parse(records.get(file_key(peer_id, cid), ""), None)
+        if isinstance(record, dict) and 'page' in record:
+            record.pop('page')
+            return peer_id, record
+    return None, None
+
+
+def get_files(peer_id: str) -> dict:
+    """
+    :return: The peer's catalog in the legacy format {CID: {"file_name": ..., "file_size": ..., "timestamp": ...}}
+    """
+    return get_files_for_peers([peer_id])[peer_id]
+
+
+def get_files_for_peers(peer_ids) -> dict:
+    """
+    Reads the catalogs of several peers with three batched KV calls, whatever the number of peers and files.
+
+    :return: {PEER_ID: catalog}, see get_files()
+    """
+    peer_ids = list(dict.fromkeys(peer_ids))
+    headers = kv.multi_get(manifest_key(peer_id) for peer_id in peer_ids)
+    # Legacy catalogs and manifest pages are fetched in the same batch
+    legacy_and_pages = kv.multi_get(_legacy_peers(peer_ids, headers) + _page_keys(peer_ids, headers))
+    records = kv.multi_get(_file_keys(peer_ids, headers, legacy_and_pages))
+    return _assemble(peer_ids, headers, legacy_and_pages, records)
+
+
+def migrate_legacy(peer_id: str) -> bool:
+    """
+    Copies a legacy single-blob catalog into the paged layout. The legacy key is left untouched.
+
+    :return: True if a migration happened, False if the peer already has a manifest
+    """
+    with _write_lock:
+        if _parse_header(kv.get_kv(manifest_key(peer_id), fresh=True)) is not None:
+            return False
+        _migrate(peer_id)
+        return True
+
+
+def _load_header_for_write(peer_id: str) -> dict:
+    header = _parse_header(kv.get_kv(manifest_key(peer_id), fresh=True))
+    if header is None:
+        header = _migrate(peer_id)
+    return header
+
+
+def _migrate(peer_id: str) -> dict:
+    legacy = _parse(kv.get_kv(peer_id, fresh=True), {})
+    if not isinstance(legacy, dict):
+        legacy = {}
+    updates = {}
+    cids = list(legacy)
+    pages = (len(cids) + PAGE_SIZE - 1) // PAGE_SIZE
+    for page in range(pages):
+        page_cids = cids[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        updates[page_key(peer_id, page)] = codec.encode(page_cids)
+        for cid in page_cids:
+            updates[file_key(peer_id, cid)] = codec.encode(dict(legacy[cid], page=page))
+    header = {'version': MANIFEST_VERSION, 'pages': pages}
+    updates[manifest_key(peer_id)] = codec.encode(header)
+    if cids:
+        print(f"Migrating {len(cids)} files of {peer_id} to the paged manifest")
+    _write_all(updates, last=manifest_key(peer_id))
+    return header
+
+
+def _append_to_page(peer_id: str, page: int, cid: str, file_info: dict) -> bool:
+    """
+    :return: True if cid was appended to the page, False if the page is full
+    """
+    appended = False
+
+    def append(cids):
+        nonlocal appended
+        appended = False
+        if len(cids) >= PAGE_SIZE:
+            return None
+        appended = True
+        if cid in cids:
+            return None
+        cids.append(cid)
+        return cids
+
+    # The record goes first so a listed CID always has its metadata
+    _set(file_key(peer_id, cid), codec.encode(dict(file_info, page=page)))
+    kv.update_obj(page_key(peer_id, page), append, default=list)
+    return appended
+
+
+def _set(key: str, value: str):
+    if not kv.set_kv(key, value):
+        raise RuntimeError(f"Failed to write {key} to ResilientDB")
+
+
+def _write_all(updates: dict, last: str = None):
+    first = {key: value for key, value in updates.items() if key != last}
+    for key, ok in kv.multi_set(first).items():
+        if not ok:
+            raise RuntimeError(f"Failed to write {key} to ResilientDB")
+    if last in updates and not kv.set_kv(last, updates[last]):
+        raise RuntimeError(f"Failed to write {last} to ResilientDB")
+
+
+def _legacy_peers(peer_ids, headers):
+    return [peer_id for peer_id in peer_ids if _parse_header(headers[manifest_key(peer_id)]) is None]
+
+
+def _page_keys(peer_ids, headers):
+    keys = []
+    for peer_id in peer_ids:
+        header = _parse_header(headers[manifest_key(peer_id)])
+        if header is not None:
+            keys.extend(page_key(peer_id, page) for page in range(header['pages']))
+    return keys
+
+
+def _file_keys(peer_ids, headers, pages):
+    keys = []
+    for peer_id in peer_ids:
+        for cid in _peer_cids(peer_id, headers, pages):
+            keys.append(file_key(peer_id, cid))
+    return keys
+
+
+def _peer_cids(peer_id, headers, pages):
+    header = _parse_header(headers[manifest_key(peer_id)])
+    if header is None:
+        return []
+    cids = []
+    for page in range(header['pages']):
+        page_cids = _parse(pages.get(page_key(peer_id, page), ""), [])
+        if isinstance(page_cids, list):
+            cids.extend(page_cids)
+    return cids
+
+
+def _assemble(peer_ids, headers, legacy_and_pages, records) -> dict:
+    catalogs = {}
+    for peer_id in peer_ids:
+        if _parse_header(headers[manifest_key(peer_id)]) is None:
+            catalog = _parse(legacy_and_pages.get(peer_id, ""), {})
+            catalogs[peer_id] = catalog if isinstance(catalog, dict) else {}
+            continue
+        catalog = {}
+        for cid in _peer_cids(peer_id, headers, legacy_and_pages):
+            record = _parse(records.get(file_key(peer_id, cid), ""), None)
+            if isinstance(record, dict):
+                record.pop('page', None)
+                catalog[cid] = record
+        catalogs[peer_id] = catalog
+    return catalogs
+
+
+def _parse_header(raw: str):
+    header = _parse(raw, None)
+    if isinstance(header, dict) and isinstance(header.get('pages'), int):
+        return header
+    return None
+
+
+def _parse(raw: str, default):
+    return codec.decode(raw, default)
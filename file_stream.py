@@ -0,0 +1,191 @@
+"""
+Streams a file, or one byte range of it, from the IPFS gateway to an HTTP caller without writing it to disk.
+
+Range requests are forwarded to the gateway; a gateway answering with the whole file is sliced locally instead.
+Encrypted files (aes.py chunked format) are decrypted on the way: the header is fetched first, then only the
+chunks covering the requested plaintext range. Unencrypted files already in the local CID cache are read from there.
+"""
+
+import os
+
+import aes
+import cid_cache
+import download_engine
+import ipfs_cluster as ipfs
+
+# Bytes per piece handed to the HTTP response
+chunk_size = 256 * 1024
+# Serve files found in the local CID cache from there instead of the gateway
+use_cache = True
+
+
+class RangeNotSatisfiable(Exception):
+    def __init__(self, size):
+        super().__init__(f"Range not satisfiable for a file of {size} bytes")
+        self.size = size
+
+
+class FileStream:
+    """
+    Iterable over the bytes to send. close() must be called once the response is done (or abandoned).
+    """
+
+    def __init__(self, size, start: int, length, chunks, close=None, partial: bool = False):
+        """
+        :param size: Size of the whole file, None if unknown
+        :param start: Offset of the first byte sent
+        :param length: Number of bytes sent, None if unknown
+        :param partial: True if this is a byte range (206), False for the whole file (200)
+        """
+        self.size = size
+        self.start = start
+        self.length = length
+        self.partial = partial
+        self._chunks = chunks
+        self._close = close
+
+    @property
+    def content_range(self) -> str:
+        size = self.size if self.size is not None else '*'
+        return f"bytes {self.start}-{self.start + self.length - 1}/{size}"
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+
+def open_stream(cid: str, file_info: dict = None, byte_range=None, from_cache: bool = True) -> FileStream:
+    """
+    :param file_info: The file record of cid, if it is encrypted this holds the key
+    :param byte_range: A single range to send, as a werkzeug.datastructures.Range, None for the whole file
+    :param from_cache: False if the copy in the local cache must not be served, e.g. because the file was deleted
+    :raises RangeNotSatisfiable: If byte_range lies outside of the file
+    :raises download_engine.DownloadError: If no gateway has the file
+    :raises ValueError: If an encrypted file fails authentication before anything was sent
+    """
+    if use_cache and from_cache and file_info is not None and not file_info.get('encrypted'):
+        f = cid_cache.get_cache().open(cid)
+        if f is not None:
+            return _open_file(f, byte_range)
+    if file_info is not None and file_info.get('encrypted'):
+        if file_info.get('cipher') != aes.CHUNKED_CIPHER or not file_info.get('key'):
+            raise download_engine.DownloadError(f"Unsupported encryption {file_info.get('cipher')} for {cid}")
+        return _open_encrypted(cid, file_info['key'], byte_range)
+    return _open_plain(cid, byte_range)
+
+
+def _open_plain(cid, byte_range) -> FileStream:
+    headers = {'Range': byte_range.to_header()} if byte_range is not None else None
+    response = _get(cid, headers)
+    if response.status_code == 206:
+        start, end, total = download_engine.parse_content_range(response.headers.get('Content-Range'))
+        if start is None or end is None:
+            response.close()
+            raise download_engine.DownloadError("Gateway sent an invalid Content-Range", 502)
+        return FileStream(total, start, end - start + 1, response.iter_content(chunk_size), response.close,
+                          partial=True)
+
+    size = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+    pieces = response.iter_content(chunk_size)
+    if byte_range is None or size is None:
+        # Without a size the range can't be resolved, sending the whole file is allowed then
+        return FileStream(size, 0, size, pieces, response.close)
+    span = byte_range.range_for_length(size)
+    if span is None:
+        response.close()
+        raise RangeNotSatisfiable(size)
+    start, stop = span
+    return FileStream(size, start, stop - start, _slice(pieces, start, stop - start), response.close, partial=True)
+
+
+def _open_encrypted(cid, key, byte_range) -> FileStream:
+    response = _get(cid, {'Range': f"bytes=0-{aes.CHUNKED_HEADER.size - 1}"})
+    try:
+        header = aes.ChunkedHeader.parse(_read_exactly(response.iter_content(aes.CHUNKED_HEADER.size),
+                                                       aes.CHUNKED_HEADER.size))
+    finally:
+        response.close()
+
+    size = header.plain_size
+    start, stop = 0, size
+    if byte_range is not None:
+        span = byte_range.range_for_length(size)
+        if span is None:
+            raise RangeNotSatisfiable(size)
+        start, stop = span
+    if start == stop:
+        return FileStream(size, 0, 0, iter(()), partial=byte_range is not None)
+
+    first, cipher_start, cipher_end = header.ciphertext_range(start, stop - start)
+    response = _get(cid, {'Range': f"bytes={cipher_start}-{cipher_end - 1}"})
+    pieces = response.iter_content(chunk_size)
+    if response.status_code != 206:
+        pieces = _slice(pieces, cipher_start, cipher_end - cipher_start)
+    plain = aes.iter_decrypted(key, header, first, pieces, end=stop)
+    return FileStream(size, start, stop - start, _slice(plain, start - first * header.chunk_size, stop - start),
+                      response.close, partial=byte_range is not None)
+
+
+def _open_file(f, byte_range) -> FileStream:
+    size = os.fstat(f.fileno()).st_size
+    start, stop = 0, size
+    if byte_range is not None:
+        span = byte_range.range_for_length(size)
+        if span is None:
+            f.close()
+            raise RangeNotSatisfiable(size)
+        start, stop = span
+    f.seek(start)
+
+    def pieces():
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    return FileStream(size, start, stop - start, pieces(), f.close, partial=byte_range is not None)
+
+
+def _get(cid, headers):
+    response = ipfs.open_gateway_stream(cid, headers)
+    if response.status_code == 416:
+        total = download_engine.parse_content_range(response.headers.get('Content-Range'))[2]
+        response.close()
+        raise RangeNotSatisfiable(total)
+    if response.status_code not in (200, 206):
+        response.close()
+        raise download_engine.DownloadError(f"Gateway returned {response.status_code} for {cid}",
+                                            response.status_code)
+    return response
+
+
+def _read_exactly(pieces, n: int) -> bytes:
+    data = bytearray()
+    for piece in pieces:
+        data += piece
+        if len(data) >= n:
+            break
+    return bytes(data[:n])
+
+
+def _slice(pieces, skip: int, length: int):
+    """
+    Yields bytes [skip, skip + length) of a stream of pieces
+    """
+    for piece in pieces:
+        if length <= 0:
+            break
+        if skip >= len(piece):
+            skip -= len(piece)
+            continue
+        piece = piece[skip:skip + length]
+        skip = 0
+        length -= len(piece)
+        yield piece
@@ -0,0 +1,145 @@
+"""
+Background scheduling of cluster-wide IPFS garbage collection.
+
+A GC pass walks the whole repository of every node, so instead of running one after each unpin the requests are
+coalesced: a pass starts once no new unpin arrived for debounce_window seconds (or max_delay seconds after the
+first pending one, so a steady stream of deletes can't postpone it forever), at least min_interval seconds after
+the previous pass started. Only one pass runs at a time, unpins that arrive meanwhile are collected by the next.
+"""
+
+import threading
+import time
+
+
+class GCScheduler:
+    def __init__(self, run_gc, debounce_window: float, min_interval: float, max_delay: float):
+        """
+        :param run_gc: Runs one GC pass, returns the GC result (a dict) or None on failure
+        """
+        self.run_gc = run_gc
+        self.debounce_window = debounce_window
+        self.min_interval = min_interval
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._pending = set()
+        self._pending_requests = 0
+        self._first_request_at = None
+        self._last_request_at = None
+        self._last_started = None  # monotonic, for min_interval
+        self._running = False
+        self._stopped = False
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+
+    def request(self, cid: str = None):
+        """
+        Asks for a GC pass, e.g. after unpinning cid. Returns immediately.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if cid is not None:
+                self._pending.add(cid)
+            self._pending_requests += 1
+            if self._first_request_at is None:
+                self._first_request_at = now
+            self._last_request_at = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ipfs-gc", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def status(self) -> dict:
+        with self._cond:
+            due = self._due()
+            return {
+                'pending_unpins': len(self._pending),
+                'pending_requests': self._pending_requests,
+                'running': self._running,
+                'next_run_in': round(max(0.0, due - time.monotonic()), 1) if due is not None else None,
+                'runs': self.runs,
+                'failures': self.failures,
+                'last_run': self.last_run,
+            }
+
+    def _due(self):
+        """
+        :return: Monotonic time the next pass may start, None if nothing is pending
+        """
+        if self._first_request_at is None:
+            return None
+        due = min(self._last_request_at + self.debounce_window, self._first_request_at + self.max_delay)
+        if self._last_started is not None:
+            due = max(due, self._last_started + self.min_interval)
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    due = self._due()
+                    if due is None:
+                        self._cond.wait()
+                    elif time.monotonic() < due:
+                        self._cond.wait(due - time.monotonic())
+                    else:
+                        break
+                if self._stopped:
+                    return
+                unpins, requests = len(self._pending), self._pending_requests
+                self._pending = set()
+                self._pending_requests = 0
+                self._first_request_at = self._last_request_at = None
+                self._last_started = time.monotonic()
+                self._running = True
+
+            print(f"Running garbage collection for {unpins} unpinned files ({requests} requests)")
+            started_at = time.time()
+            try:
+                result = self.run_gc()
+            except Exception as e:
+                print(f"Garbage collection failed: {e}")
+                result = None
+            duration = time.time() - started_at
+
+            with self._cond:
+                self._running = False
+                self.runs += 1
+                if result is None:
+                    self.failures += 1
+                self.last_run = {
+                    'started_at': started_at,
+                    'duration_seconds': round(duration, 3),
+                    'success': result is not None,
+                    'unpins': unpins,
+                    'requests': requests,
+                    **_summarize(result),
+                }
+
+
+def _summarize(result) -> dict:
+    """
+    Counts the blocks removed per peer in a GlobalRepoGC response
+    """
+    reclaimed = {}
+    errors = []
+    peer_map = result.get('peer_map') if isinstance(result, dict) else None
+    for peer_id, repo_gc in (peer_map or {}).items():
+        if not isinstance(repo_gc, dict):
+            continue
+        name = repo_gc.get('peername') or peer_id
+        keys = repo_gc.get('keys') or []
+        reclaimed[name] = sum(1 for key in keys if isinstance(key, dict) and not key.get('error'))
+        if repo_gc.get('error'):
+            errors.append(f"{name}: {repo_gc['error']}")
+    return {
+        'reclaimed_blocks': sum(reclaimed.values()),
+        'reclaimed_blocks_per_peer': reclaimed,
+        'errors': errors,
+    }
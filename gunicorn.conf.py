@@ -0,0 +1,35 @@
+"""
+gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app`, tunable through the environment:
+    RESSHARE_BIND               address to listen on (default 0.0.0.0:5000)
+    RESSHARE_WORKERS            worker processes (default 1, see below)
+    RESSHARE_THREADS            request threads per worker (default 16)
+    RESSHARE_GRACEFUL_TIMEOUT   seconds a stopping worker gets to finish its requests and background jobs
+                                (default 300, uploads can take a while)
+See wsgi.py for the settings of the app itself.
+"""
+
+import os
+
+bind = os.environ.get("RESSHARE_BIND", "0.0.0.0:5000")
+# One process by default: background jobs, upload progress and replication tracking live in the memory of the process
+# that started them, so with several workers /jobs/<id>, /upload_progress/<id> and /replication/<cid> answer 404
+# whenever the poll lands on another worker, and each worker's KV cache misses the others' writes for its TTL.
+# Only raise it if clients don't poll, or the load balancer keeps every client on one worker.
+workers = int(os.environ.get("RESSHARE_WORKERS") or 1)
+# Requests spend their time waiting on ResilientDB and IPFS with the GIL released, threads keep the worker busy
+worker_class = "gthread"
+threads = int(os.environ.get("RESSHARE_THREADS") or 16)
+# With gthread this is the worker heartbeat, not a request timeout, long uploads are fine
+timeout = 120
+graceful_timeout = int(os.environ.get("RESSHARE_GRACEFUL_TIMEOUT") or 300)
+keepalive = 5
+# Each worker imports the app after the fork, so no connection or background thread is shared between processes
+preload_app = False
+accesslog = "-"
+
+
+def worker_exit(server, worker):
+    # The worker stopped taking requests and finished the ones in flight, let its background jobs finish too
+    import client
+    if not client.shutdown(graceful_timeout):
+        server.log.warning("Worker %s exited with unfinished background jobs", worker.pid)
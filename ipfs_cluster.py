@@ -1,33 +1,290 @@
+import codecs
+import json
+import os
+import threading
+import uuid
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import async_pool
+import download_engine
+import endpoints
+import gc_scheduler
+import replication
 
+# First configured endpoint of each kind, requests go through cluster_endpoints / gateway_endpoints
 ipfs_cluster_api_url = None
 ipfs_gateway_url = None
+cluster_endpoints = None
+gateway_endpoints = None
+
+# With several endpoints configured their health and latency are probed in the background every this many seconds
+endpoint_probe_interval = 30
+endpoint_probe_timeout = (2, 5)
+# Gateways are probed with the empty directory, which every IPFS node has
+GATEWAY_PROBE_PATH = "ipfs/QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn"
+_prober = None
+
+# Garbage collection after unpins is batched, see gc_scheduler.GCScheduler
+gc_debounce_window = 10.0  # seconds
+gc_min_interval = 60.0  # seconds
+gc_max_delay = 300.0  # seconds
+_gc_scheduler = None
+_gc_scheduler_lock = threading.Lock()
+
+# Replication of pins made with pin_with_replication() is checked every replication_min_poll_interval seconds,
+# doubling up to replication_max_poll_interval while nothing changes
+replication_min_poll_interval = 1.0
+replication_max_poll_interval = 30.0
+replication_give_up_after = 3600.0  # seconds
+_replication_tracker = None
+_replication_tracker_lock = threading.Lock()
+
+# Keep-alive connections kept per host, should be at least the number of server worker threads
+http_pool_size = 16
+# (connect, read) timeouts in seconds per operation
+timeouts = {
+    'add': (5, 120),
+    'pin': (5, 30),
+    'status': (5, 30),
+    'download': (5, 30),
+    'list': (5, 60),
+    'peers': (5, 10),
+    'id': (5, 10),
+    'unpin': (5, 30),
+    'gc': (5, 600),
+}
+# The cluster answers an add once it has added the whole file. For uploads of known size, the read timeout of 'add'
+# grows by one second per add_timeout_bytes_per_second bytes
+add_timeout_bytes_per_second = 8 * 1024 * 1024
+# Idempotent requests (GET, HEAD, PUT, DELETE) are retried on connection errors and 502/503/504 responses,
+# waiting http_backoff_factor * 2 ** (retry - 1) seconds in between
+http_max_retries = 3
+http_backoff_factor = 0.5
+
+# Uploads are read from disk and sent in chunks of this many bytes
+upload_chunk_size = 1024 * 1024
+# Streamed JSON responses (/pins) are read in chunks of this many bytes
+stream_chunk_size = 64 * 1024
+
+# Downloads are split into HTTP Range segments of this many bytes, fetched download_concurrency at a time.
+# Gateways that don't support ranges are read with a single stream.
+download_segment_size = 8 * 1024 * 1024
+download_concurrency = 4
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the requests.Session shared by every call in this module, creating it on first use.
+    Its connection pools are thread safe and keep connections to the cluster API and gateway alive between calls.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=http_max_retries,
+                    backoff_factor=http_backoff_factor,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=http_pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def reset_session():
+    """
+    Drops the shared session, e.g. after changing http_pool_size or in a freshly forked worker process
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def _request(method: str, operation: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault('timeout', timeouts[operation])
+    return get_session().request(method, url, **kwargs)
 
 
 def read_config_file():
     """
-    Reads the IPFS Cluster API URL and IPFS Gateway URL from the configuration file.
-    Sets the values of global variables ipfs_cluster_api_url and ipfs_gateway_url.
+    Reads the IPFS Cluster API URLs and IPFS Gateway URLs from the configuration file.
+    Line 1 lists the cluster API endpoints and line 2 the gateways, several URLs are separated by commas.
+    Sets the global variables ipfs_cluster_api_url and ipfs_gateway_url (the first URL of each line) and the
+    endpoint pools cluster_endpoints and gateway_endpoints.
     """
-    global ipfs_cluster_api_url, ipfs_gateway_url
+    global ipfs_cluster_api_url, ipfs_gateway_url, cluster_endpoints, gateway_endpoints, _prober
     with open("config/ipfs.config") as f:
-        ipfs_cluster_api_url = f.readline().strip()
-        ipfs_gateway_url = f.readline().strip()
+        cluster_urls = endpoints.parse_urls(f.readline())
+        gateway_urls = endpoints.parse_urls(f.readline())
+    cluster_endpoints = endpoints.EndpointPool("cluster API", cluster_urls, "id")
+    gateway_endpoints = endpoints.EndpointPool("gateway", gateway_urls, GATEWAY_PROBE_PATH, probe_method='HEAD')
+    ipfs_cluster_api_url = cluster_urls[0]
+    ipfs_gateway_url = gateway_urls[0]
+
+    if _prober is not None:
+        _prober.stop()
+        _prober = None
+    pools = [pool for pool in (cluster_endpoints, gateway_endpoints) if len(pool.urls) > 1]
+    if pools and endpoint_probe_interval:
+        _prober = endpoints.Prober(pools, get_session, endpoint_probe_interval, endpoint_probe_timeout)
+        _prober.start()
+
+
+def _cluster_request(method: str, operation: str, path: str, failover: bool = True, make_kwargs=None,
+                     **kwargs) -> requests.Response:
+    """
+    Sends a request to the fastest healthy cluster API endpoint. With failover, connection errors and 5xx
+    responses are retried on the other endpoints and the last response (or error) is returned once all failed.
+    Use failover=False for requests that can't be sent twice, such as uploads from a one-shot stream.
+
+    :param path: Path relative to the API root, e.g. "pins"
+    :param make_kwargs: Optional, called before every attempt for request arguments that can only be used once
+                        (e.g. a streamed body), merged into kwargs
+    """
+    if cluster_endpoints is None:
+        read_config_file()
+    candidates = cluster_endpoints.candidates()
+    if not failover:
+        candidates = candidates[:1]
+    for i, base in enumerate(candidates):
+        last = i == len(candidates) - 1
+        try:
+            attempt_kwargs = dict(kwargs, **make_kwargs()) if make_kwargs is not None else kwargs
+            response = _request(method, operation, base + path, **attempt_kwargs)
+        except requests.exceptions.RequestException as e:
+            cluster_endpoints.record_failure(base)
+            if last:
+                raise
+            print(f"Cluster API {base} failed ({e}), trying the next endpoint")
+            continue
+        if response.status_code >= 500:
+            cluster_endpoints.record_failure(base)
+            if not last:
+                print(f"Cluster API {base} returned {response.status_code}, trying the next endpoint")
+                response.close()
+                continue
+        else:
+            cluster_endpoints.record_success(base, response.elapsed.total_seconds(),
+                                             int(response.headers.get('Content-Length') or 0))
+        return response
+
+
+def get_endpoint_stats() -> dict:
+    """
+    :return: Health, latency and the number of requests and bytes served per cluster API endpoint and gateway
+    """
+    if cluster_endpoints is None:
+        read_config_file()
+    return {"cluster_api": cluster_endpoints.stats(), "gateway": gateway_endpoints.stats()}
 
 
-def add_file_to_cluster(file_path):
+class MultipartFileStream:
     """
-    Adds a file to the IPFS Cluster.
+    A multipart/form-data request body holding one file, produced chunk by chunk while it is sent so memory use
+    stays at one chunk whatever the file size.
+
+    Pass it as data= to requests together with the content_type header. When the size is known requests sends a
+    Content-Length, otherwise the body goes out with chunked transfer encoding.
+    """
+
+    def __init__(self, fileobj, file_name: str, size: int = None, progress_callback=None,
+                 chunk_size: int = None, field_name: str = 'file'):
+        """
+        :param fileobj: Binary file-like object the content is read from
+        :param size: Number of bytes fileobj will produce, if known
+        :param progress_callback: Called as progress_callback(bytes_sent, size) after each chunk
+        """
+        self.fileobj = fileobj
+        self.size = size
+        self.progress_callback = progress_callback
+        self.chunk_size = chunk_size or upload_chunk_size
+        self.bytes_sent = 0
+        boundary = uuid.uuid4().hex
+        quoted_name = file_name.replace('\\', '\\\\').replace('"', '\\"').replace('\r', ' ').replace('\n', ' ')
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._preamble = (f'--{boundary}\r\n'
+                          f'Content-Disposition: form-data; name="{field_name}"; filename="{quoted_name}"\r\n'
+                          f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        self._epilogue = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+    def __len__(self):
+        if self.size is None:
+            raise TypeError("Size of the streamed file is unknown")
+        return len(self._preamble) + self.size + len(self._epilogue)
+
+    def __iter__(self):
+        yield self._preamble
+        while True:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            self.bytes_sent += len(chunk)
+            if self.progress_callback is not None:
+                self.progress_callback(self.bytes_sent, self.size)
+            yield chunk
+        yield self._epilogue
+
+
+def add_file_to_cluster(file_path, progress_callback=None):
+    """
+    Adds a file to the IPFS Cluster. The file is streamed in chunks of upload_chunk_size bytes.
 
     :param file_path: The path to the file to be added.
+    :param progress_callback: Called as progress_callback(bytes_sent, total_bytes) while the file is sent.
     :return: The CID (Content Identifier) of the file if successful, otherwise None.
     """
+    with open(file_path, 'rb') as f:
+        return add_stream_to_cluster(f, os.path.basename(file_path), os.path.getsize(file_path), progress_callback)
+
+
+def _add_timeout(size=None) -> tuple:
+    """
+    :param size: Number of bytes of the file to add, None if unknown
+    :return: The (connect, read) timeout of adding the file
+    """
+    connect, read = timeouts['add']
+    if size is None:
+        return connect, read
+    return connect, read + size / add_timeout_bytes_per_second
+
+
+def add_stream_to_cluster(fileobj, file_name, size=None, progress_callback=None):
+    """
+    Adds the content of a binary file-like object to the IPFS Cluster, see add_file_to_cluster().
+
+    :param size: Number of bytes fileobj will produce, None if unknown (the upload then uses chunked encoding)
+    :return: The CID of the file if successful, otherwise None.
+    """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    url = ipfs_cluster_api_url + "add"
-    files = {'file': open(file_path, 'rb')}
-    response = requests.post(url, files=files)
+    # The body is read while it is sent, it can only be sent again to another endpoint if fileobj can be rewound
+    try:
+        start = fileobj.tell() if fileobj.seekable() else None
+    except (AttributeError, OSError):
+        start = None
+
+    def request_kwargs():
+        if start is not None:
+            fileobj.seek(start)
+        body = MultipartFileStream(fileobj, file_name, size, progress_callback)
+        return {'data': body if size is not None else iter(body), 'headers': {'Content-Type': body.content_type}}
+
+    response = _cluster_request('POST', 'add', "add", failover=start is not None, make_kwargs=request_kwargs,
+                                timeout=_add_timeout(size))
 
     if response.status_code == 200:
         cid = response.json()['cid']['/']
@@ -45,22 +302,29 @@ def pin_file(cid, replication_min, replication_max):
     :param cid: The CID of the file to be pinned.
     :param replication_min: The minimum number of replicas.
     :param replication_max: The maximum number of replicas.
+    :return: True if the cluster accepted the pin, otherwise False.
     """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    url = f"{ipfs_cluster_api_url}pins/{cid}"
-    payload = {
+    # The cluster reads pin options from the query string
+    params = {
         "replication-min": replication_min,
         "replication-max": replication_max
     }
-    response = requests.post(url, json=payload)
+    try:
+        response = _cluster_request('POST', 'pin', f"pins/{cid}", params=params)
+    except requests.exceptions.RequestException as e:
+        print(f"Error connecting to IPFS Cluster API: {e}")
+        return False
 
     if response.status_code == 200:
         print(f"File with CID {cid} pinned successfully.")
+        return True
     else:
         print("Failed to pin file to IPFS Cluster.")
         print(response.text)
+        return False
 
 
 def get_file_status(cid):
@@ -73,18 +337,25 @@ def get_file_status(cid):
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    url = f"{ipfs_cluster_api_url}pins/{cid}"
-    response = requests.get(url)
+    response = _cluster_request('GET', 'status', f"pins/{cid}", stream=True)
 
     if response.status_code == 200:
-        file_info = response.json()
+        with response:
+            file_info = next(_iter_json_stream(response), None)
         return file_info
     else:
         print("Failed to get file status from IPFS Cluster.")
         print(response.text)
 
 
-def download_file_from_ipfs(cid, save_path):
+def download_file_from_ipfs(cid, save_path, progress_callback=None):
+    """
+    Downloads a file from the gateway with parallel range requests. A download that fails part way leaves
+    "<save_path>.part" behind and resumes from it the next time the same CID is downloaded to save_path.
+
+    :param progress_callback: Optional, called as progress_callback(bytes_done, total_bytes) as segments complete
+    :return: {"success": bool, "message": str}
+    """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
@@ -92,64 +363,219 @@ def download_file_from_ipfs(cid, save_path):
     print(f"IPFS Cluster API URL: {ipfs_cluster_api_url}")
     print(f"IPFS Gateway URL: {ipfs_gateway_url}")
 
-    url = f"{ipfs_gateway_url}ipfs/{cid}"
-    print(f"Download URL: {url}")
+    path = f"ipfs/{cid}"
+    print(f"Download URLs: {[base + path for base in gateway_endpoints.candidates()]}")
 
-    try:
-        response = requests.get(url, stream=True, timeout=10)
-        if response.status_code == 200:
-            with open(save_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            print(f"File downloaded successfully and saved to {save_path}")
-            return {"success": True, "message": f"File downloaded successfully and saved to {save_path}"}
+    # Every segment goes to the fastest healthy gateway and fails over to the next one
+    result = download_engine.download(
+        get_session(), lambda: [base + path for base in gateway_endpoints.candidates()], save_path,
+        download_segment_size, download_concurrency, timeout=timeouts['download'], source_id=cid,
+        progress_callback=progress_callback,
+        on_success=lambda url, latency, nbytes: gateway_endpoints.record_success(url[:-len(path)], latency, nbytes),
+        on_failure=lambda url: gateway_endpoints.record_failure(url[:-len(path)]))
+    print(result["message"])
+    return result
+
+
+def open_gateway_stream(cid, headers=None) -> requests.Response:
+    """
+    Sends a streamed GET for a file to the fastest healthy gateway, failing over to the next one on connection
+    errors and 5xx responses. The caller reads the body and must close the response.
+
+    :param headers: Optional request headers, e.g. Range
+    :return: The response of the first gateway that answered, or the last 5xx response
+    """
+    if gateway_endpoints is None:
+        read_config_file()
+    path = f"ipfs/{cid}"
+    candidates = gateway_endpoints.candidates()
+    for i, base in enumerate(candidates):
+        last = i == len(candidates) - 1
+        try:
+            response = _request('GET', 'download', base + path, headers=headers, stream=True)
+        except requests.exceptions.RequestException as e:
+            gateway_endpoints.record_failure(base)
+            if last:
+                raise
+            print(f"Gateway {base} failed ({e}), trying the next one")
+            continue
+        if response.status_code >= 500:
+            gateway_endpoints.record_failure(base)
+            if not last:
+                print(f"Gateway {base} returned {response.status_code}, trying the next one")
+                response.close()
+                continue
         else:
-            error_message = f"Failed to download file. Status code: {response.status_code}. Response: {response.text}"
-            print(error_message)
-            return {"success": False, "message": error_message}
+            gateway_endpoints.record_success(base, response.elapsed.total_seconds(), 0)
+        return response
+
+
+def download_stream_from_ipfs(cid, fileobj, progress_callback=None):
+    """
+    Downloads a file from the gateway with a single stream written to a binary file-like object as it arrives,
+    e.g. to decrypt it on the way. Unlike download_file_from_ipfs() a failed download can't be resumed.
+
+    :param progress_callback: Optional, called as progress_callback(bytes_done, total_bytes)
+    :return: {"success": bool, "message": str}
+    """
+    try:
+        with open_gateway_stream(cid) as response:
+            if response.status_code != 200:
+                return {"success": False,
+                        "message": f"Failed to download file. Status code: {response.status_code}"}
+            total = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+            done = 0
+            for chunk in response.iter_content(chunk_size=download_engine.WRITE_CHUNK_SIZE):
+                fileobj.write(chunk)
+                done += len(chunk)
+                if progress_callback is not None:
+                    progress_callback(done, total)
     except requests.exceptions.RequestException as e:
-        error_message = f"Error downloading file from IPFS: {e}"
-        print(error_message)
-        return {"success": False, "message": error_message}
+        return {"success": False, "message": f"Failed to download file: {e}"}
+    return {"success": True, "message": f"Downloaded {done} bytes of {cid}"}
 
 
-def list_pinned_files():
+def list_pinned_files(status=None):
     """
     Retrieves information about all pinned files in the IPFS Cluster.
+    Use iter_pins() to go through them without holding the whole list in memory.
 
+    :param status: Optional, see iter_pins()
     :return: A list of information about pinned files if successful, otherwise None.
     """
+    try:
+        return list(iter_pins(status))
+    except requests.exceptions.RequestException as e:
+        print(f"Error connecting to IPFS Cluster API: {e}")
+    except ValueError as e:
+        print(f"Invalid pin listing from IPFS Cluster API: {e}")
+
+
+def iter_pins(status=None, cids=None):
+    """
+    Yields the status of every pin in the IPFS Cluster as it is read from the response, so memory use doesn't
+    depend on the number of pins. The response is closed when the generator is exhausted or closed.
+
+    :param status: Optional, only yield pins that have one of these statuses (e.g. "pinned", "pinning", "error")
+                   on at least one peer. A list or a comma separated string, passed to the cluster as ?filter=.
+    :param cids: Optional, only yield the status of these CIDs, passed to the cluster as ?cids=.
+    :raises requests.exceptions.RequestException: If the cluster can't be reached or doesn't answer with 200
+    :raises ValueError: If the response isn't valid JSON
+    """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    url = f"{ipfs_cluster_api_url}pins"
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            pinned_files = response.json()
-            return pinned_files
-        else:
+    statuses = _parse_status_filter(status)
+    cids = set(cids) if cids is not None else None
+    params = {}
+    if statuses:
+        params['filter'] = ','.join(sorted(statuses))
+    if cids is not None:
+        if not cids:
+            return
+        params['cids'] = ','.join(sorted(cids))
+    response = _cluster_request('GET', 'list', "pins", params=params or None, stream=True)
+    with response:
+        if response.status_code != 200:
             print(f"Failed to retrieve pinned files. Status code: {response.status_code}")
             print(response.text)
+            raise requests.exceptions.HTTPError(f"Failed to retrieve pinned files. Status code: "
+                                                f"{response.status_code}", response=response)
+        for pin in _iter_json_stream(response):
+            # Older clusters ignore the filter parameters
+            if statuses and not _pin_has_status(pin, statuses):
+                continue
+            if cids is not None and _pin_cid(pin) not in cids:
+                continue
+            yield pin
+
+
+def get_pins_status(cids) -> dict:
+    """
+    Retrieves the status of several CIDs with one request.
+
+    :return: {CID: status as returned by get_file_status()}, CIDs the cluster doesn't know are left out.
+             None if the cluster can't be reached.
+    """
+    try:
+        return {_pin_cid(pin): pin for pin in iter_pins(cids=cids)}
     except requests.exceptions.RequestException as e:
         print(f"Error connecting to IPFS Cluster API: {e}")
+    except ValueError as e:
+        print(f"Invalid pin listing from IPFS Cluster API: {e}")
 
 
-def list_all_peers():
+def _pin_cid(pin):
+    cid = pin.get('cid') if isinstance(pin, dict) else None
+    return cid.get('/') if isinstance(cid, dict) else cid
+
+
+def _parse_status_filter(status) -> set:
+    if not status:
+        return set()
+    if isinstance(status, str):
+        status = status.split(',')
+    return {s.strip() for s in status if s.strip()}
+
+
+def _pin_has_status(pin, statuses) -> bool:
+    peer_map = pin.get('peer_map') if isinstance(pin, dict) else None
+    if not isinstance(peer_map, dict):
+        return False
+    return any(isinstance(info, dict) and info.get('status') in statuses for info in peer_map.values())
+
+
+def _iter_json_stream(response):
     """
-    Retrieves information about all peers in the IPFS Cluster.
+    Yields the JSON values of a response body that is either newline delimited JSON (what IPFS Cluster streams
+    since 1.0) or one JSON array (older versions), holding at most one value and one chunk in memory.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    buffer = ''
+    for chunk in response.iter_content(chunk_size=stream_chunk_size):
+        buffer += text.decode(chunk)
+        values, buffer = _decode_json_values(decoder, buffer)
+        yield from values
+    values, buffer = _decode_json_values(decoder, buffer + text.decode(b'', final=True))
+    yield from values
+    if buffer:
+        raise ValueError(f"Truncated JSON value in response: {buffer[:80]}")
+
+
+def _decode_json_values(decoder, buffer):
+    """
+    :return: (the complete values at the start of buffer, what is left of buffer after them)
+    """
+    values = []
+    pos = 0
+    while True:
+        # Values are separated by newlines, or by commas inside the enclosing array
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,[]':
+            pos += 1
+        if pos == len(buffer):
+            return values, ''
+        try:
+            value, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # The value continues in the next chunk
+            return values, buffer[pos:]
+        values.append(value)
+
+
+def list_peers():
+    """
+    Retrieves the information every peer of the IPFS Cluster publishes about itself (GET /peers).
 
-    :return: A list of information about all peers if successful, otherwise None.
+    :return: A list with one dict per peer if successful, otherwise None.
     """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    url = f"{ipfs_cluster_api_url}/peers"
     try:
-        response = requests.get(url)
+        response = _cluster_request('GET', 'peers', "peers")
         if response.status_code == 200:
-            peers_info = response.json()
-            return peers_info[0]
+            return response.json()
         else:
             print(f"Failed to retrieve peers info. Status code: {response.status_code}")
             print(response.text)
@@ -157,6 +583,17 @@ def list_all_peers():
         print(f"Error connecting to IPFS Cluster API: {e}")
 
 
+def list_all_peers():
+    """
+    Retrieves information about all peers in the IPFS Cluster.
+
+    :return: A list of information about all peers if successful, otherwise None.
+    """
+    peers_info = list_peers()
+    if peers_info:
+        return peers_info[0]
+
+
 def get_my_peer_id():
     """
     Retrieves the peer ID of the current IPFS Cluster peer.
@@ -166,9 +603,8 @@ def get_my_peer_id():
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    url = f"{ipfs_cluster_api_url}/id"
     try:
-        response = requests.get(url)
+        response = _cluster_request('GET', 'id', "id")
         if response.status_code == 200:
             peer_info = response.json()
             peer_id = peer_info.get('id')
@@ -183,24 +619,15 @@ def get_my_peer_id():
 
 def get_peer_name(peer_id):
     """
-    Fetch the peer name of a specific peer by its ID.
+    Fetch the peer name of a specific peer by its ID, looked up in the shared peer_directory.PeerDirectory.
 
-    :param api_url: The base URL of the IPFS Cluster API.
     :param peer_id: The peer ID of the target node.
     :return: The peer name if found, otherwise None.
     """
-    url = f"{ipfs_cluster_api_url}/peers"
+    # peer_directory imports this module
+    import peer_directory
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            peers = response.json()
-            for peer in peers:
-                if peer["id"] == peer_id:
-                    return peer.get("peername", "Unknown Peername")
-            print(f"Peer ID {peer_id} not found in the cluster.")
-        else:
-            print(f"Failed to fetch peers. Status code: {response.status_code}")
-            print(response.text)
+        return peer_directory.get_directory().peer_name(peer_id)
     except Exception as e:
         print(f"Error fetching peername: {e}")
     return None
@@ -214,25 +641,23 @@ def remove_file_from_cluster(cid):
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    verify_url = f"{ipfs_cluster_api_url}/pins/{cid}"
     headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json'
         }
-    verify_response = requests.get(verify_url, headers=headers)
+    verify_response = _cluster_request('GET', 'status', f"pins/{cid}", headers=headers)
     
     if verify_response.status_code == 404:
         print(f"CID {cid} not found in cluster")
         return False
 
-    url = f"{ipfs_cluster_api_url}pins/{cid}"
     try:
         
-        response = requests.delete(url, headers=headers)
+        response = _cluster_request('DELETE', 'unpin', f"pins/{cid}", headers=headers)
         if response.status_code == 200:
             print(f"File with CID {cid} successfully removed from IPFS Cluster.")
-            trigger_gc_on_nodes()
-            print(f"File with CID {cid} successfully deleted from IPFS Cluster.")
+            # The blocks are reclaimed by the next batched GC pass
+            schedule_gc(cid)
             return True
         else:
             print(f"Failed to remove file with CID {cid}. Status code: {response.status_code}")
@@ -243,16 +668,124 @@ def remove_file_from_cluster(cid):
         return False
     
 def trigger_gc_on_nodes():
+    """
+    Runs garbage collection on every IPFS node of the cluster and waits for it to finish.
+    Use schedule_gc() instead to batch GC passes in the background.
+
+    :return: The GC result (per peer removed keys and errors) if successful, otherwise None.
+    """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
     
-    gc_url = f"{ipfs_cluster_api_url}ipfs/gc?local=false"
     try:
-        response = requests.post(gc_url)
+        response = _cluster_request('POST', 'gc', "ipfs/gc?local=false")
         if response.status_code == 200:
             print("Garbage collection successfully triggered.")
+            try:
+                return response.json()
+            except ValueError:
+                return {}
         else:
             print(f"Failed to trigger GC. Status code: {response.status_code}")
             print(response.text)
     except requests.exceptions.RequestException as e:
         print(f"Error triggering garbage collection: {e}")
+
+
+def get_gc_scheduler() -> gc_scheduler.GCScheduler:
+    global _gc_scheduler
+    if _gc_scheduler is None:
+        with _gc_scheduler_lock:
+            if _gc_scheduler is None:
+                _gc_scheduler = gc_scheduler.GCScheduler(trigger_gc_on_nodes, gc_debounce_window, gc_min_interval,
+                                                         gc_max_delay)
+    return _gc_scheduler
+
+
+def schedule_gc(cid=None):
+    """
+    Asks for a cluster-wide GC pass in the background, e.g. after unpinning cid. Requests made close together
+    are served by a single pass.
+    """
+    get_gc_scheduler().request(cid)
+
+
+def get_gc_status() -> dict:
+    """
+    :return: Pending unpins, when the next GC pass runs and how the last one went
+    """
+    return get_gc_scheduler().status()
+
+
+def get_replication_tracker() -> replication.ReplicationTracker:
+    global _replication_tracker
+    if _replication_tracker is None:
+        with _replication_tracker_lock:
+            if _replication_tracker is None:
+                _replication_tracker = replication.ReplicationTracker(
+                    pin_file, get_pins_status, replication_min_poll_interval, replication_max_poll_interval,
+                    replication_give_up_after)
+    return _replication_tracker
+
+
+def pin_with_replication(cid, replication_min, replication_max):
+    """
+    Pins a file with the given replication factors in the background, see pin_file().
+    Follow the replication with get_replication_status(cid).
+
+    :return: The replication progress of the CID, see get_replication_status()
+    """
+    return get_replication_tracker().pin(cid, replication_min, replication_max)
+
+
+def get_replication_status(cid, wait=0):
+    """
+    :param wait: Seconds to wait for the replication to finish (or fail) before returning
+    :return: {"cid", "state", "pinned", "target", "peers": {PEER_NAME: status}, "errors", "replication_min",
+              "replication_max", "started_at", "updated_at"}, None if the CID wasn't pinned with
+              pin_with_replication(). state is one of requested, pinning, replicated, failed, timed_out.
+    """
+    if wait:
+        return get_replication_tracker().wait(cid, wait)
+    return get_replication_tracker().get(cid)
+
+
+async def add_file_to_cluster_async(file_path, progress_callback=None):
+    return await async_pool.run(add_file_to_cluster, file_path, progress_callback)
+
+
+async def pin_file_async(cid, replication_min, replication_max):
+    return await async_pool.run(pin_file, cid, replication_min, replication_max)
+
+
+async def get_file_status_async(cid):
+    return await async_pool.run(get_file_status, cid)
+
+
+async def download_file_from_ipfs_async(cid, save_path, progress_callback=None):
+    return await async_pool.run(download_file_from_ipfs, cid, save_path, progress_callback)
+
+
+async def list_pinned_files_async(status=None):
+    return await async_pool.run(list_pinned_files, status)
+
+
+async def list_peers_async():
+    return await async_pool.run(list_peers)
+
+
+async def list_all_peers_async():
+    return await async_pool.run(list_all_peers)
+
+
+async def get_my_peer_id_async():
+    return await async_pool.run(get_my_peer_id)
+
+
+async def get_peer_name_async(peer_id):
+    return await async_pool.run(get_peer_name, peer_id)
+
+
+async def remove_file_from_cluster_async(cid):
+    return await async_pool.run(remove_file_from_cluster, cid)
+
@@ -0,0 +1,245 @@
+"""
+Bounded worker pool for long running operations (uploads, deletes), so request handlers only queue the work and
+return a job id to poll instead of holding a worker thread for minutes.
+
+At most `workers` jobs run at once and at most `max_queued` wait for a worker; submitting beyond that raises
+QueueFull, which the API turns into 429 so callers back off. Queued jobs can be cancelled outright, running ones
+are asked to stop and do so at their next check (an upload aborts at its next chunk).
+"""
+
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+workers = 4
+max_queued = 64
+# Finished jobs kept for polling, oldest first out
+max_finished = 256
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = {SUCCEEDED, FAILED, CANCELLED}
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind: str, func, description: str = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description
+        self.func = func
+        self.state = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def raise_if_cancelled(self):
+        """
+        Called by the job function at points where it can stop
+        """
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def set_progress(self, **progress):
+        self.progress = dict(self.progress, **progress)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        :return: True if the job finished within timeout seconds
+        """
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'state': self.state,
+            'progress': dict(self.progress),
+            'result': self.result,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers: int, max_queued: int, max_finished: int = 256):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._jobs = OrderedDict()
+        self._running = 0
+        self._threads = []
+        self._accepting = True
+        self._stopped = False
+        self.counts = {state: 0 for state in FINISHED_STATES}
+
+    def submit(self, kind: str, func, description: str = None) -> Job:
+        """
+        Queues func(job) to run on a worker. Its return value becomes job.result, an exception job.error.
+
+        :raises QueueFull: If max_queued jobs are already waiting, or the queue is shutting down
+        """
+        job = Job(kind, func, description)
+        with self._cond:
+            if not self._accepting:
+                raise QueueFull("The server is shutting down")
+            if len(self._pending) >= self.max_queued:
+                raise QueueFull(f"{len(self._pending)} jobs are already waiting, try again later")
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._forget_finished()
+            self._start_workers()
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        """
+        Cancels a queued job, or asks a running one to stop
+
+        :return: The job, None if the id is unknown
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return job
+            job._cancel.set()
+            if job.state == QUEUED:
+                self._pending.remove(job)
+                self._finish(job, CANCELLED, error="Cancelled before it started")
+            return job
+
+    def jobs(self, limit: int = 100) -> list:
+        """
+        :return: The most recent jobs, newest first
+        """
+        with self._cond:
+            return [job.to_dict() for job in itertools.islice(reversed(self._jobs.values()), limit)]
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': len(self._pending),
+                'max_queued': self.max_queued,
+                'accepting': self._accepting,
+                **self.counts,
+            }
+
+    def drain(self, timeout: float = None) -> bool:
+        """
+        Stops accepting jobs and waits for the queued and running ones to finish
+
+        :return: True if everything finished within timeout seconds
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            self._accepting = False
+            while self._pending or self._running:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stop(self):
+        """
+        Stops the workers once they finished their current job, queued jobs are cancelled
+        """
+        with self._cond:
+            self._accepting = False
+            self._stopped = True
+            while self._pending:
+                self._finish(self._pending.popleft(), CANCELLED, error="The server shut down")
+            self._cond.notify_all()
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and not self._pending:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                job = self._pending.popleft()
+                job.state = RUNNING
+                job.started_at = time.time()
+                self._running += 1
+
+            state, result, error = SUCCEEDED, None, None
+            try:
+                result = job.func(job)
+            except JobCancelled:
+                state, error = CANCELLED, "Cancelled while running"
+            except Exception as e:
+                print(f"Job {job.id} ({job.kind}) failed: {e}")
+                state, error = FAILED, str(e)
+
+            with self._cond:
+                self._running -= 1
+                self._finish(job, state, result, error)
+
+    def _finish(self, job, state, result=None, error=None):
+        job.state = state
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        self.counts[state] += 1
+        job._done.set()
+        self._cond.notify_all()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+
+def get_queue() -> JobQueue:
+    """
+    Returns the queue shared by the process, created on first use
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(workers, max_queued, max_finished)
+    return _queue
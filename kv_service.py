@@ -1,18 +1,443 @@
+import contextlib
 import os
+import random
 import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+import async_pool
+import codec
 sys.path.append(os.path.abspath("bazel/bazel-bin/kv_service/"))
 import pybind_kv
+try:
+    import fcntl
+except ImportError:  # Windows, compare_and_set() then only excludes writers in this process
+    fcntl = None
 os.path.abspath("config/kv_server.config")
 config_path = "config/kv_server.config"
 
-def set_kv(key: str, value: str):
-    global config_path
+# Number of KVClient instances kept open by the shared connection
+pool_size = 4
+
+# Read-through cache in front of get_kv/multi_get
+cache_max_entries = 4096
+cache_default_ttl = 10.0  # seconds
+
+# Retry policy of update_kv() when another writer wins the compare-and-set
+cas_max_retries = 8
+cas_backoff = 0.05  # seconds, doubled on every retry
+
+# compare_and_set() on a key is serialized across the processes of this node (e.g. gunicorn workers) with lock
+# files in this directory
+cas_lock_dir = os.path.join(tempfile.gettempdir(), "resshare-kv-locks")
+
+# Values written by compare_and_set() start with "#RSV1:<version>:<writer token>\n"
+VERSION_STAMP_PREFIX = "#RSV1:"
+
+_connection = None
+_connection_lock = threading.Lock()
+# Locks of compare_and_set(), keys are striped over a fixed set of them (and as many lock files)
+_cas_locks = [threading.Lock() for _ in range(64)]
+
+
+# Cache entry of a key whose value must be fetched again
+_TOMBSTONE = object()
+
+
+class KVConflictError(Exception):
+    """
+    Raised by update_kv() when the key kept being changed by other writers
+    """
+
+
+class KVCache:
+    """
+    A bounded LRU cache of KV values with a TTL per entry.
+    Writes from this node go through the cache, so our own changes are visible immediately while changes made by
+    other peers show up once the cached entry expires.
+    """
+
+    def __init__(self, max_entries: int, default_ttl: float):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        # key -> (value, expires_at, write_seq), value is _TOMBSTONE for an invalidated key
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_seq = 0
+        # Highest write_seq of an entry that was dropped (evicted or expired), reads older than that can't fill
+        self._dropped_seq = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        """
+        :return: (True, value) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] <= time.monotonic():
+                    self._drop(key)
+                    if entry[0] is not _TOMBSTONE:
+                        self.expirations += 1
+                elif entry[0] is not _TOMBSTONE:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[0]
+            self.misses += 1
+            return False, None
+
+    def read_token(self) -> int:
+        """
+        Taken before fetching a value from ResilientDB and passed to fill(), so a slow read can't overwrite a
+        value that this node wrote (or invalidated) in the meantime.
+        """
+        with self._lock:
+            return self._write_seq
+
+    def fill(self, key: str, value: str, read_token: int, ttl: float = None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > read_token:
+                return
+            if read_token < self._dropped_seq:
+                # A newer write may have been dropped from the cache since the read started
+                return
+            self._store(key, value, ttl, read_token)
+
+    def write(self, key: str, value: str, ttl: float = None):
+        with self._lock:
+            self._write_seq += 1
+            self._store(key, value, ttl, self._write_seq)
+
+    def invalidate(self, key: str):
+        """
+        Forgets the value of key. A tombstone keeps the write seq, so reads that started earlier can't fill it.
+        """
+        with self._lock:
+            self._write_seq += 1
+            self._store(key, _TOMBSTONE, None, self._write_seq)
+
+    def clear(self):
+        with self._lock:
+            self._write_seq += 1
+            self._dropped_seq = self._write_seq
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _store(self, key, value, ttl, write_seq):
+        if ttl is None:
+            ttl = self.default_ttl
+        if ttl <= 0:
+            value, ttl = _TOMBSTONE, self.default_ttl
+        self._entries[key] = (value, time.monotonic() + ttl, write_seq)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._dropped_seq = max(self._dropped_seq, entry[2])
+
+
+cache = KVCache(cache_max_entries, cache_default_ttl)
+
+
+def get_connection():
+    """
+    Returns the shared pybind_kv.KVConnection, creating it on first use.
+    The config file is only parsed once and the underlying clients are pooled and reused by every call.
+    """
+    global _connection
+    if _connection is None:
+        with _connection_lock:
+            if _connection is None:
+                _connection = pybind_kv.KVConnection(config_path, pool_size)
+    return _connection
+
+
+def set_kv(key: str, value: str, ttl: float = None):
     print(f"SETTING {key}, {value}")
-    pybind_kv.set(key, value, config_path)
+    try:
+        ok = get_connection().set(key, value)
+    except Exception:
+        cache.invalidate(key)
+        raise
+    if ok:
+        cache.write(key, value, ttl)
+    else:
+        cache.invalidate(key)
+    return ok
+
+
+def get_kv(key: str, ttl: float = None, fresh: bool = False) -> str:
+    """
+    Gets a value, served from the local cache when possible.
+
+    :param key: The key to lookup
+    :param ttl: How long (seconds) the fetched value may be cached, defaults to cache_default_ttl. 0 disables caching.
+    :param fresh: Skip the cache and always read from ResilientDB, use this before a read-modify-write
+    :return: The value, "" if the key doesn't exist
+    """
+    if not fresh:
+        found, value = cache.get(key)
+        if found:
+            return value
+    print(f"GETTING {key}")
+    token = cache.read_token()
+    value = _strip_stamp(get_connection().get(key))
+    cache.fill(key, value, token, ttl)
+    return value
+
+
+def multi_get(keys, ttl: float = None, fresh: bool = False) -> dict:
+    """
+    Gets several keys in one batched call instead of one round trip per key.
+    Keys found in the local cache are not fetched again, see get_kv() for ttl and fresh.
+
+    :param keys: An iterable of keys, duplicates are only fetched once
+    :return: A python dict {key: value}, missing keys map to ""
+    """
+    keys = list(dict.fromkeys(keys))
+    result = {}
+    missing = []
+    for key in keys:
+        found, value = (False, None) if fresh else cache.get(key)
+        if found:
+            result[key] = value
+        else:
+            missing.append(key)
+    if missing:
+        print(f"GETTING {len(missing)} keys")
+        token = cache.read_token()
+        values = get_connection().multi_get(missing)
+        for key, value in zip(missing, values):
+            value = _strip_stamp(value)
+            cache.fill(key, value, token, ttl)
+            result[key] = value
+    return {key: result[key] for key in keys}
+
+
+def multi_set(items, ttl: float = None) -> dict:
+    """
+    Sets several keys in one batched call.
+
+    :param items: A dict {key: value} or an iterable of (key, value) pairs
+    :return: A python dict {key: True/False} telling which writes succeeded
+    """
+    if isinstance(items, dict):
+        items = list(items.items())
+    else:
+        items = list(items)
+    if not items:
+        return {}
+    print(f"SETTING {len(items)} keys")
+    try:
+        results = get_connection().multi_set(items)
+    except Exception:
+        for key, _ in items:
+            cache.invalidate(key)
+        raise
+    for (key, value), ok in zip(items, results):
+        if ok:
+            cache.write(key, value, ttl)
+        else:
+            cache.invalidate(key)
+    return {key: ok for (key, _), ok in zip(items, results)}
+
 
+def get_versioned(key: str):
+    """
+    Reads a key together with its version stamp, always from ResilientDB.
 
-def get_kv(key: str) -> str:
-    global config_path
+    :return: (value, version), values never written by compare_and_set() have version 0
+    """
     print(f"GETTING {key}")
-    return pybind_kv.get(key, config_path)
+    version, _, value = _parse_stamp(get_connection().get(key))
+    return value, version
+
+
+def compare_and_set(key: str, expected_version: int, value: str) -> bool:
+    """
+    Writes value as version expected_version + 1 if the key is still at expected_version.
+
+    ResilientDB has no conditional write, so this checks the version, writes the value stamped with a random writer
+    token and reads it back. The sequence holds a lock on the key shared by all processes of this node, which makes
+    it a real compare-and-set among them. It does not exclude writers on other nodes: two nodes can both pass the
+    version check, and the one writing last wins without the other noticing. Keys written by several nodes must
+    therefore not be updated this way; give every node its own key instead.
+
+    :return: True if our write is the current value, False on a version conflict
+    """
+    with _key_lock(key):
+        return _compare_and_set(key, expected_version, value)
+
+
+@contextlib.contextmanager
+def _key_lock(key: str):
+    stripe = zlib.crc32(key.encode('utf-8')) % len(_cas_locks)
+    with _cas_locks[stripe]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(cas_lock_dir, exist_ok=True)
+        fd = os.open(os.path.join(cas_lock_dir, f"{stripe}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+
+def _compare_and_set(key: str, expected_version: int, value: str) -> bool:
+    conn = get_connection()
+    current_version, _, _ = _parse_stamp(conn.get(key))
+    if current_version != expected_version:
+        return False
+
+    token = uuid.uuid4().hex[:16]
+    stamped = f"{VERSION_STAMP_PREFIX}{expected_version + 1}:{token}\n{value}"
+    print(f"SETTING {key}, {value} (version {expected_version + 1})")
+    if not conn.set(key, stamped):
+        cache.invalidate(key)
+        return False
+
+    version, written_token, _ = _parse_stamp(conn.get(key))
+    if version != expected_version + 1 or written_token != token:
+        cache.invalidate(key)
+        return False
+    cache.write(key, value)
+    return True
+
+
+def update_kv(key: str, mutate, max_retries: int = None) -> str:
+    """
+    Optimistic read-modify-write of one key: reads it, calls mutate(value) and writes the result with
+    compare_and_set(), starting over with backoff when another writer got there first.
+
+    Updates are only atomic with respect to the processes of this node, see compare_and_set(). Use it for keys no
+    other node writes, such as our own catalog and favorites.
+
+    :param mutate: Called with the current value ("" if missing), returns the new value or None to leave the key
+                   unchanged. It may be called several times.
+    :return: The value the key holds afterwards
+    :raises KVConflictError: If every attempt conflicted
+    """
+    if max_retries is None:
+        max_retries = cas_max_retries
+    for attempt in range(max_retries + 1):
+        value, version = get_versioned(key)
+        new_value = mutate(value)
+        if new_value is None:
+            return value
+        if compare_and_set(key, version, new_value):
+            return new_value
+        print(f"Version conflict on {key}, retrying")
+        time.sleep(cas_backoff * (2 ** attempt) * random.uniform(0.5, 1.0))
+    raise KVConflictError(f"Gave up updating {key} after {max_retries + 1} conflicting attempts")
+
+
+def update_obj(key: str, mutate, default=dict, max_retries: int = None):
+    """
+    update_kv() for values encoded with codec.py.
+
+    :param mutate: Called with the decoded value (default() if missing or broken), may change it in place.
+                   Returns the object to write, or None to leave the key unchanged.
+    :return: The decoded value the key holds afterwards
+    """
+    result = []
+
+    def mutate_raw(raw):
+        obj = codec.decode(raw)
+        if obj is None:
+            obj = default()
+        new_obj = mutate(obj)
+        result[:] = [obj if new_obj is None else new_obj]
+        return None if new_obj is None else codec.encode(new_obj)
+
+    update_kv(key, mutate_raw, max_retries)
+    return result[0]
+
+
+def get_obj(key: str, default=None, ttl: float = None, fresh: bool = False):
+    """
+    get_kv() decoding the value with codec.py, default if the key is missing or broken
+    """
+    return codec.decode(get_kv(key, ttl=ttl, fresh=fresh), default)
+
+
+def set_obj(key: str, obj, ttl: float = None):
+    """
+    set_kv() encoding the value with codec.default_codec
+    """
+    return set_kv(key, codec.encode(obj), ttl=ttl)
+
+
+def _parse_stamp(raw: str):
+    """
+    :return: (version, writer token, value) of a stored value
+    """
+    if not raw.startswith(VERSION_STAMP_PREFIX):
+        return 0, None, raw
+    header, _, value = raw.partition("\n")
+    try:
+        version, token = header[len(VERSION_STAMP_PREFIX):].split(":", 1)
+        return int(version), token, value
+    except ValueError:
+        return 0, None, raw
+
+
+def _strip_stamp(raw: str) -> str:
+    return _parse_stamp(raw)[2]
+
+
+def cache_stats() -> dict:
+    """
+    :return: Hit/miss counters and size of the local KV cache
+    """
+    return cache.stats()
+
+
+async def get_kv_async(key: str, ttl: float = None, fresh: bool = False) -> str:
+    """
+    Async version of get_kv(), cache hits are answered without leaving the event loop.
+    """
+    if not fresh:
+        found, value = cache.get(key)
+        if found:
+            return value
+    return await async_pool.run(get_kv, key, ttl=ttl, fresh=True)
+
+
+async def set_kv_async(key: str, value: str, ttl: float = None):
+    return await async_pool.run(set_kv, key, value, ttl=ttl)
+
+
+async def multi_get_async(keys, ttl: float = None, fresh: bool = False) -> dict:
+    return await async_pool.run(multi_get, list(keys), ttl=ttl, fresh=fresh)
+
+
+async def multi_set_async(items, ttl: float = None) -> dict:
+    if not isinstance(items, dict):
+        items = list(items)
+    return await async_pool.run(multi_set, items, ttl=ttl)
 
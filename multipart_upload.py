@@ -0,0 +1,145 @@
+"""
+Reads a multipart/form-data upload straight from the request body while it arrives, so the file can be forwarded
+to the cluster without Werkzeug spooling it to a temporary file first (which is what touching request.files does).
+
+Form fields sent before the file part are available once open_file() returned, fields sent after it only after
+finish(). Clients should therefore put upload_id, replication_min, encrypt, file_size, ... before the file.
+"""
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+# The request body is read in pieces of this many bytes
+read_chunk_size = 256 * 1024
+# Largest form field value kept, longer values are cut off
+max_field_size = 64 * 1024
+
+
+class MultipartUpload:
+    """
+    Read-only, non-seekable binary file object returning the content of one file part of a multipart body
+    """
+
+    def __init__(self, stream, boundary: str, file_field: str = 'files'):
+        """
+        :param stream: The request body, e.g. flask.request.stream
+        :param boundary: The boundary parameter of the Content-Type header
+        :param file_field: Name of the form field holding the file, other file parts are skipped
+        """
+        self.stream = stream
+        self.file_field = file_field
+        self.fields = {}
+        self.file_name = None
+        self.bytes_read = 0
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        # The end of the body read so far is held back until more arrives, so the closing boundary line reaches the
+        # decoder in one piece: werkzeug's decoder adds a stray "\r" to the last part when data stops right after
+        # "\r\n--<boundary>-"
+        self._hold_size = len(b'\r\n--') + len(boundary.encode('latin-1')) + len(b'--\r\n')
+        self._held = b''
+        self._ended = False  # the whole body was handed to the decoder
+        self._part = None  # ('field', name, value) or ('file', is_ours) of the part being read
+        self._file_done = False
+        self._buffer = memoryview(b'')
+
+    def open_file(self) -> bool:
+        """
+        Reads up to the start of the file content, collecting the fields in front of it in self.fields
+
+        :return: True if the body has a file part named file_field, otherwise False
+        :raises ValueError: If the body is not valid multipart data
+        """
+        while self.file_name is None:
+            if not self._advance():
+                return False
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._buffer and not self._file_done:
+            if not self._advance():
+                break
+        if size is None or size < 0 or size >= len(self._buffer):
+            data, self._buffer = self._buffer, memoryview(b'')
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.bytes_read += len(data)
+        return bytes(data)
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def finish(self) -> dict:
+        """
+        Reads the rest of the body, collecting the fields after the file
+
+        :return: All form fields
+        """
+        while self._advance():
+            pass
+        return self.fields
+
+    def _advance(self) -> bool:
+        """
+        Handles the next multipart event
+
+        :return: False once the body is over
+        """
+        event = self._next_event()
+        if isinstance(event, Epilogue):
+            self._file_done = True
+            return False
+        if isinstance(event, Field):
+            self._part = ('field', event.name, bytearray())
+        elif isinstance(event, File):
+            ours = self.file_name is None and event.name == self.file_field
+            if ours:
+                self.file_name = event.filename or event.name
+            self._part = ('file', ours)
+        elif isinstance(event, Data):
+            self._data(event)
+        return True
+
+    def _data(self, event):
+        if self._part is None:
+            return
+        if self._part[0] == 'field':
+            _, name, value = self._part
+            value += event.data[:max(0, max_field_size - len(value))]
+            if not event.more_data:
+                self.fields[name] = value.decode('utf-8', errors='replace')
+                self._part = None
+        else:
+            ours = self._part[1]
+            if ours:
+                self._buffer = memoryview(event.data)
+                if not event.more_data:
+                    self._file_done = True
+            if not event.more_data:
+                self._part = None
+
+    def _next_event(self):
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except Exception as e:
+                raise ValueError(f"Invalid multipart body: {e}")
+            if not isinstance(event, NeedData):
+                return event
+            if self._ended:
+                raise ValueError("Invalid multipart body: it ended before the closing boundary")
+            chunk = self.stream.read(read_chunk_size)
+            if not chunk:
+                self._ended = True
+                self._decoder.receive_data(self._held)
+                self._decoder.receive_data(None)
+            else:
+                data = self._held + chunk
+                self._held = data[-self._hold_size:]
+                self._decoder.receive_data(data[:-self._hold_size])
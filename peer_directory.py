@@ -0,0 +1,147 @@
+"""
+In-memory directory of the IPFS Cluster peers, so request handlers don't fetch /peers every time they need the
+peer list or a peer name.
+
+The snapshot is refreshed by a background thread every refresh_interval seconds. Readers only fetch /peers
+themselves when the snapshot is older than ttl (e.g. the background refresh keeps failing) or when they ask for a
+peer ID that isn't in it, and then at most once every miss_refresh_interval seconds. When a refresh fails the last
+snapshot keeps being served.
+"""
+
+import threading
+import time
+
+import ipfs_cluster as ipfs
+
+ttl = 30.0  # seconds
+refresh_interval = 15.0  # seconds, 0 disables the background refresh
+miss_refresh_interval = 2.0  # seconds
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+class PeerDirectory:
+    def __init__(self, fetch, ttl: float, miss_refresh_interval: float):
+        """
+        :param fetch: Returns the /peers list, or None on failure
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._peers = None  # /peers response
+        self._by_id = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def refresh(self) -> bool:
+        """
+        Fetches /peers and replaces the snapshot. Concurrent callers wait for the refresh already in progress
+        instead of sending their own.
+
+        :return: True if the snapshot is fresh afterwards
+        """
+        started = time.monotonic()
+        with self._refresh_lock:
+            if self._last_attempt is not None and self._last_attempt >= started:
+                return self.is_fresh()
+            self._last_attempt = time.monotonic()
+            peers = self.fetch()
+            if not isinstance(peers, list):
+                self.refresh_failures += 1
+                print("Failed to refresh the peer directory, serving the last known peers")
+                return False
+            self._by_id = {peer['id']: peer for peer in peers if isinstance(peer, dict) and 'id' in peer}
+            self._peers = peers
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+            return True
+
+    def is_fresh(self) -> bool:
+        return self._fetched_at is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    def cluster_info(self):
+        """
+        :return: What ipfs_cluster.list_all_peers() returns (our peer's view with "cluster_peers"), None if the
+                 cluster has never been reached
+        """
+        peers = self._snapshot()
+        return peers[0] if peers else None
+
+    def peers(self) -> list:
+        """
+        :return: The info of every peer, as returned by /peers
+        """
+        return list(self._snapshot() or [])
+
+    def get(self, peer_id: str):
+        """
+        :return: The /peers entry of peer_id, None if the peer is unknown
+        """
+        self._snapshot()
+        peer = self._by_id.get(peer_id)
+        if peer is None and self._may_refresh():
+            # The peer may have joined since the last refresh
+            self.refresh()
+            peer = self._by_id.get(peer_id)
+        return peer
+
+    def peer_name(self, peer_id: str):
+        """
+        :return: The peer name if found, otherwise None
+        """
+        peer = self.get(peer_id)
+        if peer is None:
+            print(f"Peer ID {peer_id} not found in the cluster.")
+            return None
+        return peer.get("peername", "Unknown Peername")
+
+    def stats(self) -> dict:
+        return {
+            'peers': len(self._by_id),
+            'age_seconds': round(time.monotonic() - self._fetched_at, 1) if self._fetched_at is not None else None,
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+        }
+
+    def start_background_refresh(self, interval: float):
+        thread = threading.Thread(target=self._run, args=(interval,), name="peer-directory", daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Peer directory refresh failed: {e}")
+
+    def _snapshot(self):
+        if not self.is_fresh() and self._may_refresh():
+            self.refresh()
+        return self._peers
+
+    def _may_refresh(self) -> bool:
+        return self._last_attempt is None or time.monotonic() - self._last_attempt >= self.miss_refresh_interval
+
+
+def get_directory() -> PeerDirectory:
+    """
+    Returns the directory shared by the process, loading it and starting its background refresh on first use
+    """
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                directory = PeerDirectory(ipfs.list_peers, ttl, miss_refresh_interval)
+                directory.refresh()
+                if refresh_interval:
+                    directory.start_background_refresh(refresh_interval)
+                _directory = directory
+    return _directory
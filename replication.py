@@ -0,0 +1,225 @@
+"""
+Asynchronous pinning with replication factors and tracking of how far the replication got.
+
+pin() returns immediately: the pin request is sent from a background thread, which then watches the per-peer
+status of every tracked CID until it reached its replication target. All CIDs due for a check are looked up with
+one batched /pins?cids= request, and each CID's polling interval doubles (up to max_poll_interval) while its
+status doesn't change, so many uploads and many clients asking for progress cost a handful of cluster requests.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Peer statuses of peers the pin isn't allocated to
+UNALLOCATED_STATUSES = {'remote', 'unpinned', 'sharded'}
+
+REQUESTED = 'requested'
+PINNING = 'pinning'
+REPLICATED = 'replicated'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+FINISHED_STATES = {REPLICATED, FAILED, TIMED_OUT}
+
+
+class ReplicationTracker:
+    def __init__(self, pin, get_status_many, min_poll_interval: float = 1.0, max_poll_interval: float = 30.0,
+                 give_up_after: float = 3600.0, batch_size: int = 100, max_tracked: int = 1024):
+        """
+        :param pin: pin(cid, replication_min, replication_max) -> bool
+        :param get_status_many: get_status_many(cids) -> {CID: pin status with a "peer_map"}, None on failure
+        :param give_up_after: Seconds after which a CID that didn't reach its target is marked timed_out
+        :param max_tracked: Finished entries beyond this number are forgotten, oldest first
+        """
+        self.pin_func = pin
+        self.get_status_many = get_status_many
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.give_up_after = give_up_after
+        self.batch_size = batch_size
+        self.max_tracked = max_tracked
+        self._cond = threading.Condition()
+        self._entries = OrderedDict()
+        self._to_pin = []
+        self._thread = None
+        self._stopped = False
+        self.polls = 0
+
+    def pin(self, cid: str, replication_min: int, replication_max: int) -> dict:
+        """
+        Pins cid with the given replication factors in the background and starts tracking it.
+
+        :return: The progress entry, see get()
+        """
+        now = time.time()
+        with self._cond:
+            self._entries[cid] = {
+                'cid': cid,
+                'replication_min': replication_min,
+                'replication_max': replication_max,
+                'state': REQUESTED,
+                'pinned': 0,
+                'target': replication_min if replication_min > 0 else None,
+                'peers': {},
+                'errors': [],
+                'started_at': now,
+                'updated_at': now,
+                '_next_poll': 0.0,
+                '_interval': self.min_poll_interval,
+            }
+            self._entries.move_to_end(cid)
+            self._forget_finished()
+            self._to_pin.append(cid)
+            self._start()
+            self._cond.notify_all()
+            return _public(self._entries[cid])
+
+    def get(self, cid: str):
+        """
+        :return: {"cid", "state", "pinned", "target", "peers": {PEER: status}, "errors", ...}, None if cid isn't
+                 tracked. state is one of requested, pinning, replicated, failed, timed_out.
+        """
+        with self._cond:
+            entry = self._entries.get(cid)
+            if entry is not None and entry['state'] not in FINISHED_STATES:
+                # Someone is waiting for this one, check it soon
+                entry['_next_poll'] = min(entry['_next_poll'], time.monotonic() + self.min_poll_interval)
+                entry['_interval'] = self.min_poll_interval
+                self._cond.notify_all()
+            return _public(entry) if entry is not None else None
+
+    def wait(self, cid: str, timeout: float):
+        """
+        Waits up to timeout seconds for cid to reach a final state.
+
+        :return: See get()
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                entry = self._entries.get(cid)
+                if entry is None or entry['state'] in FINISHED_STATES:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return self.get(cid)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="replication-tracker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and not self._to_pin and not self._due():
+                    next_poll = self._next_poll()
+                    self._cond.wait(None if next_poll is None else max(0.0, next_poll - time.monotonic()))
+                if self._stopped:
+                    return
+                to_pin, self._to_pin = self._to_pin, []
+                due = self._due()[:self.batch_size]
+                requests = [(cid, self._entries[cid]['replication_min'], self._entries[cid]['replication_max'])
+                            for cid in to_pin if cid in self._entries]
+
+            for cid, replication_min, replication_max in requests:
+                try:
+                    ok = self.pin_func(cid, replication_min, replication_max)
+                except Exception as e:
+                    print(f"Pinning {cid} failed: {e}")
+                    ok = False
+                with self._cond:
+                    entry = self._entries.get(cid)
+                    if entry is not None:
+                        entry['state'] = PINNING if ok else FAILED
+                        if not ok:
+                            entry['errors'].append("The cluster did not accept the pin")
+                        entry['updated_at'] = time.time()
+                        self._cond.notify_all()
+
+            if due:
+                self._poll(due)
+
+    def _poll(self, cids):
+        self.polls += 1
+        try:
+            statuses = self.get_status_many(cids)
+        except Exception as e:
+            print(f"Checking replication failed: {e}")
+            statuses = None
+        now = time.monotonic()
+        with self._cond:
+            for cid in cids:
+                entry = self._entries.get(cid)
+                if entry is None or entry['state'] != PINNING:
+                    continue
+                changed = statuses is not None and cid in statuses and self._update(entry, statuses[cid])
+                if entry['state'] == PINNING and time.time() - entry['started_at'] > self.give_up_after:
+                    entry['state'] = TIMED_OUT
+                # Back off while nothing changes
+                entry['_interval'] = self.min_poll_interval if changed else min(entry['_interval'] * 2,
+                                                                                self.max_poll_interval)
+                entry['_next_poll'] = now + entry['_interval']
+            self._cond.notify_all()
+
+    @staticmethod
+    def _update(entry, status) -> bool:
+        """
+        Applies a pin status to entry
+
+        :return: True if anything changed
+        """
+        peers = {}
+        errors = []
+        peer_map = status.get('peer_map') if isinstance(status, dict) else None
+        for peer_id, info in (peer_map or {}).items():
+            if not isinstance(info, dict):
+                continue
+            name = info.get('peername') or peer_id
+            peers[name] = info.get('status')
+            if info.get('error'):
+                errors.append(f"{name}: {info['error']}")
+        allocated = [s for s in peers.values() if s not in UNALLOCATED_STATUSES]
+        pinned = sum(1 for s in allocated if s == 'pinned')
+        # A replication_min of -1 (or 0, the cluster default) means every peer the pin is allocated to
+        target = entry['replication_min'] if entry['replication_min'] > 0 else len(allocated)
+
+        changed = (peers, errors, pinned, target) != (entry['peers'], entry['errors'], entry['pinned'],
+                                                       entry['target'])
+        entry.update(peers=peers, errors=errors, pinned=pinned, target=target)
+        if target and pinned >= target:
+            entry['state'] = REPLICATED
+        if changed:
+            entry['updated_at'] = time.time()
+        return changed
+
+    def _due(self) -> list:
+        now = time.monotonic()
+        due = [(entry['_next_poll'], cid) for cid, entry in self._entries.items()
+               if entry['state'] == PINNING and entry['_next_poll'] <= now]
+        return [cid for _, cid in sorted(due)]
+
+    def _next_poll(self):
+        polls = [entry['_next_poll'] for entry in self._entries.values() if entry['state'] == PINNING]
+        return min(polls) if polls else None
+
+    def _forget_finished(self):
+        excess = len(self._entries) - self.max_tracked
+        if excess > 0:
+            finished = [cid for cid, entry in self._entries.items() if entry['state'] in FINISHED_STATES]
+            for cid in finished[:excess]:
+                del self._entries[cid]
+
+
+def _public(entry) -> dict:
+    public = {key: value for key, value in entry.items() if not key.startswith('_')}
+    public['peers'] = dict(public['peers'])
+    public['errors'] = list(public['errors'])
+    return public
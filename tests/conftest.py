@@ -0,0 +1,58 @@
+"""
+The modules look up config/ and the bazel-bin directories relative to the working directory, so the tests run from
+the repository root. ResilientDB is replaced by an in-memory store (kv_store fixture); when the pybind_kv module
+isn't built, a placeholder lets kv_service be imported.
+"""
+
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "bazel/bazel-bin/kv_service"))
+
+try:
+    import pybind_kv  # noqa: F401
+except ImportError:
+    sys.modules['pybind_kv'] = types.ModuleType('pybind_kv')
+
+
+class MemoryKVConnection:
+    """
+    Stands in for pybind_kv.KVConnection, failing_keys are written as failed
+    """
+
+    def __init__(self):
+        self.store = {}
+        self.failing_keys = set()
+
+    def get(self, key):
+        return self.store.get(key, "")
+
+    def set(self, key, value):
+        if key in self.failing_keys:
+            return False
+        self.store[key] = value
+        return True
+
+    def multi_get(self, keys):
+        return [self.get(key) for key in keys]
+
+    def multi_set(self, items):
+        return [self.set(key, value) for key, value in items]
+
+
+@pytest.fixture
+def kv_store(monkeypatch, tmp_path):
+    import kv_service
+
+    connection = MemoryKVConnection()
+    monkeypatch.setattr(kv_service, '_connection', connection)
+    monkeypatch.setattr(kv_service, 'cas_lock_dir', str(tmp_path / "kv-locks"))
+    kv_service.cache.clear()
+    yield connection
+    kv_service.cache.clear()
@@ -0,0 +1,137 @@
+import io
+import os
+
+import pytest
+
+aes = pytest.importorskip("aes", reason="pybind_aes is not built")
+
+CHUNK_SIZE = 1000
+
+
+@pytest.fixture(scope="module")
+def key():
+    return aes.generate_key()
+
+
+def encrypt(tmp_path, key, data, threads=None):
+    plain_path, encrypted_path = tmp_path / "plain.bin", tmp_path / "encrypted.bin"
+    plain_path.write_bytes(data)
+    aes.encrypt_file_chunked(str(plain_path), str(encrypted_path), key, chunk_size=CHUNK_SIZE, threads=threads)
+    return encrypted_path
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 25 * CHUNK_SIZE + 17])
+@pytest.mark.parametrize("threads", [1, 3])
+def test_round_trip(tmp_path, key, size, threads):
+    data = os.urandom(size)
+    encrypted_path = encrypt(tmp_path, key, data, threads)
+    assert encrypted_path.stat().st_size == aes.chunked_encrypted_size(size, CHUNK_SIZE)
+    out_path = tmp_path / "out.bin"
+    aes.decrypt_file_chunked(str(encrypted_path), str(out_path), key, threads=threads)
+    assert out_path.read_bytes() == data
+
+
+def test_header(tmp_path, key):
+    encrypted = encrypt(tmp_path, key, os.urandom(2500)).read_bytes()
+    assert encrypted.startswith(aes.CHUNKED_MAGIC)
+    assert aes.is_chunked_file(str(tmp_path / "encrypted.bin"))
+    header = aes.ChunkedHeader.parse(encrypted)
+    assert (header.chunk_size, header.plain_size, header.chunk_count) == (CHUNK_SIZE, 2500, 3)
+    assert header.encrypted_size == len(encrypted)
+    assert len(header.nonce_prefix) == 8
+
+
+@pytest.mark.parametrize("data", [b"", b"RSAESGC1", b"NOTCHUNKED" * 10])
+def test_parse_rejects_other_data(data):
+    with pytest.raises(ValueError):
+        aes.ChunkedHeader.parse(data)
+
+
+def test_ciphertext_range():
+    header = aes.ChunkedHeader(CHUNK_SIZE, 2500, bytes(8))
+    stride = CHUNK_SIZE + aes.GCM_TAG_SIZE
+    base = aes.CHUNKED_HEADER.size
+    assert header.ciphertext_range(0, 1) == (0, base, base + stride)
+    assert header.ciphertext_range(999, 2) == (0, base, base + 2 * stride)
+    assert header.ciphertext_range(2000, 10 ** 6) == (2, base + 2 * stride, header.encrypted_size)
+    assert header.ciphertext_range(2500, 10)[1:] == (base, base)
+
+
+@pytest.mark.parametrize("offset, length", [
+    (0, 1), (0, 2500), (999, 2), (1000, 1000), (1500, 10), (2499, 1), (2400, 500), (2500, 10), (3000, 1), (10, 0),
+])
+def test_decrypt_range(tmp_path, key, offset, length):
+    data = os.urandom(2500)
+    encrypted_path = encrypt(tmp_path, key, data)
+    assert aes.decrypt_range(str(encrypted_path), key, offset, length) == data[offset:offset + length]
+    with open(encrypted_path, 'rb') as f:
+        assert aes.decrypt_range(f, key, offset, length) == data[offset:offset + length]
+
+
+def test_tampered_chunk_fails(tmp_path, key):
+    encrypted_path = encrypt(tmp_path, key, os.urandom(2500))
+    encrypted = bytearray(encrypted_path.read_bytes())
+    encrypted[aes.CHUNKED_HEADER.size + CHUNK_SIZE + aes.GCM_TAG_SIZE + 5] ^= 1
+    encrypted_path.write_bytes(bytes(encrypted))
+    out_path = tmp_path / "out.bin"
+    with pytest.raises(ValueError):
+        aes.decrypt_file_chunked(str(encrypted_path), str(out_path), key)
+    assert not out_path.exists()
+    # Only the damaged chunk fails, the others still decrypt
+    assert len(aes.decrypt_range(str(encrypted_path), key, 0, CHUNK_SIZE)) == CHUNK_SIZE
+    with pytest.raises(ValueError):
+        aes.decrypt_range(str(encrypted_path), key, CHUNK_SIZE, 1)
+
+
+def test_wrong_key_fails(tmp_path, key):
+    encrypted_path = encrypt(tmp_path, key, os.urandom(100))
+    with pytest.raises(ValueError):
+        aes.decrypt_range(str(encrypted_path), aes.generate_key(), 0, 100)
+
+
+def test_truncated_file_fails(tmp_path, key):
+    encrypted_path = encrypt(tmp_path, key, os.urandom(2500))
+    encrypted_path.write_bytes(encrypted_path.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        aes.decrypt_file_chunked(str(encrypted_path), str(tmp_path / "out.bin"), key)
+    with pytest.raises(ValueError):
+        aes.decrypt_range(str(encrypted_path), key, 2400, 100)
+
+
+@pytest.mark.parametrize("piece_size", [1, 7, CHUNK_SIZE + aes.GCM_TAG_SIZE, 10 ** 6])
+def test_iter_decrypted(tmp_path, key, piece_size):
+    data = os.urandom(5 * CHUNK_SIZE + 3)
+    encrypted = encrypt(tmp_path, key, data).read_bytes()
+    header = aes.ChunkedHeader.parse(encrypted)
+    body = encrypted[aes.CHUNKED_HEADER.size:]
+    pieces = (body[i:i + piece_size] for i in range(0, len(body), piece_size))
+    assert b''.join(aes.iter_decrypted(key, header, 0, pieces, threads=2)) == data
+
+
+def test_iter_decrypted_from_a_later_chunk(tmp_path, key):
+    data = os.urandom(5 * CHUNK_SIZE + 3)
+    encrypted = encrypt(tmp_path, key, data).read_bytes()
+    header = aes.ChunkedHeader.parse(encrypted)
+    first, start, end = header.ciphertext_range(2 * CHUNK_SIZE, CHUNK_SIZE)
+    plain = b''.join(aes.iter_decrypted(key, header, first, [encrypted[start:end]], end=3 * CHUNK_SIZE))
+    assert plain == data[2 * CHUNK_SIZE:3 * CHUNK_SIZE]
+
+
+@pytest.mark.parametrize("cut", [aes.GCM_TAG_SIZE + 3, CHUNK_SIZE + aes.GCM_TAG_SIZE])
+def test_iter_decrypted_short_stream_fails(tmp_path, key, cut):
+    encrypted = encrypt(tmp_path, key, os.urandom(3 * CHUNK_SIZE)).read_bytes()
+    header = aes.ChunkedHeader.parse(encrypted)
+    with pytest.raises(ValueError):
+        b''.join(aes.iter_decrypted(key, header, 0, [encrypted[aes.CHUNKED_HEADER.size:-cut]]))
+
+
+def test_encrypting_reader_matches_file_format(tmp_path, key):
+    data = os.urandom(4 * CHUNK_SIZE + 1)
+    with aes.ChunkedEncryptingReader(io.BytesIO(data), key, len(data), chunk_size=CHUNK_SIZE) as reader:
+        encrypted = b''.join(iter(reader.read, b''))
+    assert len(encrypted) == aes.chunked_encrypted_size(len(data), CHUNK_SIZE)
+    encrypted_path = tmp_path / "encrypted.bin"
+    encrypted_path.write_bytes(encrypted)
+    out_path = tmp_path / "out.bin"
+    aes.decrypt_file_chunked(str(encrypted_path), str(out_path), key)
+    assert out_path.read_bytes() == data
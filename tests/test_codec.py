@@ -0,0 +1,66 @@
+import pytest
+
+import codec
+
+CID = "QmeomffUNfmQy76CQGy9NdmqEnnHU9soCexBnGU3ezPHVH"
+PEER = "12D3KooWEH7HALhJhEHY6RQ1SDrxcbrihM8VBy9vB7Rf6GqRFtSg"
+
+VALUES = [
+    True,
+    False,
+    {},
+    {CID: {}},
+    {"version": 2, "pages": 3},
+    [CID, "1" + CID[1:], "11" + CID[2:]],
+    {"file_name": "report.pdf", "file_size": 5 * 1024 ** 3, "timestamp": "2024-11-08 10:15:00", "page": 0},
+    {"file_name": "ünïcode €.txt", "file_size": 0, "timestamp": None, "page": 7, "encrypted": True,
+     "cipher": "aes-gcm-chunked-v1", "key": "00112233445566778899aabbccddeeff"},
+    {PEER: {"nickname": "Bro", "peer_name": "node-1"}, "ratio": -1.5, "tags": [None, "x", "x", "x"]},
+]
+
+
+@pytest.fixture
+def compact_everything(monkeypatch):
+    # Small values are kept as JSON unless this is lowered
+    monkeypatch.setattr(codec, 'compact_min_size', 0)
+
+
+@pytest.mark.parametrize("value", VALUES)
+@pytest.mark.parametrize("name", ["json", "compact", None])
+def test_round_trip(value, name, compact_everything):
+    assert codec.decode(codec.encode(value, name)) == value
+
+
+def test_compact_format_is_marked_and_smaller(compact_everything):
+    page = [CID[:-2] + a + b for a in "ABCDEFGH" for b in "abcdefghijkmnopq"]
+    encoded = codec.encode(page, "compact")
+    assert encoded.startswith("~")
+    assert len(encoded) < len(codec.encode(page, "json"))
+    assert codec.decode(encoded) == page
+
+
+def test_large_values_are_compressed(compact_everything, monkeypatch):
+    monkeypatch.setattr(codec, 'compress_threshold', 64)
+    records = [{"file_name": "same_name.mp4", "file_size": 1, "timestamp": "2024-11-08", "page": i % 3}
+               for i in range(200)]
+    assert codec.decode(codec.encode(records, "compact")) == records
+
+
+def test_small_values_stay_json():
+    assert codec.encode({"version": 2, "pages": 1}) == '{"version": 2, "pages": 1}'
+    assert codec.encode(True) == "true"
+
+
+def test_legacy_json_is_read():
+    assert codec.decode('{"%s": {"%s": false}}' % (CID, PEER)) == {CID: {PEER: False}}
+
+
+@pytest.mark.parametrize("raw", ["", None])
+def test_empty_value_gives_default(raw):
+    assert codec.decode(raw) is None
+    assert codec.decode(raw, default={}) == {}
+
+
+@pytest.mark.parametrize("raw", ["not json", "~unknown:abc", "~c1:!!!!", "~c1:", "{"])
+def test_broken_value_gives_default(raw):
+    assert codec.decode(raw, default="fallback") == "fallback"
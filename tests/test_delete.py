@@ -0,0 +1,153 @@
+import pytest
+
+pytest.importorskip("aes", reason="pybind_aes is not built")
+
+import cid_cache
+import codec
+import file_manifest
+import ipfs_cluster
+
+ME = "PEER_ME"
+OTHER = "PEER_OTHER"
+CID = "QmeomffUNfmQy76CQGy9NdmqEnnHU9soCexBnGU3ezPHVH"
+FILE_INFO = {"file_name": "report.pdf", "file_size": 10, "timestamp": "2024-11-08 10:15:00"}
+
+
+class FakeCluster:
+    def __init__(self):
+        self.peers = [ME]
+        self.unpin_ok = True
+        self.unpinned = []
+
+    def remove_file_from_cluster(self, cid):
+        if not self.unpin_ok:
+            return False
+        self.unpinned.append(cid)
+        return True
+
+
+@pytest.fixture
+def cluster():
+    return FakeCluster()
+
+
+@pytest.fixture
+def client(kv_store, cluster, monkeypatch, tmp_path):
+    # client asks the cluster for our peer ID when it is imported
+    monkeypatch.setattr(ipfs_cluster, 'get_my_peer_id', lambda: ME)
+    import client
+
+    monkeypatch.setattr(client, 'my_ipfs_cluster_id', ME)
+    monkeypatch.setattr(client, 'get_all_peers', lambda: {"cluster_peers": list(cluster.peers)})
+    monkeypatch.setattr(client.ipfs, 'remove_file_from_cluster', cluster.remove_file_from_cluster)
+    monkeypatch.setattr(cid_cache, 'cache_dir', str(tmp_path / "cid_cache"))
+    monkeypatch.setattr(cid_cache, '_cache', None)
+    return client
+
+
+def upload(client):
+    client._record_upload(CID, dict(FILE_INFO))
+
+
+def is_listed(client) -> bool:
+    return bool(codec.decode(client.kv.get_kv(CID, fresh=True)))
+
+
+def flag(client, peer_id):
+    return client.kv.get_kv(client.holder_key(CID, peer_id), fresh=True)
+
+
+def test_only_holder_deletes(client, cluster):
+    upload(client)
+    assert client._delete_file(CID) == (True, "File deleted successfully")
+    assert cluster.unpinned == [CID]
+    assert not is_listed(client)
+    assert flag(client, ME) == ""
+    assert file_manifest.get_files(ME) == {}
+
+
+def test_deletion_waits_for_every_holder(client, cluster):
+    cluster.peers = [ME, OTHER]
+    upload(client)
+    assert client.kv.set_obj(client.holder_key(CID, OTHER), False)
+
+    ok, status = client._delete_file(CID)
+    assert ok and status.startswith("Cannot delete file")
+    assert cluster.unpinned == []
+    assert is_listed(client)
+    assert codec.decode(flag(client, ME)) is True
+
+    # The other holder marks the file too, the one finishing the deletion clears every flag
+    client.kv.set_obj(client.holder_key(CID, OTHER), True)
+    assert client._delete_file(CID) == (True, "File deleted successfully")
+    assert cluster.unpinned == [CID]
+    assert flag(client, ME) == flag(client, OTHER) == ""
+
+
+def test_legacy_record_holders_are_counted(client, cluster):
+    upload(client)
+    client.kv.set_obj(CID, {CID: {ME: False, OTHER: False}})
+    ok, status = client._delete_file(CID)
+    assert ok and status.startswith("Cannot delete file")
+    assert cluster.unpinned == []
+
+
+def test_unknown_file(client, cluster):
+    ok, status = client._delete_file(CID)
+    assert not ok and "not found" in status
+    assert cluster.unpinned == []
+
+
+def test_peer_without_the_file(client, cluster):
+    cluster.peers = [ME, OTHER]
+    client.kv.set_obj(client.holder_key(CID, OTHER), False)
+    ok, status = client._delete_file(CID)
+    assert not ok and "does not have access" in status
+    assert flag(client, ME) == ""
+
+
+def test_failed_unpin_keeps_the_records(client, cluster):
+    upload(client)
+    cluster.unpin_ok = False
+    ok, status = client._delete_file(CID)
+    assert not ok and "could not remove" in status
+    assert is_listed(client)
+    assert file_manifest.get_files(ME) == {CID: dict(FILE_INFO)}
+
+    # Retrying once the cluster works again finishes the deletion
+    cluster.unpin_ok = True
+    assert client._delete_file(CID) == (True, "File deleted successfully")
+    assert not is_listed(client)
+
+
+def test_failed_record_write_is_a_partial_deletion(client, cluster, kv_store):
+    upload(client)
+    kv_store.failing_keys.add(CID)
+    ok, status = client._delete_file(CID)
+    assert not ok and status.startswith("Partial deletion") and CID in status
+    assert cluster.unpinned == [CID]
+
+
+def test_failed_flag_write(client, cluster, kv_store):
+    upload(client)
+    kv_store.failing_keys.add(client.holder_key(CID, ME))
+    ok, status = client._delete_file(CID)
+    assert not ok and "Error updating ResilientDB" in status
+    assert cluster.unpinned == []
+
+
+def test_delete_file_returns_the_message(client):
+    upload(client)
+    assert client.delete_file(CID) == "File deleted successfully"
+
+
+def test_delete_job_fails_with_the_message(client, cluster):
+    job = client.submit_delete(CID)
+    assert job.wait(10)
+    assert job.state == 'failed' and "not found" in job.error
+
+    upload(client)
+    job = client.submit_delete(CID)
+    assert job.wait(10)
+    assert job.state == 'succeeded'
+    assert job.result == {'cid': CID, 'status': "File deleted successfully"}
@@ -0,0 +1,131 @@
+import pytest
+
+import file_index
+from file_index import FileIndex, InvalidQuery
+
+
+def make_file(i, peer="PEER_A", name=None, size=None, timestamp=None):
+    return {
+        'peerID': peer,
+        'fileName': name if name is not None else f"file_{i:03d}.txt",
+        'fileSize': size if size is not None else (i * 37) % 11,
+        'timestamp': timestamp if timestamp is not None else f"2024-11-{i % 28 + 1:02d} 10:00:00",
+        'CID': f"Qm{i:044d}",
+    }
+
+
+FILES = [make_file(i, peer="PEER_A" if i % 3 else "PEER_B") for i in range(50)] + [
+    make_file(100, name="Report.PDF", size=500),
+    make_file(101, name="report_draft.docx"),
+    make_file(102, name="photo.png", size=10 ** 9),
+    make_file(103, name="movie.mp4", peer="PEER_B"),
+    make_file(104, name="", size=3),
+]
+
+
+def all_pages(index, limit, **query):
+    seen = []
+    cursor = None
+    while True:
+        page = index.page(limit, cursor, **query)
+        assert len(page['files']) <= limit
+        seen += page['files']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize("sort", ['name', 'size', 'timestamp'])
+@pytest.mark.parametrize("order", ['asc', 'desc'])
+@pytest.mark.parametrize("limit", [1, 7, 1000])
+def test_pages_cover_all_files_in_order(sort, order, limit):
+    seen = all_pages(FileIndex(FILES), limit, sort=sort, order=order)
+    field = {'name': 'fileName', 'size': 'fileSize', 'timestamp': 'timestamp'}[sort]
+    expected = sorted(FILES, key=lambda f: (f[field].casefold() if sort == 'name' else f[field], f['CID']),
+                      reverse=order == 'desc')
+    assert [f['CID'] for f in seen] == [f['CID'] for f in expected]
+
+
+def test_ties_are_ordered_by_cid():
+    files = [make_file(i, size=5) for i in (3, 1, 2)]
+    assert [f['CID'] for f in all_pages(FileIndex(files), 1, sort='size')] == [f"Qm{i:044d}" for i in (1, 2, 3)]
+
+
+def test_filters():
+    index = FileIndex(FILES)
+    assert {f['peerID'] for f in all_pages(index, 5, peer="PEER_B")} == {"PEER_B"}
+    assert len(all_pages(index, 5, peer="PEER_B")) == sum(f['peerID'] == "PEER_B" for f in FILES)
+    assert [f['fileName'] for f in all_pages(index, 1, name_prefix="rEpOrT")] == ["Report.PDF", "report_draft.docx"]
+    assert [f['fileName'] for f in all_pages(index, 10, file_type="pdf,image/*")] == ["photo.png", "Report.PDF"]
+    assert [f['fileName'] for f in all_pages(index, 10, file_type=[".mp4"], peer="PEER_B")] == ["movie.mp4"]
+    assert all_pages(index, 10, name_prefix="nothing") == []
+
+
+def test_name_prefix_with_other_sort():
+    index = FileIndex(FILES)
+    assert [f['fileName'] for f in all_pages(index, 1, sort='size', order='desc', name_prefix="report")] == \
+        ["Report.PDF", "report_draft.docx"]
+
+
+def test_cursor_survives_changes():
+    files = [make_file(i) for i in range(10)]
+    first = FileIndex(files).page(4, sort='name')
+    assert [f['fileName'] for f in first['files']] == [f"file_{i:03d}.txt" for i in range(4)]
+    # A file before the boundary is removed and one after it is added, the next page still starts after file_003
+    changed = [f for f in files if f['fileName'] != "file_001.txt"] + [make_file(20, name="file_004b.txt")]
+    second = FileIndex(changed, generation=1).page(4, first['next_cursor'], sort='name')
+    assert [f['fileName'] for f in second['files']] == ["file_004.txt", "file_004b.txt", "file_005.txt",
+                                                       "file_006.txt"]
+
+
+def test_pages_are_copies():
+    index = FileIndex([make_file(1)])
+    index.page()['files'][0]['fileName'] = "changed"
+    assert index.page()['files'][0]['fileName'] == "file_001.txt"
+
+
+def test_select_keeps_catalog_order_without_sort():
+    files = [make_file(i) for i in (5, 1, 3)]
+    assert [f['CID'] for f in FileIndex(files).select()] == [f['CID'] for f in files]
+    assert [f['CID'] for f in FileIndex(files).select(order='desc')] == [f['CID'] for f in reversed(files)]
+    assert [f['CID'] for f in FileIndex(files).select(sort='name')] == [f"Qm{i:044d}" for i in (1, 3, 5)]
+
+
+@pytest.mark.parametrize("query", [
+    {'sort': 'owner'},
+    {'order': 'up'},
+    {'limit': 0},
+    {'limit': "ten"},
+    {'cursor': "not a cursor"},
+    {'cursor': file_index.encode_cursor({'sort': 'name'})},
+    {'cursor': file_index.encode_cursor(['size', False, 3, "Qm1"]), 'sort': 'name'},
+    {'cursor': file_index.encode_cursor(['name', True, "a", "Qm1"]), 'sort': 'name'},
+    {'cursor': file_index.encode_cursor(['size', False, "3", "Qm1"]), 'sort': 'size'},
+])
+def test_invalid_queries(query):
+    with pytest.raises(InvalidQuery):
+        FileIndex(FILES).page(**query)
+
+
+def test_limits():
+    assert file_index.check_limit(None) == file_index.default_limit
+    assert file_index.check_limit("20") == 20
+    assert file_index.check_limit(10 ** 6) == file_index.max_limit
+
+
+def test_get_index_is_shared_until_invalidated(monkeypatch):
+    monkeypatch.setattr(file_index, '_index', None)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [make_file(len(loads))]
+
+    first = file_index.get_index(load)
+    assert file_index.get_index(load) is first
+    file_index.invalidate()
+    assert file_index.get_index(load) is not first
+    assert len(loads) == 2
+    monkeypatch.setattr(file_index, 'ttl', 0)
+    file_index.get_index(load)
+    assert len(loads) == 3
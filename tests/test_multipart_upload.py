@@ -0,0 +1,137 @@
+import io
+import os
+
+import pytest
+
+import multipart_upload
+from multipart_upload import MultipartUpload
+
+BOUNDARY = "----resshare-test-boundary"
+
+
+class TrickleStream(io.BytesIO):
+    """
+    Request body handing out at most piece_size bytes per read, like a socket
+    """
+
+    def __init__(self, data: bytes, piece_size: int):
+        super().__init__(data)
+        self.piece_size = piece_size
+
+    def read(self, size=-1):
+        return super().read(min(self.piece_size, size) if size is not None and size >= 0 else self.piece_size)
+
+
+def build_body(parts, boundary=BOUNDARY) -> bytes:
+    """
+    :param parts: (name, value) for fields, (name, file name, content) for files
+    """
+    body = b''
+    for part in parts:
+        body += f'--{boundary}\r\n'.encode()
+        if len(part) == 2:
+            body += f'Content-Disposition: form-data; name="{part[0]}"\r\n\r\n'.encode() + part[1].encode()
+        else:
+            body += (f'Content-Disposition: form-data; name="{part[0]}"; filename="{part[1]}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n').encode() + part[2]
+        body += b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode()
+
+
+def read_all(upload, size=-1) -> bytes:
+    out = b''
+    while True:
+        data = upload.read(size)
+        if not data:
+            return out
+        out += data
+
+
+@pytest.mark.parametrize("piece_size", [1, 13, 4096, 10 ** 7])
+def test_file_and_fields(monkeypatch, piece_size):
+    monkeypatch.setattr(multipart_upload, 'read_chunk_size', 1000)
+    content = os.urandom(50_000) + b'\r\n--' + BOUNDARY.encode()[:-1] + b'\r\n'
+    body = build_body([("upload_id", "u1"), ("encrypt", "true"), ("files", "report.pdf", content),
+                       ("after", "late")])
+    upload = MultipartUpload(TrickleStream(body, piece_size), BOUNDARY)
+
+    assert upload.open_file()
+    assert upload.file_name == "report.pdf"
+    assert upload.fields == {"upload_id": "u1", "encrypt": "true"}
+    assert read_all(upload, 777) == content
+    assert upload.bytes_read == len(content)
+    assert upload.finish() == {"upload_id": "u1", "encrypt": "true", "after": "late"}
+
+
+@pytest.mark.parametrize("piece_size", range(1, 12))
+def test_file_as_last_part(piece_size):
+    # curl -F sends the file last, reads may stop anywhere in the closing boundary
+    content = b'abcdef'
+    upload = MultipartUpload(TrickleStream(build_body([("files", "a.txt", content)]), piece_size), BOUNDARY)
+    assert upload.open_file()
+    assert read_all(upload) == content
+    assert upload.finish() == {}
+
+
+def test_empty_file():
+    upload = MultipartUpload(io.BytesIO(build_body([("files", "empty.txt", b'')])), BOUNDARY)
+    assert upload.open_file()
+    assert upload.read() == b''
+    assert upload.finish() == {}
+
+
+def test_readinto():
+    content = os.urandom(3000)
+    upload = MultipartUpload(io.BytesIO(build_body([("files", "a.bin", content)])), BOUNDARY)
+    assert upload.open_file()
+    buffer = bytearray(1024)
+    out = b''
+    while True:
+        n = upload.readinto(buffer)
+        if not n:
+            break
+        out += buffer[:n]
+    assert out == content
+
+
+def test_other_file_parts_are_skipped():
+    body = build_body([("thumbnail", "thumb.png", b'not this'), ("files", "a.txt", b'this'),
+                       ("files", "b.txt", b'nor this')])
+    upload = MultipartUpload(io.BytesIO(body), BOUNDARY)
+    assert upload.open_file()
+    assert upload.file_name == "a.txt"
+    assert read_all(upload) == b'this'
+    upload.finish()
+
+
+def test_custom_file_field():
+    upload = MultipartUpload(io.BytesIO(build_body([("document", "a.txt", b'data')])), BOUNDARY, 'document')
+    assert upload.open_file()
+    assert read_all(upload) == b'data'
+
+
+def test_body_without_file():
+    upload = MultipartUpload(io.BytesIO(build_body([("upload_id", "u1")])), BOUNDARY)
+    assert not upload.open_file()
+    assert upload.fields == {"upload_id": "u1"}
+
+
+def test_long_fields_are_cut(monkeypatch):
+    monkeypatch.setattr(multipart_upload, 'max_field_size', 10)
+    upload = MultipartUpload(io.BytesIO(build_body([("note", "x" * 100), ("files", "a", b'')])), BOUNDARY)
+    assert upload.open_file()
+    assert upload.fields == {"note": "x" * 10}
+
+
+def test_truncated_body_fails():
+    body = build_body([("files", "a.bin", os.urandom(5000))])
+    upload = MultipartUpload(io.BytesIO(body[:3000]), BOUNDARY)
+    assert upload.open_file()
+    with pytest.raises(ValueError):
+        read_all(upload)
+
+
+def test_not_a_stream_file_object():
+    upload = MultipartUpload(io.BytesIO(b''), BOUNDARY)
+    assert upload.readable()
+    assert not upload.seekable()
@@ -0,0 +1,27 @@
+"""
+Production entry point: `gunicorn -c gunicorn.conf.py wsgi:app` (see README.md).
+
+Every worker process imports this module and builds its own app, with its own ResilientDB / IPFS connections and
+job workers. The settings come from the environment:
+    RESSHARE_JOB_WORKERS      background jobs running at once per process (default 4)
+    RESSHARE_JOB_MAX_QUEUED   jobs waiting per process before /upload and /delete answer 429 (default 64)
+    RESSHARE_THREADS          request threads per process, the IPFS connection pool is sized to match (default 16)
+    RESSHARE_KV_POOL_SIZE     pooled ResilientDB clients per process (default 4)
+"""
+
+import os
+
+from controller import create_app
+
+
+def _env_int(name: str, default: int = None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+app = create_app(
+    job_workers=_env_int("RESSHARE_JOB_WORKERS"),
+    job_max_queued=_env_int("RESSHARE_JOB_MAX_QUEUED"),
+    http_pool_size=max(16, _env_int("RESSHARE_THREADS", 16)),
+    kv_pool_size=_env_int("RESSHARE_KV_POOL_SIZE"),
+)